@@ -0,0 +1,160 @@
+"""
+Fixtures for the benchmarks.
+
+Engrafo outputs and source tarballs are generated rather than checked in.
+They are deterministic, so results are comparable between commits.
+"""
+import datetime
+import gzip
+import io
+import os
+import random
+import tarfile
+from django.utils import timezone
+import yaml
+from ..papers.models import Paper
+
+SCRAPER_TESTS_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "scraper", "tests"
+)
+
+PARAGRAPH = (
+    "We explored a model for sentiment classification that takes the "
+    "embeddings of the radicals of the Chinese characters, as described in "
+    '<a href="https://arxiv.org/abs/1708.03312">prior work</a> and by '
+    '<a href="mailto:someone@example.com">someone@example.com</a>. The '
+    "results achieved are on par with the character embedding-based models "
+    '<cite class="ltx_cite"><a href="#bib.bib{n}" class="ltx_ref">[{n}]</a></cite>.'
+)
+
+EQUATION = (
+    '<span class="ltx_Math"><math display="inline">'
+    "<semantics><mrow><msub><mi>x</mi><mi>{n}</mi></msub><mo>=</mo>"
+    "<mfrac><mrow><msup><mi>e</mi><mrow><mo>-</mo><mi>λ</mi><mi>t</mi></mrow></msup>"
+    "<mo>+</mo><msqrt><mrow><mi>a</mi><mo>+</mo><mn>{n}</mn></mrow></msqrt></mrow>"
+    "<mrow><munderover><mo>∑</mo><mrow><mi>i</mi><mo>=</mo><mn>1</mn></mrow>"
+    "<mi>N</mi></munderover><msub><mi>w</mi><mi>i</mi></msub></mrow></mfrac>"
+    "</mrow></semantics></math></span>"
+)
+
+FIGURE = (
+    '<figure class="ltx_figure" id="S{section}.F{n}">'
+    '<img src="x{n}.png" class="ltx_graphics" alt="">'
+    '<figcaption class="ltx_caption">Figure {n}: A figure with a '
+    '<a href="#S{section}" class="ltx_ref">reference</a>.</figcaption>'
+    "</figure>"
+)
+
+
+def engrafo_html(sections=5, paragraphs=4, figures=0, equations=0):
+    """
+    Returns an HTML document shaped like Engrafo output, as bytes.
+
+    `figures` and `equations` are the totals for the whole document and are
+    spread evenly across sections.
+    """
+    parts = [
+        "<!DOCTYPE html><html><head>",
+        '<meta charset="utf-8"><title>Benchmark paper</title>',
+        '<link rel="stylesheet" href="index.css">',
+        '<script src="index.js"></script>',
+        "<style>.ltx_figure { margin: 0; }</style>",
+        "</head><body>",
+        '<div class="ltx_page_main"><div class="ltx_page_content">',
+        '<article class="ltx_document">',
+        '<h1 class="ltx_title ltx_title_document">Benchmark paper</h1>',
+        '<div class="ltx_abstract"><p class="ltx_p">An abstract for a '
+        "paper that does not exist.</p></div>",
+    ]
+    for section in range(1, sections + 1):
+        parts.append(f'<section class="ltx_section" id="S{section}">')
+        parts.append(f'<h2 class="ltx_title">{section}. Section</h2>')
+        for n in range(paragraphs):
+            parts.append(f'<p class="ltx_p">{PARAGRAPH.format(n=n)}</p>')
+        for n in _spread(equations, sections, section):
+            parts.append(
+                f'<div class="ltx_para"><p class="ltx_p">Where '
+                f"{EQUATION.format(n=n)} holds.</p></div>"
+            )
+        for n in _spread(figures, sections, section):
+            parts.append(FIGURE.format(n=n, section=section))
+        parts.append("</section>")
+    parts.append("</article></div></div></body></html>")
+    return "\n".join(parts).encode("utf-8")
+
+
+def _spread(total, sections, section):
+    """
+    The numbers out of `total` that belong in a 1-indexed `section`.
+    """
+    return range(section - 1, total, sections)
+
+
+# name -> kwargs for engrafo_html()
+ENGRAFO_OUTPUTS = {
+    "small": {"sections": 5, "paragraphs": 4},
+    "figures": {"sections": 20, "paragraphs": 6, "figures": 200},
+    "math": {"sections": 20, "paragraphs": 6, "equations": 2000},
+    "large": {"sections": 60, "paragraphs": 20, "figures": 200, "equations": 2000},
+}
+
+
+def atom_feeds():
+    """
+    Returns a dictionary of recorded arXiv API responses, keyed by name.
+    """
+    with open(os.path.join(SCRAPER_TESTS_PATH, "test-data.xml"), encoding="utf-8") as f:
+        feeds = {"single": f.read()}
+    # The first page of 100 results recorded for the scraper tests
+    with open(os.path.join(SCRAPER_TESTS_PATH, "fixtures", "query.yaml")) as f:
+        cassette = yaml.safe_load(f)
+    body = cassette["interactions"][0]["response"]["body"]["string"]
+    feeds["page"] = gzip.decompress(body).decode("utf-8")
+    return feeds
+
+
+def papers(num_papers):
+    """
+    Returns a list of unsaved papers, each in a few machine learning
+    categories like those on the paper list.
+    """
+    categories = ["cs.LG", "stat.ML", "cs.CL", "cs.CV", "cs.AI", "cs.NE"]
+    published = datetime.datetime(2018, 1, 1, tzinfo=timezone.utc)
+    return [
+        Paper(
+            arxiv_id=f"1801.{n:05d}",
+            arxiv_version=1,
+            title=f"Paper {n}",
+            published=published,
+            updated=published,
+            summary=PARAGRAPH.format(n=n),
+            arxiv_url=f"https://arxiv.org/abs/1801.{n:05d}",
+            pdf_url=f"https://arxiv.org/pdf/1801.{n:05d}",
+            primary_category=categories[n % len(categories)],
+            categories=[categories[(n + i) % len(categories)] for i in range(3)],
+            authors=[],
+        )
+        for n in range(num_papers)
+    ]
+
+
+def write_tarball(path, num_files, file_size, seed=0):
+    """
+    Write an uncompressed tarball of `num_files` source files of `file_size`
+    bytes, like arXiv's bulk source tarballs.
+    """
+    rand = random.Random(seed)
+    with tarfile.open(path, "w:") as tar:
+        for i in range(num_files):
+            # Random bytes look like compressed data
+            data = rand.getrandbits(file_size * 8).to_bytes(file_size, "little")
+            info = tarfile.TarInfo(f"1801/1801.{i:05d}.gz")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+# name -> kwargs for write_tarball()
+TARBALLS = {
+    "many_small": {"num_files": 2000, "file_size": 1024},
+    "few_large": {"num_files": 10, "file_size": 1024 * 1024},
+}
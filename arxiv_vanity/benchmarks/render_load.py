@@ -0,0 +1,190 @@
+"""
+A load test of the render lifecycle against fake Docker hosts (see
+papers.fake_docker): dispatching renders, updating their state from the
+webhook and the sweep, and reaping containers.
+
+Like the paper_detail benchmarks, the papers and renders are created in a
+transaction that is rolled back afterwards.
+"""
+from contextlib import redirect_stderr
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from ..papers.fake_docker import FakeDockerHost
+from ..papers.models import Paper, Render, SourceFile
+from ..papers.renderer import remove_long_running_containers
+from ..utils import log_exception
+from .fixtures import engrafo_html, papers
+
+
+class Phase:
+    """
+    Times a phase of the load test, and counts the exceptions that were
+    logged during it. Their tracebacks are swallowed, because with a high
+    failure rate there are thousands of them. So are Django's logs of
+    failed requests, which the webhook phase counts itself.
+    """
+
+    def __init__(self, results, name, count=None):
+        self.results = results
+        self.name = name
+        self.count = count
+
+    def __enter__(self):
+        self.stderr = io.StringIO()
+        self.redirect = redirect_stderr(self.stderr)
+        self.redirect.__enter__()
+        logging.getLogger("django.request").disabled = True
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.redirect.__exit__(*exc_info)
+        logging.getLogger("django.request").disabled = False
+        result = {
+            "seconds": seconds,
+            "errors": self.stderr.getvalue().count("Traceback (most recent call last)"),
+        }
+        if self.count is not None:
+            result["renders"] = self.count
+            result["renders_per_second"] = self.count / seconds if seconds else None
+        self.results[self.name] = result
+
+
+def create_renders(num_renders, media_root):
+    """
+    Create unstarted renders of new papers, with Engrafo output already in
+    place so they can be post-processed.
+    """
+    source_files = SourceFile.objects.bulk_create(
+        [
+            SourceFile(arxiv_id=f"load/{n:07d}", file=f"source-files/load-{n}.tar.gz")
+            for n in range(num_renders)
+        ]
+    )
+    new_papers = papers(num_renders)
+    for paper, source_file in zip(new_papers, source_files):
+        paper.arxiv_id = source_file.arxiv_id
+        paper.source_file = source_file
+    new_papers = Paper.objects.bulk_create(new_papers)
+    renders = Render.objects.bulk_create([Render(paper=paper) for paper in new_papers])
+
+    html = engrafo_html(sections=1, paragraphs=1)
+    for render in renders:
+        output_dir = os.path.join(media_root, render.get_output_path())
+        os.makedirs(output_dir)
+        with open(os.path.join(output_dir, "index.html"), "wb") as f:
+            f.write(html)
+    return [render.id for render in renders]
+
+
+def run_render_load_test(
+    num_renders=1000,
+    num_hosts=2,
+    capacity=None,
+    concurrency=10,
+    latency=0,
+    failure_rate=0,
+    run_time=0,
+    exit_failure_rate=0,
+    webhook_fraction=0.5,
+):
+    """
+    Drive `num_renders` renders through `num_hosts` fake Docker hosts, each
+    able to run `capacity` renders at once (by default, all of them).
+
+    1. dispatch: start the renders with run_renders(). Renders that don't
+       fit are left unstarted.
+    2. webhook: `webhook_fraction` of the started renders call the webhook,
+       which records their state.
+    3. sweep: update_state() saves diagnostics, post-processes and removes
+       the containers of all of them, like the cron job. The rest get their
+       state from their containers.
+    4. reap: remove_long_running_containers() across all the hosts.
+
+    Returns a dictionary of results for each phase, and totals.
+    """
+    hosts = [
+        FakeDockerHost(
+            latency=latency,
+            failure_rate=failure_rate,
+            run_time=run_time,
+            exit_failure_rate=exit_failure_rate,
+            seed=i,
+        ).start()
+        for i in range(num_hosts)
+    ]
+    hosts_by_url = {host.url: host for host in hosts}
+    media_root = tempfile.mkdtemp()
+    results = {}
+    try:
+        with override_settings(
+            MEDIA_ROOT=media_root,
+            MEDIA_USE_S3=False,
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            ALLOWED_HOSTS=["testserver"],
+            PAPERS_RENDER_HOSTS={host.url: capacity or num_renders for host in hosts},
+            PAPERS_IMAGE_VARIANT_WIDTHS=[],
+        ), mock.patch.dict(os.environ, {"HOST_PWD": media_root}), transaction.atomic():
+            render_ids = create_renders(num_renders, media_root)
+
+            # Greenlets get their own database connections, which can't see
+            # this transaction, so load everything run_renders() needs first
+            renders = list(
+                Render.objects.filter(id__in=render_ids).select_related(
+                    "paper__source_file"
+                )
+            )
+            with Phase(results, "dispatch", num_renders):
+                started = Render.objects.run_renders(renders, concurrency=concurrency)
+            results["dispatch"]["started"] = len(started)
+
+            # Wait for the containers to exit
+            time.sleep(run_time)
+
+            client = Client()
+            webhook_renders = started[: int(len(started) * webhook_fraction)]
+            with Phase(results, "webhook", len(webhook_renders)):
+                for render in webhook_renders:
+                    host = hosts_by_url[render.host]
+                    container = host.get_container(render.container_id)
+                    exit_code = container["State"]["ExitCode"] if container else 1
+                    # The test client raises exceptions instead of returning
+                    # a 500, which the sweep would retry after
+                    try:
+                        client.post(
+                            reverse("render_update_state", args=(render.id,)),
+                            {"exit_code": exit_code},
+                        )
+                    except Exception:
+                        log_exception()
+
+            remaining = Render.objects.filter(
+                id__in=render_ids, container_is_removed=False
+            ).exclude(state=Render.STATE_UNSTARTED)
+            with Phase(results, "sweep", remaining.count()):
+                remaining.update_state()
+
+            with Phase(results, "reap"):
+                remove_long_running_containers()
+
+            results["states"] = {
+                state: Render.objects.filter(id__in=render_ids, state=state).count()
+                for state, _ in Render._meta.get_field("state").choices
+            }
+            results["docker_requests"] = sum(host.requests for host in hosts)
+            results["docker_failures"] = sum(host.failures for host in hosts)
+            transaction.set_rollback(True)
+    finally:
+        for host in hosts:
+            host.stop()
+        shutil.rmtree(media_root)
+    return results
@@ -0,0 +1,235 @@
+"""
+Benchmarks for the paper serving path.
+
+Each benchmark is a context manager that does its setup, yields a function
+to time and how many bytes that function handles, then tears down.
+Results are plain dictionaries so they can be written as JSON and compared
+between commits.
+"""
+from contextlib import contextmanager
+import io
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.test import Client, RequestFactory, override_settings
+from django.utils import timezone
+from ..papers.models import Paper, Render
+from ..papers.processor import process_render
+from ..scraper.bulk_sources import extract_tarball
+from ..scraper.query import parse
+from .fixtures import (
+    ENGRAFO_OUTPUTS,
+    TARBALLS,
+    atom_feeds,
+    engrafo_html,
+    papers,
+    write_tarball,
+)
+
+BENCHMARK_ARXIV_ID = "9912.99999"
+
+
+@contextmanager
+def bench_process_render(name):
+    html = engrafo_html(**ENGRAFO_OUTPUTS[name])
+    context = {"render": None, "paper": None}
+
+    def run():
+        process_render(io.BytesIO(html), "/media/render-output/1", context)
+
+    yield run, len(html)
+
+
+@contextmanager
+def bench_paper_detail(name):
+    """
+    A full request to paper_detail with the test client, reading the render
+    from local storage. The paper and render are created in a transaction
+    that is rolled back afterwards.
+    """
+    html = engrafo_html(**ENGRAFO_OUTPUTS[name])
+    media_root = tempfile.mkdtemp()
+    try:
+        with override_settings(
+            MEDIA_ROOT=media_root,
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            ALLOWED_HOSTS=["testserver"],
+        ), transaction.atomic():
+            paper = Paper.objects.create(
+                arxiv_id=BENCHMARK_ARXIV_ID,
+                arxiv_version=1,
+                title="Benchmark paper",
+                published=timezone.now(),
+                updated=timezone.now(),
+                summary="",
+                arxiv_url=f"https://arxiv.org/abs/{BENCHMARK_ARXIV_ID}",
+                pdf_url=f"https://arxiv.org/pdf/{BENCHMARK_ARXIV_ID}",
+                primary_category="cs.CL",
+                categories=["cs.CL"],
+                authors=[],
+            )
+            render = Render.objects.create(paper=paper, state=Render.STATE_SUCCESS)
+            output_dir = os.path.join(media_root, render.get_output_path())
+            os.makedirs(output_dir)
+            with open(os.path.join(output_dir, "index.html"), "wb") as f:
+                f.write(html)
+
+            client = Client()
+            url = paper.get_absolute_url()
+
+            def run():
+                response = client.get(url)
+                assert response.status_code == 200, response.status_code
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+
+            yield run, len(html)
+            transaction.set_rollback(True)
+    finally:
+        shutil.rmtree(media_root)
+
+
+@contextmanager
+def bench_paper_list(num_papers):
+    """
+    Render the paper list template for a page of papers, without querying
+    the database.
+    """
+    page = Paginator(papers(num_papers), num_papers).page(1)
+    context = {
+        "object_list": page.object_list,
+        "page_obj": page,
+        "paginator": page.paginator,
+        "is_paginated": False,
+    }
+    request = RequestFactory().get("/")
+
+    def run():
+        return render_to_string("papers/paper_list.html", context, request=request)
+
+    yield run, len(run().encode("utf-8"))
+
+
+@contextmanager
+def bench_parse_feed(name):
+    feed = atom_feeds()[name]
+
+    def run():
+        for _ in parse(feed):
+            pass
+
+    yield run, len(feed.encode("utf-8"))
+
+
+@contextmanager
+def bench_extract_tarball(name):
+    with tempfile.NamedTemporaryFile(suffix=".tar") as tarfh:
+        write_tarball(tarfh.name, **TARBALLS[name])
+        size = os.path.getsize(tarfh.name)
+
+        def run():
+            for _, f in extract_tarball(tarfh.name):
+                f.read()
+
+        yield run, size
+
+
+BENCHMARKS = {}
+for name in ENGRAFO_OUTPUTS:
+    BENCHMARKS[f"process_render.{name}"] = (bench_process_render, name)
+    BENCHMARKS[f"paper_detail.{name}"] = (bench_paper_detail, name)
+BENCHMARKS["paper_list"] = (bench_paper_list, 100)
+for name in ["single", "page"]:
+    BENCHMARKS[f"scraper_parse.{name}"] = (bench_parse_feed, name)
+for name in TARBALLS:
+    BENCHMARKS[f"extract_tarball.{name}"] = (bench_extract_tarball, name)
+
+
+def time_function(func, min_time, min_iterations):
+    """
+    Call `func` repeatedly for at least `min_time` seconds and
+    `min_iterations` times, after one warm-up call. Returns a list of the
+    time each call took.
+    """
+    func()
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < min_iterations or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmark(name, min_time=1.0, min_iterations=5):
+    bench, arg = BENCHMARKS[name]
+    with bench(arg) as (func, size):
+        times = time_function(func, min_time, min_iterations)
+    median = statistics.median(times)
+    return {
+        "iterations": len(times),
+        "bytes": size,
+        "min": min(times),
+        "median": median,
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "mb_per_second": size / median / 1e6 if median else None,
+    }
+
+
+def get_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                stderr=subprocess.DEVNULL,
+                cwd=os.path.dirname(__file__),
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(names=None, min_time=1.0, min_iterations=5, progress=None):
+    """
+    Run benchmarks, by default all of them. Returns a dictionary of results,
+    with some information about the environment they were run in.
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = run_benchmark(name, min_time, min_iterations)
+        if progress:
+            progress(name, results[name])
+    return {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created_at": timezone.now().isoformat(),
+        "results": results,
+    }
+
+
+def compare(baseline, current):
+    """
+    Compare two sets of results. Returns a list of
+    (name, baseline median, current median, percentage change) tuples for
+    benchmarks in both.
+    """
+    rows = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median"]
+        after = result["median"]
+        rows.append((name, before, after, (after - before) / before * 100))
+    return rows
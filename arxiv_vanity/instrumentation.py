@@ -0,0 +1,140 @@
+"""
+Lightweight per-request instrumentation.
+
+Records how long a request spends in the database, reading from storage,
+processing renders and rendering templates, and reports it as a
+`Server-Timing` header and a log line. Turned on with the
+INSTRUMENTATION_ENABLED setting.
+
+Code on the hot path wraps the work it wants measuring in `timer()`. When
+instrumentation is off, or outside of a request, that is a no-op.
+"""
+from contextlib import ExitStack, contextmanager
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# gevent patches threading.local to be local to each greenlet
+_local = threading.local()
+
+
+class Span(object):
+    """
+    A single timed piece of work. Set `size` to record how many bytes it
+    handled.
+    """
+
+    def __init__(self):
+        self.size = 0
+
+
+class Metric(object):
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.duration = 0.0
+        self.size = 0
+
+    def add(self, duration, size=0):
+        self.count += 1
+        self.duration += duration
+        self.size += size
+
+
+class RequestTimings(object):
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, name, duration, size=0):
+        if name not in self.metrics:
+            self.metrics[name] = Metric(name)
+        self.metrics[name].add(duration, size)
+
+    def server_timing_header(self, total):
+        """
+        Format as a `Server-Timing` header, with durations in milliseconds.
+        """
+        parts = []
+        for metric in self.metrics.values():
+            desc = f"{metric.count}x"
+            if metric.size:
+                desc += f" {metric.size} bytes"
+            parts.append(
+                f'{metric.name};dur={metric.duration * 1000:.1f};desc="{desc}"'
+            )
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    def log_fields(self, total):
+        fields = {"total_ms": round(total * 1000, 1)}
+        for metric in self.metrics.values():
+            fields[f"{metric.name}_count"] = metric.count
+            fields[f"{metric.name}_ms"] = round(metric.duration * 1000, 1)
+            if metric.size:
+                fields[f"{metric.name}_bytes"] = metric.size
+        return fields
+
+
+def get_current_timings():
+    return getattr(_local, "timings", None)
+
+
+@contextmanager
+def timer(name):
+    """
+    Time the code inside the block and record it against `name` for the
+    current request.
+    """
+    span = Span()
+    start = time.perf_counter()
+    try:
+        yield span
+    finally:
+        timings = get_current_timings()
+        if timings is not None:
+            timings.add(name, time.perf_counter() - start, span.size)
+
+
+def _time_query(execute, sql, params, many, context):
+    with timer("db"):
+        return execute(sql, params, many, context)
+
+
+class InstrumentationMiddleware(object):
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.timings = timings = RequestTimings()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(_time_query))
+                response = self.get_response(request)
+        finally:
+            _local.timings = None
+        total = time.perf_counter() - start
+
+        response["Server-Timing"] = timings.server_timing_header(total)
+        fields = timings.log_fields(total)
+        fields.update(
+            {
+                "method": request.method,
+                "path": request.path,
+                "status": response.status_code,
+            }
+        )
+        logger.info(
+            "request_timing %s",
+            " ".join(f"{key}={value}" for key, value in fields.items()),
+            extra={"timings": fields},
+        )
+        return response
@@ -1,11 +1,14 @@
+import datetime
 from django.contrib import admin
 from django.template.defaultfilters import truncatechars
+from django.utils import timezone
 from django.utils.html import format_html
 import json
 from .models import (
+    CachedSourceFile,
+    EngrafoImage,
     Paper,
     Render,
-    PaperIsNotRenderableError,
     SourceFile,
     SourceFileBulkTarball,
 )
@@ -45,6 +48,7 @@ class PaperAdmin(admin.ModelAdmin):
     ]
     list_filter = [HasSuccessfulRenderListFilter]
     list_per_page = 250
+    list_select_related = ["source_file"]
     search_fields = ["arxiv_id", "title"]
     raw_id_fields = ("source_file",)
     ordering = ["-updated"]
@@ -52,8 +56,14 @@ class PaperAdmin(admin.ModelAdmin):
         RenderInline,
     ]
 
+    def get_queryset(self, request):
+        # Annotate the columns in list_display so the changelist doesn't do
+        # a query per row
+        qs = super().get_queryset(request)
+        return qs._with_has_successful_render_annotation().with_latest_render()
+
     def has_source_file(self, obj):
-        return bool(obj.source_file)
+        return obj.source_file_id is not None
 
     has_source_file.boolean = True
 
@@ -63,30 +73,27 @@ class PaperAdmin(admin.ModelAdmin):
     is_renderable.boolean = True
 
     def has_successful_render(self, obj):
-        return obj.renders.succeeded().exists()
+        return obj.has_successful_render
 
     has_successful_render.boolean = True
 
     def latest_render(self, obj):
-        try:
-            render = obj.renders.latest()
-        except Render.DoesNotExist:
+        if obj.latest_render_id is None:
             return ""
         return format_html(
-            '<a href="../render/{}/change/">{}</a>', render.id, render.state
+            '<a href="../render/{}/change/">{}</a>',
+            obj.latest_render_id,
+            obj.latest_render_state,
         )
 
     def render(self, request, queryset):
-        rendered = 0
-        not_renderable = 0
-        for paper in queryset:
-            try:
-                paper.render()
-            except PaperIsNotRenderableError:
-                not_renderable += 1
-            else:
-                rendered += 1
-        s = f"{rendered} successfully rendered."
+        # Strip the changelist annotations, they're not needed to render
+        queryset = Paper.objects.filter(pk__in=queryset.values("pk"))
+        renders, not_renderable = queryset.render()
+        s = f"{len(renders)} successfully rendered."
+        failed = queryset.count() - len(renders) - not_renderable
+        if failed > 0:
+            s += f" {failed} failed to start."
         if not_renderable > 0:
             s += f" {not_renderable} not renderable."
         self.message_user(request, s)
@@ -98,8 +105,7 @@ admin.site.register(Paper, PaperAdmin)
 
 
 def mark_as_deleted(modeladmin, request, queryset):
-    for render in queryset:
-        render.mark_as_deleted()
+    queryset.mark_as_deleted()
 
 
 mark_as_deleted.short_description = "Mark selected renders as deleted"
@@ -111,29 +117,54 @@ class RenderAdmin(admin.ModelAdmin):
         "paper_link",
         "state",
         "short_container_id",
+        "duration_ms",
         "is_deleted",
     ]
-    list_filter = ["state", "is_deleted"]
+    list_filter = ["state", "is_deleted", "host", "image_digest"]
     list_per_page = 250
     list_select_related = ["paper"]
     actions = [mark_as_deleted]
 
-    # The fields except the ones we're formatting
+    # The fields, plus the formatted diagnostics
     RENDER_FIELDS = [
-        f.name
-        for f in Render._meta.get_fields()
-        if f.name not in ["container_logs", "container_inspect"]
+        f.name for f in Render._meta.get_fields() if f.name != "diagnostics"
     ] + ["formatted_container_logs", "formatted_container_inspect"]
     fields = RENDER_FIELDS
     readonly_fields = RENDER_FIELDS
+    # Timing stats on the changelist are for renders created in this many days
+    timing_stats_days = 7
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context=extra_context)
+        # Show timing stats for the renders that have been filtered to
+        try:
+            cl = response.context_data["cl"]
+        except (AttributeError, KeyError):
+            # Redirect or error
+            return response
+        # Only recent renders, so the percentiles don't sort the whole table
+        # on every page load
+        recent = cl.queryset.filter(
+            created_at__gt=timezone.now()
+            - datetime.timedelta(days=self.timing_stats_days)
+        )
+        response.context_data["timing"] = recent.succeeded().timing_stats()
+        response.context_data["timing_stats_days"] = self.timing_stats_days
+        return response
 
     def formatted_container_logs(self, obj):
-        return format_html("<pre>{}</pre>", obj.container_logs)
+        diagnostics = obj.get_diagnostics()
+        if diagnostics is None:
+            return None
+        return format_html("<pre>{}</pre>", diagnostics.get_container_logs())
 
     formatted_container_logs.short_description = "Container logs"
 
     def formatted_container_inspect(self, obj):
-        formatted = json.dumps(obj.container_inspect, indent=2)
+        diagnostics = obj.get_diagnostics()
+        if diagnostics is None:
+            return None
+        formatted = json.dumps(diagnostics.container_inspect, indent=2)
         return format_html("<pre>{}</pre>", formatted)
 
     formatted_container_inspect.short_description = "Container inspect"
@@ -179,3 +210,20 @@ class SourceFileAdmin(admin.ModelAdmin):
 
 
 admin.site.register(SourceFile, SourceFileAdmin)
+
+
+class CachedSourceFileAdmin(admin.ModelAdmin):
+    list_display = ["path", "host", "size", "last_used_at"]
+    list_filter = ["host"]
+    search_fields = ["path"]
+
+
+admin.site.register(CachedSourceFile, CachedSourceFileAdmin)
+
+
+class EngrafoImageAdmin(admin.ModelAdmin):
+    list_display = ["digest", "name", "created_at", "is_active", "is_removed"]
+    list_filter = ["is_active", "is_removed"]
+
+
+admin.site.register(EngrafoImage, EngrafoImageAdmin)
@@ -0,0 +1,421 @@
+"""
+A fake Docker daemon, serving just enough of the Docker HTTP API for
+docker-py to run, inspect, list and remove render containers.
+
+It is used by the tests and to load test rendering without a real Docker
+host. Pulling an image gives it an ID that is the same on every host,
+unless the host's `registry` says otherwise. Render containers don't run anything: they exit with a simulated exit
+code after a simulated run time. Other containers exit as soon as they
+start, and `rm` commands are run against volumes, which are dictionaries of
+path -> bytes. Request latency and failures can be simulated too.
+"""
+import datetime
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import os
+import random
+import re
+import struct
+import tarfile
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs, urlparse
+from .renderer import RENDER_LABEL
+
+# Paths are prefixed with the API version, like /v1.35/info
+PATH_RE = re.compile(r"^(?:/v[\d.]+)?(/.*)$")
+CONTAINER_RE = re.compile(r"^/containers/(\w+)(/\w+)?$")
+IMAGE_RE = re.compile(r"^/images/(.+?)(/json)?$")
+
+ZERO_TIME = "0001-01-01T00:00:00Z"
+
+
+def format_time(timestamp):
+    return (
+        datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    # Keep connections open, like the real daemon, so docker-py's connection
+    # pool isn't what is being measured
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def handle_request(self, method):
+        host = self.server.host
+        url = urlparse(self.path)
+        path = PATH_RE.match(url.path).group(1)
+        query = parse_qs(url.query)
+        # Read the body before responding, so the connection can be reused
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length)
+        body = json.loads(data or b"{}") if method == "POST" else None
+
+        host.requests += 1
+        if host.latency:
+            time.sleep(host.latency)
+        if host.failure_rate and host.random.random() < host.failure_rate:
+            host.failures += 1
+            return self.send_json({"message": "simulated failure"}, 500)
+
+        if path == "/_ping":
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"OK")
+            return
+        if path == "/info" and method == "GET":
+            return self.send_json({"ContainersRunning": host.running})
+        if path == "/containers/json" and method == "GET":
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            return self.send_json(
+                host.list_containers(
+                    filters.get("label", []),
+                    stopped=query.get("all") == ["1"],
+                    ancestors=filters.get("ancestor", []),
+                )
+            )
+        if path == "/containers/create" and method == "POST":
+            container = host.create_container(body)
+            return self.send_json({"Id": container["Id"], "Warnings": []}, 201)
+        if path == "/images/create" and method == "POST":
+            name = f"{query['fromImage'][0]}:{query.get('tag', ['latest'])[0]}"
+            host.pull_image(name)
+            return self.send_json({"status": f"Downloaded image for {name}"})
+        if path == "/images/json" and method == "GET":
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            images = list(host.images.values())
+            if filters.get("dangling"):
+                images = [image for image in images if not image["RepoTags"]]
+            return self.send_json(images)
+
+        match = IMAGE_RE.match(path)
+        if match is not None:
+            image_id = host.resolve_image(match.group(1))
+            if image_id is None:
+                return self.send_json({"message": "No such image"}, 404)
+            if match.group(2) and method == "GET":
+                return self.send_json(host.images[image_id])
+            if not match.group(2) and method == "DELETE":
+                if host.image_in_use(image_id):
+                    return self.send_json({"message": "image is being used"}, 409)
+                del host.images[image_id]
+                return self.send_json([{"Deleted": image_id}])
+
+        match = CONTAINER_RE.match(path)
+        if match is None:
+            return self.send_json({"message": f"page not found: {path}"}, 404)
+        container = host.get_container(match.group(1))
+        if container is None:
+            return self.send_json({"message": "No such container"}, 404)
+        action = match.group(2)
+        if action == "/json" and method == "GET":
+            return self.send_json(container)
+        if action == "/start" and method == "POST":
+            host.start_container(container)
+            return self.send_empty()
+        if action == "/wait" and method == "POST":
+            return self.send_json({"StatusCode": container["State"]["ExitCode"]})
+        if action == "/archive" and method == "PUT":
+            host.put_archive(container, query["path"][0], data)
+            return self.send_empty(200)
+        if action == "/stats" and method == "GET":
+            return self.send_json({"memory_stats": {"max_usage": 256 * 1024 * 1024}})
+        if action == "/logs" and method == "GET":
+            # Multiplexed stdout, as containers without a TTY have
+            data = host.logs.get(container["Id"], b"")
+            body = struct.pack(">BxxxL", 1, len(data)) + data if data else b""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if action is None and method == "DELETE":
+            host.remove_container(container["Id"])
+            return self.send_empty()
+        return self.send_json({"message": f"page not found: {path}"}, 404)
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+class FakeDockerHost:
+    """
+    A fake Docker daemon listening on localhost.
+
+    * `latency`: seconds each request takes
+    * `failure_rate`: proportion of requests that fail with a 500
+    * `run_time`: seconds a container runs for before exiting, or None to
+      run until `exit()` is called on it
+    * `exit_failure_rate`: proportion of containers that exit with code 1
+    """
+
+    def __init__(
+        self,
+        latency=0,
+        failure_rate=0,
+        run_time=None,
+        exit_failure_rate=0,
+        seed=0,
+    ):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.run_time = run_time
+        self.exit_failure_rate = exit_failure_rate
+        self.random = random.Random(seed)
+        self.containers = {}
+        self.logs = {}
+        self.volumes = {}
+        # Image ID -> image, and tag -> the ID to pull for it
+        self.images = {}
+        self.registry = {}
+        # Container ID -> (time, exit code) for containers with a run time
+        self.exits = {}
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeDockerHandler)
+        self.server.daemon_threads = True
+        self.server.host = self
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"tcp://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def running(self):
+        return sum(
+            1
+            for container_id in list(self.containers)
+            if (self.get_container(container_id) or {}).get("State", {}).get("Running")
+        )
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_container(self, config):
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        container = {
+            "Id": container_id,
+            "Created": format_time(time.time()),
+            "Config": {
+                "Image": config.get("Image"),
+                "Cmd": config.get("Cmd"),
+                "Labels": config.get("Labels") or {},
+                "Tty": False,
+            },
+            "HostConfig": {
+                "Binds": (config.get("HostConfig") or {}).get("Binds"),
+                "LogConfig": {"Type": "json-file"},
+            },
+            "State": {
+                "Status": "created",
+                "Running": False,
+                "ExitCode": 0,
+                "StartedAt": ZERO_TIME,
+                "FinishedAt": ZERO_TIME,
+            },
+        }
+        with self.lock:
+            self.containers[container_id] = container
+        return container
+
+    def start_container(self, container):
+        now = time.time()
+        container["State"].update(
+            Status="running", Running=True, StartedAt=format_time(now)
+        )
+        if RENDER_LABEL not in container["Config"]["Labels"]:
+            self.run_command(container)
+            self.exit(container["Id"])
+        elif self.run_time is not None:
+            exit_code = 1 if self.random.random() < self.exit_failure_rate else 0
+            self.exits[container["Id"]] = (now + self.run_time, exit_code)
+
+    def get_container(self, container_id):
+        """
+        Returns a container's inspect output, exiting it first if its run
+        time is up.
+        """
+        container = self.containers.get(container_id)
+        if container is not None and container_id in self.exits:
+            exit_at, exit_code = self.exits[container_id]
+            if time.time() >= exit_at:
+                self.exits.pop(container_id, None)
+                self.exit(container_id, exit_code=exit_code, finished_at=exit_at)
+        return container
+
+    def list_containers(self, labels, stopped=False, ancestors=()):
+        """
+        Returns containers in the format of the list containers API, filtered
+        to those with all of `labels`, as "key" or "key=value", and run from
+        one of `ancestors`, if given. Only running containers are returned,
+        unless `stopped` is set.
+        """
+        ancestor_ids = {self.resolve_image(image) for image in ancestors}
+        results = []
+        for container_id in list(self.containers):
+            container = self.get_container(container_id)
+            if container is None:
+                continue
+            if not stopped and not container["State"]["Running"]:
+                continue
+            container_labels = container["Config"]["Labels"]
+            if not all(self._has_label(container_labels, label) for label in labels):
+                continue
+            image_id = self.resolve_image(container["Config"]["Image"] or "")
+            if ancestors and (image_id is None or image_id not in ancestor_ids):
+                continue
+            created = datetime.datetime.fromisoformat(
+                container["Created"].replace("Z", "+00:00")
+            )
+            results.append(
+                {
+                    "Id": container_id,
+                    "Created": int(created.timestamp()),
+                    "Image": container["Config"]["Image"],
+                    "Labels": container_labels,
+                    "State": container["State"]["Status"],
+                }
+            )
+        return results
+
+    def _has_label(self, labels, label):
+        key, _, value = label.partition("=")
+        return key in labels and (not value or labels[key] == value)
+
+    def pull_image(self, name):
+        image_id = self.registry.get(name)
+        if image_id is None:
+            image_id = "sha256:" + hashlib.sha256(name.encode()).hexdigest()
+        # The tag moves to the new image
+        for image in self.images.values():
+            if name in image["RepoTags"]:
+                image["RepoTags"].remove(name)
+        self.images.setdefault(image_id, {"Id": image_id, "RepoTags": []})
+        self.images[image_id]["RepoTags"].append(name)
+
+    def resolve_image(self, name):
+        """
+        Returns the ID of an image from its ID or tag, or None if there
+        isn't one.
+        """
+        if name in self.images:
+            return name
+        if ":" not in name:
+            name += ":latest"
+        for image in self.images.values():
+            if name in image["RepoTags"]:
+                return image["Id"]
+
+    def image_in_use(self, image_id):
+        return any(
+            self.resolve_image(container["Config"]["Image"] or "") == image_id
+            for container in list(self.containers.values())
+        )
+
+    def get_mounts(self, container):
+        """
+        Returns a dictionary of mount point -> volume name for a container.
+        """
+        mounts = {}
+        for bind in container["HostConfig"]["Binds"] or []:
+            volume, mount, *_ = bind.split(":")
+            mounts[mount] = volume
+        return mounts
+
+    def get_volume_path(self, container, path):
+        """
+        Returns the volume and the path in it of a path in a container, or
+        (None, None) if it isn't in a volume.
+        """
+        for mount, volume in self.get_mounts(container).items():
+            if path == mount or path.startswith(mount + "/"):
+                return volume, os.path.relpath(path, mount)
+        return None, None
+
+    def put_archive(self, container, path, data):
+        volume, volume_path = self.get_volume_path(container, path)
+        files = self.volumes.setdefault(volume, {})
+        with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+            for member in tar.getmembers():
+                if member.isfile():
+                    name = os.path.normpath(os.path.join(volume_path, member.name))
+                    files[name] = tar.extractfile(member).read()
+
+    def run_command(self, container):
+        cmd = container["Config"]["Cmd"] or []
+        if cmd[:1] != ["rm"]:
+            return
+        for path in cmd[1:]:
+            if path.startswith("-"):
+                continue
+            volume, volume_path = self.get_volume_path(container, path)
+            files = self.volumes.get(volume, {})
+            for name in list(files):
+                if name == volume_path or name.startswith(volume_path + "/"):
+                    del files[name]
+
+    def remove_container(self, container_id):
+        with self.lock:
+            self.containers.pop(container_id, None)
+            self.logs.pop(container_id, None)
+            self.exits.pop(container_id, None)
+
+    def add_running_container(self, render=True):
+        """
+        Add a container that runs until it is exited. It is a render
+        container, unless `render` is False.
+        """
+        labels = {RENDER_LABEL: "true"} if render else {}
+        container = self.create_container({"Labels": labels})
+        container["State"].update(Status="running", Running=True)
+        return container
+
+    def exit(self, container_id, exit_code=0, logs=b"", finished_at=None):
+        container = self.containers[container_id]
+        container["State"].update(
+            Status="exited",
+            Running=False,
+            ExitCode=exit_code,
+            FinishedAt=format_time(finished_at or time.time()),
+        )
+        self.logs[container_id] = logs
@@ -0,0 +1,93 @@
+"""
+Smaller variants of the images in a render, so browsers on narrow screens
+can load them with srcset instead of the full-size original.
+"""
+import io
+import os
+from django.core.files.base import ContentFile
+from gevent import get_hub
+from gevent.pool import Pool
+from PIL import Image
+from ..storage import storage_overwrite, storage_walk
+from ..utils import catch_exceptions
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif"}
+
+VARIANTS_DIR = "variants"
+
+
+def get_variant_path(path, width):
+    return os.path.join(VARIANTS_DIR, str(width), path)
+
+
+def resize_image(data, widths):
+    """
+    Make variants of an image that are narrower than it. Returns its width,
+    height and a dictionary of width -> encoded variant.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    size = image.width, image.height
+
+    # Resizing animated GIFs would only keep the first frame
+    if image.format not in ("PNG", "JPEG"):
+        return size, {}
+    if image.mode == "P":
+        image = image.convert("RGBA")
+
+    variants = {}
+    for width in widths:
+        if width >= image.width:
+            continue
+        height = round(image.height * width / image.width)
+        variant = image.resize((width, height), Image.LANCZOS)
+        buf = io.BytesIO()
+        variant.save(buf, format=image.format, optimize=True)
+        variants[width] = buf.getvalue()
+    return size, variants
+
+
+def generate_image_variant(storage, output_path, path, widths):
+    """
+    Write variants of an image that are narrower than it. Returns a
+    dictionary of its width, height and variants, as a {width: path}
+    dictionary. Paths are relative to `output_path`.
+
+    Resizing is CPU-bound, so it is done in gevent's threadpool, where it
+    doesn't stop other greenlets running.
+    """
+    with storage.open(os.path.join(output_path, path)) as fh:
+        data = fh.read()
+    (width, height), variants = get_hub().threadpool.apply(resize_image, (data, widths))
+    result = {"width": width, "height": height, "variants": {}}
+    for variant_width, variant_data in variants.items():
+        variant_path = get_variant_path(path, variant_width)
+        storage_overwrite(
+            storage, os.path.join(output_path, variant_path), ContentFile(variant_data)
+        )
+        result["variants"][variant_width] = variant_path
+    return result
+
+
+def generate_image_variants(storage, output_path, widths, concurrency=10):
+    """
+    Write variants of all the images in a render's output. Returns a
+    dictionary of image path -> generate_image_variant() result.
+    """
+    paths = [
+        os.path.relpath(path, output_path)
+        for path in storage_walk(storage, output_path)
+        if os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+    ]
+    paths = [path for path in paths if not path.startswith(VARIANTS_DIR + "/")]
+
+    @catch_exceptions
+    def generate(path):
+        return path, generate_image_variant(storage, output_path, path, widths)
+
+    pool = Pool(concurrency)
+    return {
+        result[0]: result[1]
+        for result in pool.imap_unordered(generate, paths)
+        if result
+    }
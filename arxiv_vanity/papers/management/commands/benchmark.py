@@ -0,0 +1,81 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from ....benchmarks.suite import BENCHMARKS, compare, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = """Benchmark the paper serving path: processing renders, paper_detail
+    end-to-end, parsing arXiv API responses and extracting source tarballs.
+
+    Results are written as JSON. Pass the output of a previous run with
+    --compare to see how the median time of each benchmark has changed.
+
+    paper_detail benchmarks create a paper in the configured database inside
+    a transaction that is rolled back.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            help=f"benchmarks to run (default: all). One of: {', '.join(BENCHMARKS)}",
+        )
+        parser.add_argument(
+            "--output", default=None, help="file to write JSON results to"
+        )
+        parser.add_argument(
+            "--compare", default=None, help="JSON results of a previous run"
+        )
+        parser.add_argument(
+            "--min-time",
+            type=float,
+            default=1.0,
+            help="minimum seconds to run each benchmark for (default: 1)",
+        )
+        parser.add_argument(
+            "--min-iterations",
+            type=int,
+            default=5,
+            help="minimum times to run each benchmark (default: 5)",
+        )
+
+    def handle(self, *args, **options):
+        for name in options["names"]:
+            if name not in BENCHMARKS:
+                raise CommandError(f"Unknown benchmark: {name}")
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                baseline = json.load(f)
+
+        def progress(name, result):
+            print(
+                f"{name}: median {result['median'] * 1000:.2f}ms "
+                f"over {result['iterations']} iterations",
+                file=sys.stderr,
+            )
+
+        results = run_benchmarks(
+            names=options["names"],
+            min_time=options["min_time"],
+            min_iterations=options["min_iterations"],
+            progress=progress,
+        )
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+        else:
+            print(json.dumps(results, indent=2))
+
+        if baseline:
+            print(
+                f"\nCompared to {baseline.get('commit') or options['compare']}:",
+                file=sys.stderr,
+            )
+            for name, before, after, change in compare(baseline, results):
+                print(
+                    f"{name}: {before * 1000:.2f}ms -> {after * 1000:.2f}ms ({change:+.1f}%)",
+                    file=sys.stderr,
+                )
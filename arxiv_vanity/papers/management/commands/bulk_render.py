@@ -7,8 +7,10 @@ from gevent.pool import Pool
 from requests.exceptions import HTTPError, ConnectionError
 from storages.backends.s3boto3 import S3Boto3Storage
 from ....utils import catch_exceptions
-from ...models import SourceFile
-from ...renderer import render_paper
+from ...models import EngrafoImage, SourceFile
+from ...renderer import choose_render_host, render_paper
+
+MANIFEST_SEGMENTS_PREFIX = "manifest-segments/"
 
 
 def keep_on_trying(f, *args, **kwargs):
@@ -33,52 +35,79 @@ def keep_on_trying(f, *args, **kwargs):
 
 
 class BulkRenderer(object):
-    def __init__(self, concurrency, output_bucket):
+    def __init__(self, concurrency, output_bucket, chunk_size=1000, segment_size=100):
         self.concurrency = concurrency
         self.output_bucket = output_bucket
+        self.chunk_size = chunk_size
+        self.segment_size = segment_size
+        # Segments are named after the run so resumed runs don't overwrite them
+        self.run_id = time.strftime("%Y%m%d%H%M%S")
+        self.segments_written = 0
 
-    def run(self, id_filename):
+    def run(self, id_filename, resume=False):
         s3 = S3Boto3Storage().connection
         obj = s3.Object(self.output_bucket, id_filename)
         arxiv_id_str = obj.get()["Body"].read().decode("utf-8")
         arxiv_ids = [s.strip() for s in arxiv_id_str.split() if s.strip()]
 
+        if resume:
+            rendered_ids = {r["arxiv_id"] for r in self.read_manifest_segments()}
+            print(f"Skipping {len(rendered_ids)} already rendered IDs")
+            arxiv_ids = [i for i in arxiv_ids if i not in rendered_ids]
+
         # We can't access database inside our gevent pool because of max
         # connections, so first figure out which IDs we actually want to
         # render.
         arxiv_ids, source_paths = self.filter_unrenderable_ids(arxiv_ids)
 
-        # Stagger the starting of jobs a bit so we don't break Hyper.sh
-        def slow_arxiv_ids():
-            for arxiv_id in arxiv_ids:
-                yield arxiv_id
-                time.sleep(0.1)
+        self.image = EngrafoImage.objects.get_active_digest()
 
+        # Write the manifest in segments as renders finish so a crash doesn't
+        # lose all the work done so far
         pool = Pool(self.concurrency)
-        manifest = pool.imap_unordered(self.render, slow_arxiv_ids(), source_paths)
-        # Failed renders are None
-        manifest = (obj for obj in manifest if obj)
-        # Read the iterator, starting the actual processing
-        manifest = list(manifest)
+        segment = []
+        for result in pool.imap_unordered(self.render, arxiv_ids, source_paths):
+            # Failed renders are None
+            if not result:
+                continue
+            segment.append(result)
+            if len(segment) >= self.segment_size:
+                self.write_manifest_segment(segment)
+                segment = []
+        if segment:
+            self.write_manifest_segment(segment)
+
+        # A resumed run carries on from the runs before it, so its manifest
+        # includes them
+        if resume:
+            manifest = self.read_manifest_segments()
+        else:
+            manifest = self.read_manifest_segments(run_id=self.run_id)
         self.write_manifest(manifest)
 
     def filter_unrenderable_ids(self, arxiv_ids):
         ids_to_render = []
         source_paths = []
-        for arxiv_id in arxiv_ids:
-            try:
-                source_file = SourceFile.objects.get(arxiv_id=arxiv_id)
-            except SourceFile.DoesNotExist:
-                print(f"{arxiv_id} has no source file, skipping")
-                continue
-
-            if source_file.is_pdf():
-                print(f"{arxiv_id} source is a PDF, skipping")
-                continue
-
-            ids_to_render.append(arxiv_id)
-            source_paths.append(source_file.file.name)
-        return arxiv_ids, source_paths
+        for i in range(0, len(arxiv_ids), self.chunk_size):
+            chunk = arxiv_ids[i : i + self.chunk_size]
+            source_files = dict(
+                SourceFile.objects.filter(arxiv_id__in=chunk).values_list(
+                    "arxiv_id", "file"
+                )
+            )
+            for arxiv_id in chunk:
+                source_path = source_files.get(arxiv_id)
+                if source_path is None:
+                    print(f"{arxiv_id} has no source file, skipping")
+                    continue
+
+                if SourceFile(file=source_path).is_pdf():
+                    print(f"{arxiv_id} source is a PDF, skipping")
+                    continue
+
+                ids_to_render.append(arxiv_id)
+                source_paths.append(source_path)
+        return ids_to_render, source_paths
 
     @catch_exceptions
     def render(self, arxiv_id, source_path):
@@ -89,9 +118,12 @@ class BulkRenderer(object):
             source=source_path,
             output_path=output_path,
             output_bucket=self.output_bucket,
+            arxiv_id=arxiv_id,
+            host=choose_render_host(),
+            image=self.image,
         )
         try:
-            exit_code = keep_on_trying(container.wait)
+            result = keep_on_trying(container.wait)
         finally:
             try:
                 container.kill()
@@ -102,9 +134,39 @@ class BulkRenderer(object):
             except Exception:
                 pass
 
-        if exit_code == 0:
+        # Container.wait() returns the API response, or None if we gave up
+        if result and result["StatusCode"] == 0:
             return {"arxiv_id": arxiv_id, "output_path": output_path}
 
+    def write_manifest_segment(self, segment):
+        s3 = S3Boto3Storage().connection
+        self.segments_written += 1
+        key = (
+            f"{MANIFEST_SEGMENTS_PREFIX}{self.run_id}-{self.segments_written:05d}.json"
+        )
+        s3.Object(self.output_bucket, key).put(Body=json.dumps(segment, indent=2))
+        print(f"Wrote {len(segment)} renders to {key}", file=sys.stderr)
+
+    def read_manifest_segments(self, run_id=None):
+        """
+        Returns the renders recorded in manifest segments in the bucket by
+        the run `run_id`, or by all runs if it is None. If a paper was
+        rendered more than once, only the latest render is returned.
+        """
+        s3 = S3Boto3Storage().connection
+        bucket = s3.Bucket(self.output_bucket)
+        prefix = MANIFEST_SEGMENTS_PREFIX
+        if run_id is not None:
+            prefix += f"{run_id}-"
+        # Segments are listed in key order, which is the order they were
+        # written in, so later renders replace earlier ones
+        renders = {}
+        for obj in bucket.objects.filter(Prefix=prefix):
+            for render in json.loads(obj.get()["Body"].read().decode("utf-8")):
+                renders.pop(render["arxiv_id"], None)
+                renders[render["arxiv_id"]] = render
+        return list(renders.values())
+
     def write_manifest(self, manifest):
         s3 = S3Boto3Storage().connection
         manifest_json = json.dumps(manifest, indent=2)
@@ -121,9 +183,21 @@ class Command(BaseCommand):
         parser.add_argument(
             "id_filename", nargs=1, help="File in S3 containing arXiv IDs."
         )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=500,
+            help="number of parallel renders to run (default: 500)",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="skip IDs that have already been rendered to the bucket by a previous run",
+        )
 
     def handle(self, *args, **options):
         renderer = BulkRenderer(
-            concurrency=500, output_bucket=options["output_bucket"][0]
+            concurrency=options["concurrency"],
+            output_bucket=options["output_bucket"][0],
         )
-        renderer.run(options["id_filename"][0])
+        renderer.run(options["id_filename"][0], resume=options["resume"])
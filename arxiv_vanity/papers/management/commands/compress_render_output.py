@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from ...models import Render
+
+
+class Command(BaseCommand):
+    help = "Gzip the text files in the output of successful renders, for renders that succeeded before this was done automatically. Can be resumed with --start if it is interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=int, default=0, help="ID to start at")
+
+    def handle(self, *args, **options):
+        renders = (
+            Render.objects.succeeded()
+            .not_deleted()
+            .filter(id__gte=options["start"])
+            .order_by("id")
+        )
+        for render in renders.iterator():
+            num_compressed = render.compress_output()
+            print(f"{render.id}: compressed {num_compressed} files", flush=True)
+        print("Done")
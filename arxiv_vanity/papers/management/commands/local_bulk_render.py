@@ -1,42 +1,187 @@
+import os
 import sys
+import time
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
+from gevent.lock import Semaphore
 from gevent.pool import Pool
 from ....utils import catch_exceptions
-from ...renderer import render_paper
+from ...models import EngrafoImage
+from ...renderer import create_client, render_paper
+
+
+SIZE_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+
+
+def parse_size(s):
+    """
+    Parse a size like "512m" or "2g" into bytes.
+    """
+    s = s.strip().lower()
+    if s and s[-1] in SIZE_UNITS:
+        return int(float(s[:-1]) * SIZE_UNITS[s[-1]])
+    return int(s)
+
+
+def get_available_memory():
+    """
+    Returns the memory available on this machine in bytes, or None if it
+    can't be found out. This includes memory used outside Docker, which
+    the tally of started renders doesn't.
+    """
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def docker_host_is_local():
+    host = os.environ.get("DOCKER_HOST")
+    return not host or host.startswith("unix://")
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
 
 
 class BulkRenderer(object):
-    def __init__(self, concurrency, output_bucket):
+    def __init__(
+        self,
+        concurrency,
+        output_bucket,
+        cpus_per_render,
+        memory_per_render,
+        min_free_memory,
+        timeout,
+        memory_poll_interval=5,
+    ):
         self.concurrency = concurrency
         self.output_bucket = output_bucket
+        self.cpus_per_render = cpus_per_render
+        self.memory_per_render = memory_per_render
+        self.min_free_memory = min_free_memory
+        self.timeout = timeout
+        self.memory_poll_interval = memory_poll_interval
+        self.memory_total = create_client().info()["MemTotal"]
+        # Memory limits of the renders that have been started and haven't
+        # finished. A render doesn't use its memory straight away, so this
+        # is counted as well as what the machine reports as available.
+        self.memory_reserved = 0
+        # Held while checking for and reserving memory, which doesn't call
+        # Docker, so only the render at the front of the queue polls
+        self.memory_lock = Semaphore()
 
     def run(self, arxiv_ids):
-        print(f"Rendering {len(arxiv_ids)} arXiv IDs...")
+        print(
+            f"Rendering {len(arxiv_ids)} arXiv IDs, {self.concurrency} at a time...",
+            file=sys.stderr,
+        )
+        start_time = time.monotonic()
+        self.image = EngrafoImage.objects.get_active_digest()
         pool = Pool(self.concurrency)
         done = 0
+        succeeded = 0
+        durations = []
         for result in pool.imap_unordered(self.render, arxiv_ids):
+            done += 1
             if not result:
                 continue
-            arxiv_id, exit_code = result
+            arxiv_id, exit_code, duration = result
+            durations.append(duration)
             if exit_code == 0:
                 status = "success"
+                succeeded += 1
             else:
                 status = "failure"
-            done += 1
-            print(f"{arxiv_id}: {status} ({done} of {len(arxiv_ids)})", file=sys.stderr)
+            print(
+                f"{arxiv_id}: {status} in {duration:.1f}s ({done} of {len(arxiv_ids)})",
+                file=sys.stderr,
+            )
+        self.print_stats(durations, succeeded, time.monotonic() - start_time)
+
+    def memory_available(self):
+        available = self.memory_total - self.memory_reserved
+        if docker_host_is_local():
+            machine_available = get_available_memory()
+            if machine_available is not None:
+                available = min(available, machine_available)
+        return available
+
+    def reserve_memory(self):
+        """
+        Wait until the Docker host is not under memory pressure, then
+        reserve memory for a render.
+        """
+        with self.memory_lock:
+            while True:
+                available = self.memory_available()
+                if available >= self.min_free_memory:
+                    self.memory_reserved += self.memory_per_render
+                    return
+                print(
+                    f"Only {available // SIZE_UNITS['m']}MB memory available, waiting...",
+                    file=sys.stderr,
+                )
+                time.sleep(self.memory_poll_interval)
 
     @catch_exceptions
     def render(self, arxiv_id):
         output_path = arxiv_id.replace("/", "")
-        container = render_paper(
-            source=f"source-files/{output_path}.gz",
-            output_path=output_path,
-            output_bucket=self.output_bucket,
-            extra_run_kwargs={"remove": True},
+        self.reserve_memory()
+        try:
+            start_time = time.monotonic()
+            container = render_paper(
+                source=f"source-files/{output_path}.gz",
+                output_path=output_path,
+                output_bucket=self.output_bucket,
+                arxiv_id=arxiv_id,
+                image=self.image,
+                extra_run_kwargs={
+                    "remove": True,
+                    "nano_cpus": int(self.cpus_per_render * 1e9),
+                    "mem_limit": self.memory_per_render,
+                },
+            )
+            result = container.wait(timeout=self.timeout)
+        finally:
+            self.memory_reserved -= self.memory_per_render
+        return arxiv_id, result["StatusCode"], time.monotonic() - start_time
+
+    def print_stats(self, durations, succeeded, elapsed):
+        print(
+            f"Rendered {len(durations)} papers ({succeeded} successful) in {elapsed:.0f}s",
+            file=sys.stderr,
+        )
+        if not durations:
+            return
+        durations = sorted(durations)
+        print(
+            f"Throughput: {len(durations) / elapsed * 60:.1f} renders per minute",
+            file=sys.stderr,
         )
-        exit_code = container.wait(timeout=30 * 60)
-        return arxiv_id, exit_code
+        print(
+            f"Render time: mean {sum(durations) / len(durations):.1f}s, "
+            f"p50 {percentile(durations, 50):.1f}s, "
+            f"p95 {percentile(durations, 95):.1f}s, "
+            f"max {durations[-1]:.1f}s",
+            file=sys.stderr,
+        )
+
+
+def default_concurrency(cpus_per_render, memory_per_render):
+    """
+    Number of renders that fit on the Docker host, given the CPU and memory
+    limit of each render.
+    """
+    info = create_client().info()
+    by_cpu = int(info["NCPU"] / cpus_per_render)
+    by_memory = int(info["MemTotal"] / memory_per_render)
+    return max(1, min(by_cpu, by_memory))
 
 
 class Command(BaseCommand):
@@ -56,8 +201,30 @@ class Command(BaseCommand):
         parser.add_argument(
             "--concurrency",
             type=int,
-            default=10,
-            help="number of parallel instances to run (default: 10)",
+            default=None,
+            help="number of parallel instances to run (default: as many as fit in the Docker host's CPUs and memory)",
+        )
+        parser.add_argument(
+            "--cpus-per-render",
+            type=float,
+            default=1.0,
+            help="CPU limit for each render (default: 1)",
+        )
+        parser.add_argument(
+            "--memory-per-render",
+            default="2g",
+            help="memory limit for each render (default: 2g)",
+        )
+        parser.add_argument(
+            "--min-free-memory",
+            default="1g",
+            help="don't start renders when the Docker host has less memory than this left, after the memory limits of running renders and, if it is this machine, what is in use (default: 1g)",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=int,
+            default=30 * 60,
+            help="seconds to wait for each render (default: 1800)",
         )
 
     def handle(self, *args, **options):
@@ -65,9 +232,25 @@ class Command(BaseCommand):
             raise CommandError(
                 "MEDIA_USE_S3 is False. This command is designed to work with S3."
             )
+        try:
+            memory_per_render = parse_size(options["memory_per_render"])
+            min_free_memory = parse_size(options["min_free_memory"])
+        except ValueError as e:
+            raise CommandError(f"Invalid size: {e}")
+
+        concurrency = options["concurrency"]
+        if concurrency is None:
+            concurrency = default_concurrency(
+                options["cpus_per_render"], memory_per_render
+            )
+
         renderer = BulkRenderer(
-            concurrency=options["concurrency"],
+            concurrency=concurrency,
             output_bucket=options["output_bucket"][0],
+            cpus_per_render=options["cpus_per_render"],
+            memory_per_render=memory_per_render,
+            min_free_memory=min_free_memory,
+            timeout=options["timeout"],
         )
 
         arxiv_ids = []
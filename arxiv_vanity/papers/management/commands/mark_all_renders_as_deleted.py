@@ -3,9 +3,24 @@ from ...models import Render
 
 
 class Command(BaseCommand):
-    help = "Marks all renders as deleted so they will be rerendered. WARNING! This is old and will likely not work any longer. Also very slow..."
+    help = "Marks all renders as deleted so they will be rerendered. Can be resumed with --start if it is interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=int, default=0, help="ID to start at")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="number of render outputs to delete in parallel (default: 10)",
+        )
 
     def handle(self, *args, **options):
-        qs = Render.objects.defer("container_inspect", "container_logs").not_deleted()
-        qs.mark_as_deleted()
+        def progress(pointer):
+            print(f"✅  Renders up to {pointer} marked as deleted", flush=True)
+
+        Render.objects.not_deleted().mark_as_deleted(
+            start=options["start"],
+            concurrency=options["concurrency"],
+            progress=progress,
+        )
         print(f"Done")
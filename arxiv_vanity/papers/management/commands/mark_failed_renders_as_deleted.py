@@ -5,11 +5,13 @@ from ...models import Render
 class Command(BaseCommand):
     help = "Marks all failed renders as deleted so they will be rerendered"
 
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=int, default=0, help="ID to start at")
+
     def handle(self, *args, **options):
-        qs = (
-            Render.objects.defer("container_inspect", "container_logs")
-            .failed()
-            .not_deleted()
-        )
-        qs.mark_as_deleted()
+        def progress(pointer):
+            print(f"✅  Renders up to {pointer} marked as deleted", flush=True)
+
+        qs = Render.objects.failed().not_deleted()
+        qs.mark_as_deleted(start=options["start"], progress=progress)
         print(f"Done")
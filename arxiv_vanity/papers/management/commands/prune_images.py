@@ -1,9 +1,17 @@
 from django.core.management.base import BaseCommand, CommandError
+from ...models import EngrafoImage
 from ...renderer import prune_images
 
 
 class Command(BaseCommand):
-    help = "Prune unused images from Docker server"
+    help = """Remove old Engrafo images that no running render uses, then
+    other unused images, from all render hosts"""
 
     def handle(self, *args, **options):
-        prune_images()
+        for image in EngrafoImage.objects.prune():
+            print(f"Removed {image}")
+        # Dangling images include deployed ones that are still in use
+        keep = EngrafoImage.objects.filter(is_removed=False).values_list(
+            "digest", flat=True
+        )
+        prune_images(keep=set(keep))
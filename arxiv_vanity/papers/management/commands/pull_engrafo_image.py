@@ -1,10 +1,15 @@
 from django.core.management.base import BaseCommand, CommandError
-from ...renderer import pull_image
+from ...models import EngrafoImage, EngrafoImageError
 
 
 class Command(BaseCommand):
-    help = "Pull the configured Engrafo image"
+    help = """Pull the configured Engrafo image on all render hosts in
+    parallel, then switch new renders to run with it, pinned to its ID.
+    Existing renders are kept. To replace them, run rerender --older-image."""
 
     def handle(self, *args, **options):
-        image = pull_image()
-        print(f"Pulled {image.attrs['Id']}")
+        try:
+            image = EngrafoImage.objects.deploy()
+        except EngrafoImageError as e:
+            raise CommandError(str(e))
+        print(f"Renders now run with {image.digest} ({image.name})")
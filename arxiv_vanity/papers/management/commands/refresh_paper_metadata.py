@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from ...models import Paper
+
+
+class Command(BaseCommand):
+    help = "Update papers that have been rendered from arXiv's API, so new versions of them are re-rendered the next time they are viewed. Can be resumed with --start if it is interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=int, default=0, help="ID to start at")
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=100,
+            help="number of papers to query arXiv for at once (default: 100)",
+        )
+
+    def handle(self, *args, **options):
+        def progress(pointer, new_versions):
+            print(
+                f"✅  Papers up to {pointer} updated ({new_versions} new versions)",
+                flush=True,
+            )
+
+        total = Paper.objects.has_not_deleted_render().refresh_from_arxiv(
+            start=options["start"],
+            chunk_size=options["chunk_size"],
+            progress=progress,
+        )
+        print(f"Done. {total} new versions")
@@ -0,0 +1,86 @@
+import json
+import sys
+from django.core.management.base import BaseCommand
+from ....benchmarks.render_load import run_render_load_test
+
+
+class Command(BaseCommand):
+    help = """Load test dispatching renders and updating their state, against
+    fake Docker hosts running on localhost.
+
+    Renders are started with run_renders(), half call the webhook, then
+    the update_render_state sweep collects all of them and long-running
+    containers are reaped. Prints the throughput of each phase
+    as JSON.
+
+    Papers and renders are created in the configured database inside a
+    transaction that is rolled back.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--renders", type=int, default=1000, help="number of renders"
+        )
+        parser.add_argument(
+            "--hosts", type=int, default=2, help="number of fake Docker hosts"
+        )
+        parser.add_argument(
+            "--capacity",
+            type=int,
+            default=None,
+            help="renders each host can run at once (default: all of them)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="renders to start in parallel (default: 10)",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0,
+            help="seconds each Docker API request takes",
+        )
+        parser.add_argument(
+            "--failure-rate",
+            type=float,
+            default=0,
+            help="proportion of Docker API requests that fail",
+        )
+        parser.add_argument(
+            "--run-time",
+            type=float,
+            default=0,
+            help="seconds each render runs for",
+        )
+        parser.add_argument(
+            "--exit-failure-rate",
+            type=float,
+            default=0.1,
+            help="proportion of renders that fail (default: 0.1)",
+        )
+        parser.add_argument(
+            "--output", default=None, help="file to write JSON results to"
+        )
+
+    def handle(self, *args, **options):
+        print(
+            f"Running {options['renders']} renders on {options['hosts']} hosts...",
+            file=sys.stderr,
+        )
+        results = run_render_load_test(
+            num_renders=options["renders"],
+            num_hosts=options["hosts"],
+            capacity=options["capacity"],
+            concurrency=options["concurrency"],
+            latency=options["latency"],
+            failure_rate=options["failure_rate"],
+            run_time=options["run_time"],
+            exit_failure_rate=options["exit_failure_rate"],
+        )
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(results, f, indent=2)
+        else:
+            print(json.dumps(results, indent=2))
@@ -1,26 +1,249 @@
+import datetime
 import time
-import docker.errors
+from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from ...models import Paper, Render
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from ....utils import log_exception
+from ...models import EngrafoImage, Paper, PaperIsNotRenderableError, Render
+from ...renderer import TooManyRendersRunningError
+
+
+class Rerenderer(object):
+    """
+    Rerenders papers that have a render, keeping `concurrency` renders in
+    flight at a time.
+
+    Papers are streamed from the database in chunks using keyset pagination,
+    so it can be stopped and resumed from the last printed position.
+    Papers that have been rendered since `started_at` are skipped, so a
+    resumed run should be given the time the first run started.
+    """
+
+    def __init__(
+        self,
+        concurrency,
+        order,
+        older_image=False,
+        started_at=None,
+        chunk_size=1000,
+        poll_interval=5,
+    ):
+        self.concurrency = concurrency
+        self.order = order
+        self.older_image = older_image
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.started_at = started_at or timezone.now()
+        self.in_flight = set()
+        self.position = None
+
+    def run(self, start=None):
+        for position, paper in self.candidates(start):
+            self.wait_for_capacity()
+            if self.render(paper):
+                print(
+                    f"{paper.arxiv_id}: started ({len(self.in_flight)} in flight, position {position})",
+                    flush=True,
+                )
+            self.position = position
+        while self.in_flight:
+            self.wait()
+            self.update_in_flight()
+
+    def render(self, paper):
+        """
+        Start a render of a paper, waiting for space if too many renders are
+        running. Returns whether the render was started.
+        """
+        while True:
+            try:
+                render = paper.render()
+            except PaperIsNotRenderableError:
+                print(f"{paper.arxiv_id}: not renderable, skipping", flush=True)
+                return False
+            except TooManyRendersRunningError:
+                # Something else is rendering too, so wait for space
+                self.wait()
+                self.update_in_flight()
+                continue
+            except Exception:
+                log_exception()
+                return False
+            self.in_flight.add(render.id)
+            return True
+
+    def wait_for_capacity(self):
+        self.update_in_flight()
+        while len(self.in_flight) >= self.concurrency:
+            self.wait()
+            self.update_in_flight()
+
+    def wait(self):
+        time.sleep(self.poll_interval)
+
+    def update_in_flight(self):
+        """
+        Drop renders that have finished from the set of renders in flight.
+
+        Renders report their state with the webhook. Renders that have been
+        running for longer than PAPERS_MAX_RENDER_TIME_MINS are dropped too,
+        because update_render_state will remove their containers.
+        """
+        if not self.in_flight:
+            return
+        cutoff = timezone.now() - datetime.timedelta(
+            minutes=settings.PAPERS_MAX_RENDER_TIME_MINS
+        )
+        running = Render.objects.filter(
+            id__in=self.in_flight,
+            state__in=[Render.STATE_UNSTARTED, Render.STATE_RUNNING],
+            created_at__gt=cutoff,
+        )
+        self.in_flight = set(running.values_list("id", flat=True))
+
+    def renders(self):
+        """
+        The renders whose papers are rendered again.
+        """
+        renders = Render.objects.not_deleted()
+        if self.older_image:
+            renders = renders.made_with_older_image()
+        return renders
+
+    def candidates(self, start=None):
+        """
+        Returns an iterator of (position, paper) tuples of papers to render.
+        """
+        if self.order == "rendered":
+            return self.candidates_by_latest_render(start)
+        return self.candidates_by_updated(start)
+
+    def candidates_by_latest_render(self, start=None):
+        """
+        Papers ordered by their latest render, newest first. Renders are kicked
+        off when a paper is viewed, so this puts recently viewed papers first.
+
+        The position is a render ID.
+        """
+        pointer = start
+        while True:
+            renders = self.renders().order_by("-id")
+            if pointer is not None:
+                renders = renders.filter(id__lt=pointer)
+            chunk = list(renders.values_list("id", "paper_id")[: self.chunk_size])
+            if not chunk:
+                break
+            paper_ids = {paper_id for _, paper_id in chunk}
+            # Papers with several undeleted renders, or that have been
+            # rendered by this run, or the run it resumes, already
+            already_rendered = set(
+                Render.objects.filter(
+                    paper_id__in=paper_ids, created_at__gte=self.started_at
+                ).values_list("paper_id", flat=True)
+            )
+            papers = Paper.objects.select_related("source_file").in_bulk(paper_ids)
+            for render_id, paper_id in chunk:
+                pointer = render_id
+                if paper_id in already_rendered or paper_id not in papers:
+                    continue
+                already_rendered.add(paper_id)
+                yield render_id, papers[paper_id]
+
+    def candidates_by_updated(self, start=None):
+        """
+        Papers ordered by when they were last updated on arXiv, newest first.
+
+        The position is a paper ID.
+        """
+        qs = (
+            Paper.objects.filter(pk__in=self.renders().values("paper_id"))
+            .select_related("source_file")
+            .order_by("-updated", "-id")
+        )
+        pointer = None
+        if start is not None:
+            pointer = Paper.objects.get(pk=start)
+        while True:
+            chunk = qs
+            if pointer is not None:
+                chunk = chunk.filter(
+                    Q(updated__lt=pointer.updated)
+                    | Q(updated=pointer.updated, id__lt=pointer.id)
+                )
+            chunk = list(chunk[: self.chunk_size])
+            if not chunk:
+                break
+            for paper in chunk:
+                pointer = paper
+                yield paper.id, paper
 
 
 class Command(BaseCommand):
-    help = "Rerender all papers which have a render that has not expired. You might want to do ./manage.py mark_all_renders_as_expired instead"
+    help = "Rerender all papers which have a render that has not been deleted, keeping a fixed number of renders running. You might want to do ./manage.py mark_all_renders_as_deleted instead"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--order",
+            choices=["rendered", "recent"],
+            default="rendered",
+            help="rendered renders papers that were rendered most recently first, recent renders papers updated on arXiv most recently first (default: rendered)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.PAPERS_MAX_RENDERS_RUNNING // 2,
+            help="number of renders to keep running, leaving room for renders started by visitors (default: half of PAPERS_MAX_RENDERS_RUNNING)",
+        )
+        parser.add_argument(
+            "--start",
+            type=int,
+            default=None,
+            help="position to resume from, as printed by a previous run",
+        )
+        parser.add_argument(
+            "--started-at",
+            default=None,
+            help="skip papers rendered since this ISO 8601 time. Pass the time a run started, as printed by it, when resuming it (default: now)",
+        )
+        parser.add_argument(
+            "--older-image",
+            action="store_true",
+            help="only rerender papers that haven't been rendered with the active Engrafo image, such as after pull_engrafo_image",
+        )
 
     def handle(self, *args, **options):
-        print("Rendering papers", end="")
-        for i, paper in enumerate(Paper.objects.has_not_deleted_render()):
-            paper.render()
-            print(".", end="", flush=True)
-
-            # Update render state periodically so we don't create too many
-            # containers
-            if i % 100 == 99:
-                print()
-                print("Updating render state...")
-                Render.objects.update_state()
-                print("Rendering papers", end="")
-        print()
-        time.sleep(10)
-        print("Updating render state...")
-        Render.objects.update_state()
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1")
+        started_at = None
+        if options["started_at"] is not None:
+            started_at = parse_datetime(options["started_at"])
+            if started_at is None:
+                raise CommandError("--started-at must be an ISO 8601 time")
+            if timezone.is_naive(started_at):
+                started_at = timezone.make_aware(started_at)
+        if options["older_image"] and EngrafoImage.objects.get_active_digest() is None:
+            raise CommandError(
+                "No Engrafo image has been deployed. Run pull_engrafo_image first."
+            )
+        rerenderer = Rerenderer(
+            concurrency=options["concurrency"],
+            order=options["order"],
+            older_image=options["older_image"],
+            started_at=started_at,
+        )
+        print(f"Skipping papers rendered since {rerenderer.started_at.isoformat()}")
+        try:
+            rerenderer.run(start=options["start"])
+        except KeyboardInterrupt:
+            if rerenderer.position is not None:
+                resume_args = (
+                    f"--order {options['order']} --start {rerenderer.position} "
+                    f"--started-at {rerenderer.started_at.isoformat()}"
+                )
+                if options["older_image"]:
+                    resume_args += " --older-image"
+                print(f"Stopped. Resume with {resume_args}")
+            raise
+        print("Done")
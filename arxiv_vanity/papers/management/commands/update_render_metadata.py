@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from ...models import Render
+
+
+class Command(BaseCommand):
+    help = "Extract the abstract, first image, word count, figure count and outline of successful renders that don't have them. Can be resumed with --start if it is interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=int, default=0, help="ID to start at")
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=10,
+            help="number of renders to process in parallel (default: 10)",
+        )
+
+    def handle(self, *args, **options):
+        def progress(pointer, num_processed):
+            print(
+                f"✅  Renders up to {pointer} updated ({num_processed} processed)",
+                flush=True,
+            )
+
+        Render.objects.succeeded().not_deleted().filter(
+            word_count=None
+        ).update_metadata(
+            start=options["start"],
+            concurrency=options["concurrency"],
+            progress=progress,
+        )
+        print("Done")
@@ -6,8 +6,15 @@ from ...renderer import remove_long_running_containers
 class Command(BaseCommand):
     help = "Sync the state of renders in the database with what is on Docker"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--include-unlabelled",
+            action="store_true",
+            help="also remove old Engrafo containers started before render containers were labelled. Only needed once, after upgrading.",
+        )
+
     def handle(self, *args, **options):
         print("Updating state...")
         Render.objects.update_state()
         print("Removing long running containers...")
-        remove_long_running_containers()
+        remove_long_running_containers(include_unlabelled=options["include_unlabelled"])
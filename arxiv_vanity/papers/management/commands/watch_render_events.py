@@ -0,0 +1,68 @@
+import time
+from django.core.management.base import BaseCommand
+import docker.errors
+import gevent
+import requests.exceptions
+from ....utils import log_exception
+from ...models import Render
+from ...renderer import get_render_hosts, render_events
+
+MAX_RECONNECT_DELAY = 60
+
+
+def watch_host(host):
+    """
+    Update the state of renders on a Docker host from its events stream,
+    reconnecting if it is lost.
+    """
+    name = host or "DOCKER_HOST"
+    since = None
+    delay = 1
+    while True:
+        try:
+            # Connect first, so events during the catch-up are buffered
+            events = render_events(host=host, since=since)
+            if since is None:
+                print(f"{name}: catching up...", flush=True)
+                Render.objects.filter(host=host).update_state()
+            print(f"{name}: watching for render events...", flush=True)
+            delay = 1
+            for event in events:
+                # Events in the same second may be replayed, but updating
+                # state twice is harmless
+                since = event["time"]
+                try:
+                    render = Render.objects.update_state_from_event(event)
+                except Exception:
+                    log_exception()
+                    continue
+                if render is not None:
+                    print(
+                        f"{name}: render {render.id} {event['Action']}: {render.state}",
+                        flush=True,
+                    )
+        except (
+            docker.errors.DockerException,
+            requests.exceptions.RequestException,
+        ):
+            log_exception()
+        print(f"{name}: disconnected, reconnecting in {delay}s...", flush=True)
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+
+class Command(BaseCommand):
+    help = """Update the state of renders as their containers finish, from the
+    Docker events stream of each render host. Runs until it is killed.
+
+    On start, every render with a container on a host is synced, like
+    update_render_state does, to catch up on anything that finished while it
+    wasn't running. If a stream is lost, it reconnects and replays events
+    from the last one it saw.
+    """
+
+    def handle(self, *args, **options):
+        gevent.joinall(
+            [gevent.spawn(watch_host, host) for host in get_render_hosts()],
+            raise_error=True,
+        )
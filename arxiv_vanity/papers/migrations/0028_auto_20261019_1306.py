@@ -0,0 +1,17 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0027_auto_20210106_0136'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='render',
+            index=models.Index(fields=['paper', 'created_at'], name='papers_rend_paper_created_idx'),
+        ),
+    ]
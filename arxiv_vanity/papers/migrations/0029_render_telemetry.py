@@ -0,0 +1,33 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('papers', '0028_auto_20261019_1306'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='render',
+            name='duration_ms',
+            field=models.IntegerField(blank=True, help_text='How long Engrafo ran for, in milliseconds.', null=True),
+        ),
+        migrations.AddField(
+            model_name='render',
+            name='finished_at',
+            field=models.DateTimeField(blank=True, help_text='When Engrafo finished.', null=True),
+        ),
+        migrations.AddField(
+            model_name='render',
+            name='peak_memory_bytes',
+            field=models.BigIntegerField(blank=True, help_text='Peak memory usage of the container, if Docker reports it.', null=True),
+        ),
+        migrations.AddField(
+            model_name='render',
+            name='started_at',
+            field=models.DateTimeField(blank=True, help_text='When the container started.', null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+# Docker uses 0001-01-01T00:00:00Z for things that haven't happened yet.
+# Postgres rounds Docker's nanosecond timestamps to microseconds.
+BACKFILL_TIMINGS = """
+UPDATE papers_render SET
+    started_at = NULLIF(container_inspect->'State'->>'StartedAt', '0001-01-01T00:00:00Z')::timestamptz,
+    finished_at = NULLIF(container_inspect->'State'->>'FinishedAt', '0001-01-01T00:00:00Z')::timestamptz
+WHERE container_inspect IS NOT NULL AND state IN ('success', 'failure');
+
+UPDATE papers_render SET
+    duration_ms = EXTRACT(EPOCH FROM finished_at - started_at) * 1000
+WHERE started_at IS NOT NULL AND finished_at IS NOT NULL;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("papers", "0029_render_telemetry")]
+
+    operations = [migrations.RunSQL(BACKFILL_TIMINGS, migrations.RunSQL.noop)]
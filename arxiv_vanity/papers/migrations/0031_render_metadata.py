@@ -0,0 +1,45 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:25
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0030_backfill_render_telemetry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="render",
+            name="abstract",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="render",
+            name="figure_count",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="render",
+            name="first_image",
+            field=models.TextField(
+                blank=True, help_text="URL of the first figure.", null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="render",
+            name="outline",
+            field=django.contrib.postgres.fields.jsonb.JSONField(
+                blank=True,
+                help_text="List of sections, as {id, title, level} objects.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="render",
+            name="word_count",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
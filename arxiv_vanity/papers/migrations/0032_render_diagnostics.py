@@ -0,0 +1,40 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:28
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0031_render_metadata"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RenderDiagnostics",
+            fields=[
+                (
+                    "render",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="diagnostics",
+                        serialize=False,
+                        to="papers.Render",
+                    ),
+                ),
+                (
+                    "container_inspect",
+                    django.contrib.postgres.fields.jsonb.JSONField(
+                        blank=True, null=True
+                    ),
+                ),
+                ("container_logs", models.TextField(blank=True, null=True)),
+            ],
+            options={
+                "verbose_name_plural": "render diagnostics",
+            },
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.db import migrations
+
+CHUNK_SIZE = 1000
+
+# ON CONFLICT so it can be run again if it is interrupted
+COPY_CHUNK = """
+INSERT INTO papers_renderdiagnostics (render_id, container_inspect, container_logs)
+SELECT id, container_inspect, container_logs FROM papers_render
+WHERE id > %s AND id <= %s
+    AND (container_inspect IS NOT NULL OR container_logs IS NOT NULL)
+ON CONFLICT (render_id) DO NOTHING
+"""
+
+RESTORE = """
+UPDATE papers_render SET
+    container_inspect = d.container_inspect,
+    container_logs = d.container_logs
+FROM papers_renderdiagnostics d
+WHERE d.render_id = papers_render.id
+"""
+
+
+def move_diagnostics(apps, schema_editor):
+    """
+    Copy container logs and inspect output into RenderDiagnostics in chunks
+    of renders, so each chunk is its own short transaction.
+    """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT MAX(id) FROM papers_render")
+        max_id = cursor.fetchone()[0] or 0
+        for start in range(0, max_id, CHUNK_SIZE):
+            cursor.execute(COPY_CHUNK, [start, start + CHUNK_SIZE])
+
+
+def restore_diagnostics(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(RESTORE)
+
+
+class Migration(migrations.Migration):
+
+    # Commit after each chunk rather than holding locks on every render
+    atomic = False
+
+    dependencies = [("papers", "0032_render_diagnostics")]
+
+    operations = [migrations.RunPython(move_diagnostics, restore_diagnostics)]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:28
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0033_move_render_diagnostics"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="render",
+            name="container_inspect",
+        ),
+        migrations.RemoveField(
+            model_name="render",
+            name="container_logs",
+        ),
+    ]
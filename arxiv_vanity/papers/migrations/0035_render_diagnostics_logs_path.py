@@ -0,0 +1,23 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0034_remove_render_container_logs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="renderdiagnostics",
+            name="container_logs_path",
+            field=models.CharField(
+                blank=True,
+                help_text="Path in storage of the gzipped container logs.",
+                max_length=255,
+                null=True,
+            ),
+        ),
+    ]
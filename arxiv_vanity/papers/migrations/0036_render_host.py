@@ -0,0 +1,23 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0035_render_diagnostics_logs_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="render",
+            name="host",
+            field=models.CharField(
+                blank=True,
+                help_text="Docker host the render ran on. Empty if it was DOCKER_HOST.",
+                max_length=255,
+                null=True,
+            ),
+        ),
+    ]
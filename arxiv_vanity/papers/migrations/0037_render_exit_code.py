@@ -0,0 +1,22 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0036_render_host"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="render",
+            name="exit_code",
+            field=models.IntegerField(
+                blank=True,
+                help_text="Exit code of Engrafo, from the webhook or the container.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0037_render_exit_code"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CachedSourceFile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "host",
+                    models.CharField(
+                        blank=True,
+                        help_text="Docker host the file is cached on. Empty if it is DOCKER_HOST.",
+                        max_length=255,
+                        null=True,
+                    ),
+                ),
+                (
+                    "path",
+                    models.CharField(
+                        help_text="Path in the cache, from get_source_cache_path().",
+                        max_length=255,
+                    ),
+                ),
+                ("size", models.BigIntegerField()),
+                ("last_used_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="sourcefile",
+            name="checksum",
+            field=models.CharField(
+                blank=True,
+                help_text="SHA-256 of the file. Set when the file is saved.",
+                max_length=64,
+                null=True,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="cachedsourcefile",
+            index=models.Index(
+                fields=["host", "last_used_at"], name="papers_cach_host_used_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="cachedsourcefile",
+            index=models.Index(fields=["path"], name="papers_cach_path_idx"),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0038_source_cache"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EngrafoImage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        help_text="The tag that was pulled.", max_length=255
+                    ),
+                ),
+                (
+                    "digest",
+                    models.CharField(
+                        help_text="Image ID.", max_length=255, unique=True
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "is_active",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Whether new renders run with this image.",
+                    ),
+                ),
+                (
+                    "is_removed",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Whether it has been removed from the render hosts.",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="render",
+            name="image_digest",
+            field=models.CharField(
+                blank=True,
+                help_text="ID of the Engrafo image the render ran with. Empty if no image had been deployed, so it ran with the ENGRAFO_IMAGE tag.",
+                max_length=255,
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.26 on 2026-10-19 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0039_engrafo_image"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="render",
+            name="arxiv_version",
+            field=models.IntegerField(
+                blank=True,
+                help_text="Version of the paper that was rendered.",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="sourcefile",
+            name="arxiv_version",
+            field=models.IntegerField(
+                blank=True,
+                help_text="Version of the paper the file is, if known. arXiv serves the latest version.",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 2.2.26 on 2026-10-19 14:13
+
+from django.db import migrations, models
+
+# Keep the most recently used row for each file, so the constraints can be
+# added. IS NOT DISTINCT FROM so files on DOCKER_HOST (a NULL host) match.
+DELETE_DUPLICATES = """
+DELETE FROM papers_cachedsourcefile a
+USING papers_cachedsourcefile b
+WHERE a.host IS NOT DISTINCT FROM b.host AND a.path = b.path
+    AND (a.last_used_at, a.id) < (b.last_used_at, b.id)
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0040_arxiv_versions"),
+    ]
+
+    operations = [
+        migrations.RunSQL(DELETE_DUPLICATES, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name="cachedsourcefile",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(host__isnull=False),
+                fields=("host", "path"),
+                name="papers_cach_host_path_uniq",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="cachedsourcefile",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(host__isnull=True),
+                fields=("path",),
+                name="papers_cach_path_uniq",
+            ),
+        ),
+    ]
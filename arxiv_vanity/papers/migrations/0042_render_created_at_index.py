@@ -0,0 +1,17 @@
+# Generated by Django 2.2.26 on 2026-10-19 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("papers", "0041_cached_source_file_unique"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="render",
+            index=models.Index(fields=["created_at"], name="papers_rend_created_idx"),
+        ),
+    ]
@@ -1,24 +1,59 @@
 import datetime
 import docker.errors
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection, models, transaction
+from django.db.models.functions import Coalesce
 from django.contrib.postgres.fields import ArrayField, JSONField
 from django.core.files.storage import default_storage
 from django.urls import reverse
 from django.utils import timezone
+from gevent.pool import Pool
+import gzip
+import hashlib
+import io
+import json
 import os
-from ..scraper.query import query_single_paper
-from ..storage import storage_delete_path
-from ..utils import log_exception
+import time
+from ..instrumentation import timer
+from ..scraper.query import query_page, query_single_paper
+from ..storage import (
+    storage_delete_path,
+    storage_gzip_path,
+    storage_overwrite,
+    storage_read_chunks,
+    storage_save_private,
+)
+from ..utils import catch_exceptions, log_exception
 from .downloader import download_source_file
-from .processor import process_render
-from .renderer import render_paper, create_client, TooManyRendersRunningError
+from .images import VARIANTS_DIR, generate_image_variants
+from .processor import PROCESSOR_VERSION, process_render
+from .renderer import (
+    render_paper,
+    add_to_source_cache,
+    choose_render_host,
+    count_running_renders,
+    create_client,
+    get_source_cache_path,
+    parse_docker_timestamp,
+    pull_image,
+    read_container_logs,
+    remove_from_source_cache,
+    remove_image,
+    RENDER_ID_LABEL,
+    TooManyRendersRunningError,
+)
 
 
 class RenderError(Exception):
     pass
 
 
+class EngrafoImageError(Exception):
+    pass
+
+
 class PaperIsNotRenderableError(RenderError):
     """Paper cannot be rendered."""
 
@@ -55,6 +90,19 @@ class PaperQuerySet(models.QuerySet):
         qs = self._with_has_not_deleted_render_annotation()
         return qs.filter(has_not_deleted_render=True)
 
+    def with_latest_render(self):
+        """
+        Annotate papers with the ID and state of their latest render as
+        `latest_render_id` and `latest_render_state`.
+        """
+        renders = Render.objects.filter(paper=models.OuterRef("pk")).order_by(
+            "-created_at"
+        )
+        return self.annotate(
+            latest_render_id=models.Subquery(renders.values("id")[:1]),
+            latest_render_state=models.Subquery(renders.values("state")[:1]),
+        )
+
     def downloaded(self):
         return self.filter(source_file__isnull=False)
 
@@ -62,7 +110,69 @@ class PaperQuerySet(models.QuerySet):
         return self.filter(source_file__isnull=True)
 
     def update_or_create_from_api(self, result):
-        return self.update_or_create(arxiv_id=result["arxiv_id"], defaults=result)
+        paper, previous_version = self.update_from_api(result)
+        return paper, previous_version is None
+
+    def update_from_api(self, result):
+        """
+        Create or update a paper from an arXiv API result. Returns a tuple of
+        (paper, the version we had before, or None if it is new).
+
+        If it is a new version, the paper's source file is marked as the
+        previous version, so the next render downloads it again.
+        """
+        previous = (
+            self.filter(arxiv_id=result["arxiv_id"])
+            .values_list("arxiv_version", "source_file")
+            .first()
+        )
+        paper, _ = self.update_or_create(arxiv_id=result["arxiv_id"], defaults=result)
+        if previous is None:
+            return paper, None
+        previous_version, source_file_id = previous
+        if paper.arxiv_version > previous_version and source_file_id:
+            # Files we know the version of will already be older
+            SourceFile.objects.filter(id=source_file_id, arxiv_version=None).update(
+                arxiv_version=previous_version
+            )
+        return paper, previous_version
+
+    def refresh_from_arxiv(self, start=0, chunk_size=100, wait_time=3.0, progress=None):
+        """
+        Update the papers in this queryset from arXiv's API, a chunk of IDs
+        per request, so new versions are noticed. Their renders are replaced
+        the next time they are viewed (see Render.is_outdated()).
+
+        `start` is an ID to resume from. `progress` is called with the last
+        ID of each chunk and the number of new versions in it. Returns the
+        total number of new versions.
+        """
+        pointer = start
+        total = 0
+        while True:
+            papers = list(
+                self.filter(id__gt=pointer)
+                .order_by("id")
+                .values_list("id", "arxiv_id")[:chunk_size]
+            )
+            if not papers:
+                break
+            arxiv_ids = [arxiv_id for _, arxiv_id in papers]
+            new_versions = 0
+            for result in query_page(id_list=arxiv_ids, max_results=len(arxiv_ids)):
+                paper, previous_version = Paper.objects.update_from_api(result)
+                if (
+                    previous_version is not None
+                    and paper.arxiv_version > previous_version
+                ):
+                    new_versions += 1
+            pointer = papers[-1][0]
+            total += new_versions
+            if progress is not None:
+                progress(pointer, new_versions)
+            # Be nice to arXiv's API
+            time.sleep(wait_time)
+        return total
 
     def update_or_create_from_arxiv_id(self, arxiv_id):
         """
@@ -81,6 +191,30 @@ class PaperQuerySet(models.QuerySet):
             categories__overlap=settings.PAPERS_MACHINE_LEARNING_CATEGORIES
         )
 
+    def render(self):
+        """
+        Make new renders of all the papers in this queryset, starting the
+        containers in parallel. Source files are downloaded for papers that
+        don't have one yet.
+
+        Returns a tuple of (started renders, number of papers that are not
+        renderable).
+        """
+        papers = []
+        not_renderable = 0
+        for paper in self.select_related("source_file"):
+            if not paper.has_current_source_file():
+                paper.get_or_download_source_file()
+            if paper.source_file.is_renderable():
+                papers.append(paper)
+            else:
+                not_renderable += 1
+        renders = Render.objects.bulk_create(Render(paper=p) for p in papers)
+        # bulk_create() doesn't set the papers we already have loaded
+        for render, paper in zip(renders, papers):
+            render.paper = paper
+        return Render.objects.run_renders(renders), not_renderable
+
 
 class PaperManager(models.Manager):
     def get_queryset(self):
@@ -142,12 +276,24 @@ class Paper(models.Model):
         """
         return self.source_file and self.source_file.is_renderable()
 
+    def has_current_source_file(self):
+        """
+        Returns whether this paper has a source file, and it isn't of an
+        older version of the paper.
+        """
+        return bool(self.source_file) and not self.source_file.is_older_than(
+            self.arxiv_version
+        )
+
     def get_or_download_source_file(self):
         """
         Attempts to get the source file from a bulk data download, otherwise
-        downloads it and creates it.
+        downloads it and creates it. If the source file is of an older version
+        of the paper, the latest version is downloaded.
         """
-        self.source_file = SourceFile.objects.get_or_download(self.arxiv_id)
+        self.source_file = SourceFile.objects.get_or_download(
+            self.arxiv_id, arxiv_version=self.arxiv_version
+        )
         self.save()
         return self.source_file
 
@@ -156,14 +302,17 @@ class Paper(models.Model):
     ):
         """
         Returns the render that should display for this paper, and kicks off
-        a new render if need be.
+        a new render if need be. The render's outline isn't loaded.
         """
+        # The outline can be large and the paper page doesn't need it
+        renders = self.renders.not_deleted().defer("outline")
+
         # If we're not doing any rendering, just return the latest succeeded render
         if no_render:
-            return self.renders.not_deleted().succeeded().latest()
+            return renders.succeeded().latest()
 
         try:
-            render = self.renders.not_deleted().latest()
+            render = renders.latest()
         except Render.DoesNotExist:
             render = None
         if not render:
@@ -178,14 +327,14 @@ class Paper(models.Model):
         # There is already a render running, so try and get the most recent one that isn't running
         if render.state == Render.STATE_RUNNING:
             try:
-                return self.renders.not_deleted().succeeded().latest()
+                return renders.succeeded().latest()
             except Render.DoesNotExist:
                 # If this is the only render or the other renders errored, display loading render
                 return render
 
         elif render.state == Render.STATE_FAILURE:
-            # Kick off render if this one has expired
-            if render.is_expired() or force_render:
+            # Kick off render if this one is outdated
+            if render.is_outdated() or force_render:
                 try:
                     render = self.render()
                 except TooManyRendersRunningError:
@@ -195,14 +344,14 @@ class Paper(models.Model):
                     log_exception()
             # Try and display a successful render
             try:
-                return self.renders.not_deleted().succeeded().latest()
+                return renders.succeeded().latest()
             # Otherwise, display the failed or running render
             except Render.DoesNotExist:
                 return render
 
         elif render.state == Render.STATE_SUCCESS:
-            # Kick off render in background if it has expired
-            if render.is_expired() or force_render:
+            # Kick off render in background if it is outdated
+            if render.is_outdated() or force_render:
                 try:
                     self.render()
                 except TooManyRendersRunningError:
@@ -220,7 +369,7 @@ class Paper(models.Model):
         Make a new render of this paper. Will download the source file and save
         itself if it hasn't already.
         """
-        if not self.source_file:
+        if not self.has_current_source_file():
             self.get_or_download_source_file()
         if not self.source_file.is_renderable():
             raise PaperIsNotRenderableError("This paper is not renderable.")
@@ -234,6 +383,65 @@ def _get_expired_date():
     return timezone.now() - expired_delta
 
 
+class Percentile(models.Aggregate):
+    """
+    Continuous percentile of an expression. `percentile` is between 0 and 1.
+    """
+
+    function = "PERCENTILE_CONT"
+    name = "Percentile"
+    template = "%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+
+    def __init__(self, expression, percentile, **extra):
+        super().__init__(expression, percentile=percentile, **extra)
+
+
+def _to_seconds(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return value / 1000
+
+
+# Fields of Render that are set from process_render()
+METADATA_FIELDS = ["abstract", "first_image", "word_count", "figure_count", "outline"]
+
+# Output of a render never changes, and a new render gets a new path
+RENDER_OUTPUT_CACHE_CONTROL = "public, max-age=31536000"
+
+COMPRESSED_OUTPUT_EXTENSIONS = {".html", ".css", ".js", ".svg"}
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def should_compress_output_file(path):
+    """
+    Whether a file in a render's output should be gzipped. Files that arXiv
+    Vanity writes itself are left alone, because they are read back with
+    default_storage, which doesn't decompress them.
+    """
+    if path.startswith(("processed-", VARIANTS_DIR + "/")):
+        return False
+    return os.path.splitext(path)[1].lower() in COMPRESSED_OUTPUT_EXTENSIONS
+
+
+def render_state_cache_key(arxiv_id):
+    return f"render-state:{arxiv_id}"
+
+
+@catch_exceptions
+def _delete_render_output(render_id):
+    try:
+        Render(id=render_id).delete_output()
+    except FileNotFoundError:
+        pass
+
+
+# Key of the Postgres advisory lock that serializes choosing render hosts
+RENDER_HOSTS_LOCK_ID = 0x76616E31
+
+
 class RenderQuerySet(models.QuerySet):
     def running(self):
         return self.filter(state=Render.STATE_RUNNING)
@@ -250,12 +458,26 @@ class RenderQuerySet(models.QuerySet):
     def deleted(self):
         return self.filter(is_deleted=True)
 
+    def made_with_older_image(self):
+        """
+        Renders of papers that don't have an undeleted render made with the
+        active Engrafo image, for rerender to replace after a deploy.
+        """
+        current = Render.objects.not_deleted().filter(
+            image_digest=EngrafoImage.objects.get_active_digest()
+        )
+        return self.exclude(paper_id__in=current.values("paper_id"))
+
     def update_state(self):
         """
         Update the state of renders that have a container.
         """
-        qs = self.exclude(state=Render.STATE_UNSTARTED).filter(
-            container_is_removed=False
+        # save() needs the paper's arXiv ID to clear its cached state
+        qs = (
+            self.exclude(state=Render.STATE_UNSTARTED)
+            .filter(container_is_removed=False)
+            .select_related("paper")
+            .defer("outline")
         )
         for render in qs.iterator(chunk_size=100):
             try:
@@ -265,6 +487,55 @@ class RenderQuerySet(models.QuerySet):
                 log_exception()
         return self
 
+    def record_exit(self, exit_code):
+        """
+        Record the exit code Engrafo reported to the webhook, and the state
+        it implies, in a single UPDATE. Returns the number of renders
+        updated.
+
+        The container is still running, because it is waiting for the
+        webhook to respond, so everything that needs Docker is left to
+        update_state() once it has exited.
+        """
+        state = Render.STATE_SUCCESS if exit_code == 0 else Render.STATE_FAILURE
+        qs = self.exclude(state=Render.STATE_UNSTARTED).filter(
+            container_is_removed=False
+        )
+        # Saving clears this cache, but UPDATE doesn't
+        arxiv_ids = list(qs.values_list("paper__arxiv_id", flat=True))
+        count = qs.update(
+            state=state,
+            exit_code=exit_code,
+            finished_at=Coalesce("finished_at", models.Value(timezone.now())),
+        )
+        cache.delete_many([render_state_cache_key(arxiv_id) for arxiv_id in arxiv_ids])
+        return count
+
+    def update_state_from_event(self, event):
+        """
+        Update the state of a render from a Docker container event (see
+        renderer.render_events()). Returns the render, or None if the event
+        wasn't for a render with a container.
+        """
+        attributes = event["Actor"]["Attributes"]
+        qs = self.exclude(state=Render.STATE_UNSTARTED).filter(
+            container_is_removed=False
+        )
+        # Event attributes include the container's labels
+        if RENDER_ID_LABEL in attributes:
+            qs = qs.filter(id=attributes[RENDER_ID_LABEL], container_id=event["id"])
+        else:
+            qs = qs.filter(container_id=event["id"])
+        render = qs.select_related("paper").defer("outline").first()
+        if render is None:
+            return None
+        exit_code = None
+        if event["Action"] == "die":
+            exit_code = attributes.get("exitCode")
+        render.update_state(exit_code=exit_code)
+        render.delete_older_renders_if_successful()
+        return render
+
     def expired(self):
         """
         Returns renders that ran more than PAPERS_EXPIRED_DAYS ago.
@@ -277,14 +548,234 @@ class RenderQuerySet(models.QuerySet):
         """
         return self.filter(created_at__gt=_get_expired_date())
 
-    def mark_as_deleted(self):
+    def mark_as_deleted(self, start=0, chunk_size=1000, concurrency=10, progress=None):
         """
-        Mark renders as deleted. Useful for forcing re-rendering.
+        Mark renders as deleted and delete their output. Useful for forcing
+        re-rendering.
+
+        Renders are worked through in chunks ordered by ID. Each chunk is
+        marked as deleted with a single UPDATE, then the output of its
+        renders is deleted in parallel. If this is interrupted, output that
+        was not deleted is cleaned up by the delete_all_expired_renders
+        command.
+
+        `start` is an ID to resume from. `progress` is called with the last
+        ID of each chunk once that chunk is done.
         """
-        for render in self.iterator():
-            render.mark_as_deleted()
+        pool = Pool(concurrency)
+        pointer = start
+        while True:
+            ids = list(
+                self.filter(id__gt=pointer)
+                .order_by("id")
+                .values_list("id", flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            Render.objects.filter(id__in=ids).update(is_deleted=True)
+            pool.map(_delete_render_output, ids)
+            pointer = ids[-1]
+            if progress is not None:
+                progress(pointer)
         return self
 
+    def update_metadata(self, start=0, chunk_size=100, concurrency=10, progress=None):
+        """
+        Process renders and save their metadata fields.
+
+        Renders are worked through in chunks ordered by ID, processed in
+        parallel, then saved with a single query per chunk. `start` is an ID
+        to resume from. `progress` is called with the last ID of each chunk
+        and the number of renders in it that were processed.
+        """
+        pool = Pool(concurrency)
+
+        @catch_exceptions
+        def process(render):
+            render.write_processed_render()
+            return render
+
+        pointer = start
+        while True:
+            renders = list(
+                self.filter(id__gt=pointer)
+                .select_related("paper")
+                .order_by("id")[:chunk_size]
+            )
+            if not renders:
+                break
+            processed = [render for render in pool.map(process, renders) if render]
+            Render.objects.bulk_update(processed, METADATA_FIELDS)
+            pointer = renders[-1].id
+            if progress is not None:
+                progress(pointer, len(processed))
+        return self
+
+    def run_renders(self, renders, concurrency=10):
+        """
+        Start running a list of unstarted renders, launching their containers
+        in parallel. Renders that don't fit on a host or fail to start are
+        left unstarted, like `Render.run()` does.
+
+        Returns the renders that were started.
+        """
+        renders = self.reserve_hosts(renders)
+        cached_paths = CachedSourceFile.objects.cached_paths(
+            [render.paper.source_file for render in renders]
+        )
+        image = EngrafoImage.objects.get_active_digest()
+
+        @catch_exceptions
+        def start(render):
+            return render, render.start_container(
+                cached_paths=cached_paths, image=image
+            )
+
+        pool = Pool(concurrency)
+        started = []
+        for result in pool.imap_unordered(start, renders):
+            if not result:
+                continue
+            render, container_id = result
+            render.container_id = container_id
+            started.append(render)
+
+        self.release_hosts([render for render in renders if render not in started])
+        self.bulk_update(
+            started, ["host", "image_digest", "arxiv_version", "container_id", "state"]
+        )
+        # bulk_update() doesn't call save(), so clear cached states here
+        cache.delete_many(
+            [render_state_cache_key(render.paper.arxiv_id) for render in started]
+        )
+        return started
+
+    def reserve_hosts(self, renders):
+        """
+        Choose a host for each of a list of unstarted renders, and mark them
+        as running on it. Returns the renders that got a host. The rest
+        didn't fit, and are left unstarted.
+
+        A host's load is the number of renders marked as running on it, or
+        the number of render containers Docker says are running on it if
+        that is larger. Hosts are chosen and renders marked in one
+        transaction, under a lock, so renders being started at the same
+        time, here or in other processes, count towards a host's capacity
+        before their containers exist.
+        """
+        running = count_running_renders()
+        reserved = []
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_advisory_xact_lock(%s)", [RENDER_HOSTS_LOCK_ID]
+                )
+            placed = dict(
+                Render.objects.running()
+                .values_list("host")
+                .annotate(count=models.Count("id"))
+                .order_by()
+            )
+            loads = {
+                host: max(count, placed.get(host, 0)) for host, count in running.items()
+            }
+            for render in renders:
+                try:
+                    render.host = choose_render_host(loads)
+                except TooManyRendersRunningError:
+                    break
+                loads[render.host] += 1
+                render.state = Render.STATE_RUNNING
+                reserved.append(render)
+            for host in {render.host for render in reserved}:
+                Render.objects.filter(
+                    id__in=[render.id for render in reserved if render.host == host],
+                    state=Render.STATE_UNSTARTED,
+                ).update(host=host, state=Render.STATE_RUNNING)
+        return reserved
+
+    def release_hosts(self, renders):
+        """
+        Put renders from reserve_hosts() back to being unstarted, because
+        their containers didn't start.
+        """
+        for render in renders:
+            render.host = None
+            render.state = Render.STATE_UNSTARTED
+        Render.objects.filter(
+            id__in=[render.id for render in renders], container_id__isnull=True
+        ).update(host=None, state=Render.STATE_UNSTARTED)
+
+    def first_for_paper(self):
+        """
+        Returns only renders that were the first render of their paper.
+        """
+        earlier_renders = Render.objects.filter(
+            paper=models.OuterRef("paper"), created_at__lt=models.OuterRef("created_at")
+        )
+        return self.annotate(has_earlier_render=models.Exists(earlier_renders)).filter(
+            has_earlier_render=False
+        )
+
+    def timing_stats(self):
+        """
+        Returns the median and 95th percentile, in seconds, of:
+
+        * `render_time`: how long Engrafo ran for
+        * `queue_time`: how long renders waited for their container to start
+        * `first_render_time`: for the first render of a paper, how long it
+          took from the render being created to finishing. This is how long
+          the first reader of a paper waits for it.
+        """
+        render_time = models.F("duration_ms")
+        queue_time = models.ExpressionWrapper(
+            models.F("started_at") - models.F("created_at"),
+            output_field=models.DurationField(),
+        )
+        first_render_time = models.ExpressionWrapper(
+            models.F("finished_at") - models.F("created_at"),
+            output_field=models.DurationField(),
+        )
+        stats = self.aggregate(
+            render_time_p50=Percentile(
+                render_time, 0.5, output_field=models.FloatField()
+            ),
+            render_time_p95=Percentile(
+                render_time, 0.95, output_field=models.FloatField()
+            ),
+            queue_time_p50=Percentile(queue_time, 0.5),
+            queue_time_p95=Percentile(queue_time, 0.95),
+        )
+        stats.update(
+            self.first_for_paper().aggregate(
+                first_render_time_p50=Percentile(first_render_time, 0.5),
+                first_render_time_p95=Percentile(first_render_time, 0.95),
+            )
+        )
+        return {key: _to_seconds(value) for key, value in stats.items()}
+
+    def latest_state_for_arxiv_id(self, arxiv_id):
+        """
+        Returns the state of the latest render of a paper, or None if it has
+        no renders.
+
+        This is polled by every open "rendering" page, so it is a single
+        indexed query and the result is cached for
+        PAPERS_RENDER_STATE_CACHE_SECONDS. Saving a render clears the cache.
+        """
+        key = render_state_cache_key(arxiv_id)
+        state = cache.get(key)
+        if state is None:
+            state = (
+                self.filter(paper__arxiv_id=arxiv_id, paper__is_deleted=False)
+                .order_by("-created_at")
+                .values_list("state", flat=True)
+                .first()
+            )
+            if state is not None:
+                cache.set(key, state, settings.PAPERS_RENDER_STATE_CACHE_SECONDS)
+        return state
+
 
 class Render(models.Model):
     STATE_UNSTARTED = "unstarted"
@@ -306,21 +797,80 @@ class Render(models.Model):
         db_index=True,
     )
     is_deleted = models.BooleanField(default=False)
+    host = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="Docker host the render ran on. Empty if it was DOCKER_HOST.",
+    )
+    image_digest = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="ID of the Engrafo image the render ran with. Empty if no image had been deployed, so it ran with the ENGRAFO_IMAGE tag.",
+    )
+    arxiv_version = models.IntegerField(
+        null=True, blank=True, help_text="Version of the paper that was rendered."
+    )
     container_id = models.CharField(max_length=64, null=True, blank=True)
-    container_inspect = JSONField(null=True, blank=True)
-    container_logs = models.TextField(null=True, blank=True)
     container_is_removed = models.BooleanField(default=False)
+    exit_code = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Exit code of Engrafo, from the webhook or the container.",
+    )
+
+    # Telemetry
+    started_at = models.DateTimeField(
+        null=True, blank=True, help_text="When the container started."
+    )
+    finished_at = models.DateTimeField(
+        null=True, blank=True, help_text="When Engrafo finished."
+    )
+    duration_ms = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="How long Engrafo ran for, in milliseconds.",
+    )
+    peak_memory_bytes = models.BigIntegerField(
+        null=True,
+        blank=True,
+        help_text="Peak memory usage of the container, if Docker reports it.",
+    )
+
+    # Metadata extracted from the output by process_render(), so it can be
+    # used without reading the output from storage
+    abstract = models.TextField(null=True, blank=True)
+    first_image = models.TextField(
+        null=True, blank=True, help_text="URL of the first figure."
+    )
+    word_count = models.IntegerField(null=True, blank=True)
+    figure_count = models.IntegerField(null=True, blank=True)
+    outline = JSONField(
+        null=True,
+        blank=True,
+        help_text="List of sections, as {id, title, level} objects.",
+    )
 
     objects = RenderQuerySet.as_manager()
 
     class Meta:
         get_latest_by = "created_at"
+        indexes = [
+            models.Index(
+                fields=["paper", "created_at"], name="papers_rend_paper_created_idx"
+            ),
+            models.Index(fields=["created_at"], name="papers_rend_created_idx"),
+        ]
 
     def __str__(self):
         return self.paper.title
 
     def save(self, *args, **kwargs):
         super(Render, self).save(*args, **kwargs)
+        # Pollers will pick up the new state on their next request. This
+        # only reaches other processes if CACHE_URL is a shared cache.
+        cache.delete(render_state_cache_key(self.paper.arxiv_id))
 
     def get_output_path(self):
         """
@@ -360,28 +910,64 @@ class Render(models.Model):
             raise RenderAlreadyStartedError(
                 f"Render {self.id} has already been started"
             )
-        self.container_id = render_paper(
-            self.paper.source_file.file.name,
+        if not Render.objects.reserve_hosts([self]):
+            raise TooManyRendersRunningError("No render hosts have capacity")
+        try:
+            cached_paths = CachedSourceFile.objects.cached_paths(
+                [self.paper.source_file]
+            )
+            self.container_id = self.start_container(
+                cached_paths=cached_paths,
+                image=EngrafoImage.objects.get_active_digest(),
+            )
+        except:
+            Render.objects.release_hosts([self])
+            raise
+        self.save()
+
+    def start_container(self, cached_paths=frozenset(), image=None):
+        """
+        Start the Engrafo container for this render on the host given to it
+        by RenderQuerySet.reserve_hosts(), set `image_digest`, and return
+        the container's ID. Doesn't touch the database, so it is safe to
+        call in parallel.
+
+        `cached_paths` is from CachedSourceFile.objects.cached_paths(). If
+        the source file is in the source cache of the chosen host, it is
+        rendered from there. `image` is from
+        EngrafoImage.objects.get_active_digest().
+        """
+        self.image_digest = image
+        self.arxiv_version = self.paper.arxiv_version
+        source_file = self.paper.source_file
+        cached_source = source_file.get_source_cache_path()
+        if (self.host, cached_source) not in cached_paths:
+            cached_source = None
+        return render_paper(
+            source_file.file.name,
             self.get_output_path(),
             webhook_url=self.get_webhook_url(),
+            render_id=self.id,
+            arxiv_id=self.paper.arxiv_id,
+            host=self.host,
+            cached_source=cached_source,
+            image=image,
         ).id
-        self.state = Render.STATE_RUNNING
-        self.save()
 
     def update_state(self, exit_code=None):
         """
         Update state of this render from the container.
 
-        This is used for two purposes:
+        This is called by watch_render_events when a container exits, with
+        the exit code from the event, and by the update_render_state cron
+        job, which syncs all of the containers that exist. Either way, it
+        saves the container's diagnostics, post-processes successful output
+        and removes containers that have stopped.
 
-        1. Called by the webhook to update the state. In this case, exit_code
-            is passed through instead of using the containers exit code
-            because the container is still running (it's sending the webhook!).
-
-        2. Called by the update_render_state cron job. In this case, it'll
-            sync all of the details about the containers that exist, and remove
-            any containers that have stopped. This sweeps up containers
-            that have reported their state in (1).
+        The webhook only records the exit code and state with
+        RenderQuerySet.record_exit(), so that the container, which is
+        waiting on it, can exit as soon as possible. The rest of the work
+        is done here.
         """
         if self.state == Render.STATE_UNSTARTED:
             # The create container timeed out, but container ran anyway
@@ -389,12 +975,23 @@ class Render(models.Model):
             self.mark_as_deleted()
             return
 
-        client = create_client()
+        if self.container_id is None:
+            # It has a host reserved, but its container hasn't started yet.
+            # If it hasn't by now, whatever was starting it died.
+            cutoff = timezone.now() - datetime.timedelta(
+                minutes=settings.PAPERS_MAX_RENDER_TIME_MINS
+            )
+            if self.created_at < cutoff:
+                self.state = Render.STATE_FAILURE
+                self.container_is_removed = True
+                self.save()
+            return
+
+        client = create_client(self.host)
 
         try:
             container = client.containers.get(self.container_id)
-            self.container_inspect = container.attrs
-            self.container_logs = str(container.logs(), "utf-8").replace("\x00", "")
+            self.save_diagnostics(container)
         except docker.errors.NotFound:
             # Container has been removed for some reason, so mark it as
             # removed so we don't try to update its state again
@@ -402,19 +999,29 @@ class Render(models.Model):
             # Give it a failed state if the render was still running
             if self.state == Render.STATE_RUNNING:
                 self.state = Render.STATE_FAILURE
+            elif self.state == Render.STATE_SUCCESS:
+                # The webhook succeeded, but it never got post-processed
+                self.postprocess_output()
             self.save()
             return
 
         if exit_code is None and container.status == "exited":
             exit_code = container.attrs["State"]["ExitCode"]
 
+        self.update_telemetry(container)
+
         if exit_code is not None:
-            # Safer to convert int to str than other way round
-            if str(exit_code) == "0":
+            self.exit_code = int(exit_code)
+            if self.exit_code == 0:
                 self.state = Render.STATE_SUCCESS
             else:
                 self.state = Render.STATE_FAILURE
 
+        # Post-process once the container has exited, just before it is
+        # removed, so it is only done again if removing it fails
+        if container.status == "exited" and self.state == Render.STATE_SUCCESS:
+            self.postprocess_output()
+
         # Deleting containers on Hyper.sh often fails, so save here so we at
         # least save the state. If remove fails, this will get retried by
         # the update_render_state cron job.
@@ -429,6 +1036,89 @@ class Render(models.Model):
                 pass
             self.container_is_removed = True
             self.save()
+            catch_exceptions(self.cache_source_file)()
+
+    def cache_source_file(self):
+        """
+        Put this render's source file in the source cache of the host it
+        ran on, so if the paper is rendered there again it doesn't need
+        fetching from storage. Called by update_state().
+        """
+        if settings.PAPERS_SOURCE_CACHE_VOLUME and self.paper.source_file:
+            CachedSourceFile.objects.add(self.host, self.paper.source_file)
+
+    def save_diagnostics(self, container):
+        """
+        Save the container's inspect output, and its logs once it has
+        exited. Called by update_state().
+        """
+        diagnostics, _ = RenderDiagnostics.objects.get_or_create(render=self)
+        diagnostics.container_inspect = container.attrs
+        # Logs are only complete once the container has exited, and
+        # update_state() is called for running containers on every sweep
+        if container.status == "exited" and not diagnostics.container_logs_path:
+            diagnostics.container_logs_path = self.save_container_logs(container)
+        diagnostics.save()
+
+    def get_container_logs_path(self):
+        return os.path.join("render-logs", str(self.id), "container.log.gz")
+
+    def save_container_logs(self, container):
+        """
+        Save the start and end of the container's logs, gzipped, to
+        storage. Returns the path they were saved to.
+        """
+        logs = read_container_logs(
+            container,
+            head_bytes=settings.PAPERS_CONTAINER_LOG_HEAD_BYTES,
+            tail_bytes=settings.PAPERS_CONTAINER_LOG_TAIL_BYTES,
+        )
+        path = self.get_container_logs_path()
+        # Private, because the logs include the webhook URL
+        storage_save_private(
+            default_storage, path, gzip.compress(logs), content_type="application/gzip"
+        )
+        return path
+
+    def get_diagnostics(self):
+        """
+        Returns this render's RenderDiagnostics, or None if its container
+        hasn't been inspected.
+        """
+        try:
+            return self.diagnostics
+        except RenderDiagnostics.DoesNotExist:
+            return None
+
+    def update_telemetry(self, container):
+        """
+        Record timings and resource usage of this render from its container.
+        Called by update_state().
+        """
+        state = container.attrs["State"]
+        if self.started_at is None:
+            self.started_at = parse_docker_timestamp(state.get("StartedAt"))
+
+        if self.finished_at is None and container.status == "exited":
+            self.finished_at = parse_docker_timestamp(state.get("FinishedAt"))
+
+        if self.started_at and self.finished_at and self.duration_ms is None:
+            duration = self.finished_at - self.started_at
+            self.duration_ms = int(duration.total_seconds() * 1000)
+
+        # Memory stats are only available while the container is running, so
+        # they are sampled on each update_render_state sweep. max_usage is
+        # the peak so far, so the last sample is the closest to the real one.
+        if container.status == "running":
+            try:
+                stats = container.stats(stream=False)
+            except docker.errors.APIError:
+                log_exception()
+            else:
+                memory_stats = stats.get("memory_stats") or {}
+                peak = memory_stats.get("max_usage")
+                if peak is not None and peak > (self.peak_memory_bytes or 0):
+                    self.peak_memory_bytes = peak
 
     def get_processed_render(self):
         """
@@ -436,8 +1126,142 @@ class Render(models.Model):
         {"body", "script", "styles"}.
         """
         context = {"render": self, "paper": self.paper}
-        with default_storage.open(self.get_html_path()) as fh:
-            return process_render(fh, self.get_output_url(), context=context)
+        with timer("storage") as span:
+            with default_storage.open(self.get_html_path()) as fh:
+                html = fh.read()
+            span.size = len(html)
+        # Compressed by compress_output()
+        if html[:2] == GZIP_MAGIC:
+            html = gzip.decompress(html)
+        images = self.get_image_manifest()
+        with timer("processor"):
+            return process_render(
+                io.BytesIO(html), self.get_output_url(), context=context, images=images
+            )
+
+    def postprocess_output(self):
+        """
+        Work done on a render's output when it succeeds. None of it is
+        essential, so it doesn't fail the render if it goes wrong.
+        """
+        if settings.PAPERS_IMAGE_VARIANT_WIDTHS:
+            catch_exceptions(self.generate_image_variants)()
+        # Saved by update_state()
+        catch_exceptions(self.write_processed_render)()
+        if settings.PAPERS_COMPRESS_RENDER_OUTPUT:
+            catch_exceptions(self.compress_output)()
+
+    def compress_output(self):
+        """
+        Gzip the text files in this render's output in place, so they are
+        served compressed.
+        """
+        return storage_gzip_path(
+            default_storage,
+            self.get_output_path(),
+            should_compress_output_file,
+            cache_control=RENDER_OUTPUT_CACHE_CONTROL,
+        )
+
+    def get_image_manifest_path(self):
+        return os.path.join(self.get_output_path(), "images.json")
+
+    def generate_image_variants(self):
+        """
+        Write smaller variants of this render's images for srcsets, and a
+        manifest of them and the size of every image.
+        """
+        images = generate_image_variants(
+            default_storage,
+            self.get_output_path(),
+            settings.PAPERS_IMAGE_VARIANT_WIDTHS,
+        )
+        storage_overwrite(
+            default_storage,
+            self.get_image_manifest_path(),
+            ContentFile(json.dumps(images).encode("utf-8")),
+        )
+
+    def get_image_manifest(self):
+        """
+        Returns the manifest written by generate_image_variants(), or None
+        if there isn't one.
+        """
+        try:
+            with default_storage.open(self.get_image_manifest_path()) as fh:
+                return json.loads(fh.read())
+        except FileNotFoundError:
+            return None
+
+    def get_processed_path(self):
+        """
+        Path to the directory that the processed render is stored in.
+        """
+        return os.path.join(self.get_output_path(), f"processed-v{PROCESSOR_VERSION}")
+
+    def write_processed_render(self):
+        """
+        Process this render and store the result, so it can be served
+        without processing it again. The body is stored on its own so it
+        can be streamed, and everything else goes in a metadata file.
+        Returns the metadata.
+        """
+        processed = self.get_processed_render()
+        # Kept on the render rather than in the metadata file
+        for field in METADATA_FIELDS:
+            setattr(self, field, processed.pop(field))
+        body = processed.pop("body").encode("utf-8")
+        processed["body_size"] = len(body)
+        path = self.get_processed_path()
+        # Metadata last, so if it exists the body does too
+        storage_overwrite(
+            default_storage, os.path.join(path, "body.html"), ContentFile(body)
+        )
+        storage_overwrite(
+            default_storage,
+            os.path.join(path, "metadata.json"),
+            ContentFile(json.dumps(processed).encode("utf-8")),
+        )
+        return processed
+
+    def get_processed_metadata(self):
+        """
+        Returns the stored links, styles, scripts and body_size of this
+        render, processing it if it hasn't been already.
+        """
+        try:
+            with timer("storage") as span:
+                with default_storage.open(
+                    os.path.join(self.get_processed_path(), "metadata.json")
+                ) as fh:
+                    data = fh.read()
+                span.size = len(data)
+        except FileNotFoundError:
+            metadata = self.write_processed_render()
+            self.save(update_fields=METADATA_FIELDS)
+            return metadata
+        return json.loads(data)
+
+    def read_processed_body(self):
+        """
+        Returns the stored processed body. get_processed_metadata() must have
+        been called first.
+        """
+        with timer("storage") as span:
+            with default_storage.open(
+                os.path.join(self.get_processed_path(), "body.html")
+            ) as fh:
+                body = fh.read()
+            span.size = len(body)
+        return body.decode("utf-8")
+
+    def iter_processed_body(self):
+        """
+        Returns an iterator of chunks of the stored processed body, as bytes.
+        """
+        return storage_read_chunks(
+            default_storage, os.path.join(self.get_processed_path(), "body.html")
+        )
 
     def is_expired(self):
         """
@@ -445,6 +1269,26 @@ class Render(models.Model):
         """
         return self.created_at <= _get_expired_date()
 
+    def is_outdated(self):
+        """
+        Returns True if this render should be replaced, because the paper
+        has a newer version or, failing that, because it has expired.
+        Failed renders expire after PAPERS_FAILED_EXPIRED_HOURS instead.
+
+        Deploying a new Engrafo image doesn't make renders outdated, because
+        the next view of every paper would then start a render. Use
+        `rerender --older-image` to replace them at a steady rate instead.
+        """
+        if self.arxiv_version is not None and (
+            self.arxiv_version < self.paper.arxiv_version
+        ):
+            return True
+        if self.state == Render.STATE_FAILURE:
+            retry_delta = datetime.timedelta(hours=settings.PAPERS_FAILED_EXPIRED_HOURS)
+            if self.created_at <= timezone.now() - retry_delta:
+                return True
+        return self.is_expired()
+
     def mark_as_deleted(self):
         """
         Delete render's output and mark is as deleted.
@@ -468,8 +1312,48 @@ class Render(models.Model):
         """
         if not self.state == Render.STATE_SUCCESS:
             return
-        for render in self.paper.renders.not_deleted().filter(pk__lt=self.pk):
-            render.mark_as_deleted()
+        self.paper.renders.not_deleted().filter(pk__lt=self.pk).mark_as_deleted()
+
+
+class RenderDiagnostics(models.Model):
+    """
+    What Docker reported about a render's container. The logs can be
+    hundreds of kilobytes of LaTeX output and are only needed for debugging,
+    so they are kept out of the Render table that the paper page queries.
+    """
+
+    render = models.OneToOneField(
+        Render,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="diagnostics",
+    )
+    container_inspect = JSONField(null=True, blank=True)
+    container_logs_path = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="Path in storage of the gzipped container logs.",
+    )
+    # Logs of renders from before they were stored in storage
+    container_logs = models.TextField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = "render diagnostics"
+
+    def __str__(self):
+        return f"Diagnostics for render {self.render_id}"
+
+    def get_container_logs(self):
+        """
+        Returns the container logs as a string, or None if they haven't
+        been saved.
+        """
+        if not self.container_logs_path:
+            return self.container_logs
+        with default_storage.open(self.container_logs_path) as fh:
+            logs = gzip.decompress(fh.read())
+        return logs.decode("utf-8", errors="replace")
 
 
 class SourceFileBulkTarball(models.Model):
@@ -504,24 +1388,36 @@ class SourceFileBulkTarball(models.Model):
         return self.num_items == self.sourcefile_set.count()
 
 
+def get_checksum(file):
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
 class SourceFileQuerySet(models.QuerySet):
-    def get_or_download(self, arxiv_id):
+    def get_or_download(self, arxiv_id, arxiv_version=None):
         """
         Returns a source file for an arxiv ID if it exists (probably created
         from a bulk source download), otherwise downloads and creates it.
+        If it exists but is older than `arxiv_version`, it is downloaded
+        again.
         """
         try:
-            return self.get(arxiv_id=arxiv_id)
+            source_file = self.get(arxiv_id=arxiv_id)
         except SourceFile.DoesNotExist:
-            return self.download_and_create(arxiv_id)
+            return self.download_and_create(arxiv_id, arxiv_version=arxiv_version)
+        if source_file.is_older_than(arxiv_version):
+            source_file.download(arxiv_version=arxiv_version)
+        return source_file
 
-    def download_and_create(self, arxiv_id):
+    def download_and_create(self, arxiv_id, arxiv_version=None):
         """
         Download the LaTeX source of this paper, save to storage, and create
         SourceFile.
         """
         file = download_source_file(arxiv_id)
-        return self.create(arxiv_id=arxiv_id, file=file)
+        return self.create(arxiv_id=arxiv_id, file=file, arxiv_version=arxiv_version)
 
     def filename_exists(self, fn):
         return self.filter(file=f"source-files/{fn}").exists()
@@ -538,6 +1434,17 @@ class SourceFile(models.Model):
 
     arxiv_id = models.CharField(max_length=50, unique=True)
     file = models.FileField(upload_to="source-files/", unique=True)
+    checksum = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text="SHA-256 of the file. Set when the file is saved.",
+    )
+    arxiv_version = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="Version of the paper the file is, if known. arXiv serves the latest version.",
+    )
     bulk_tarball = models.ForeignKey(
         SourceFileBulkTarball,
         on_delete=models.SET_NULL,
@@ -551,6 +1458,39 @@ class SourceFile(models.Model):
     def __str__(self):
         return str(self.file)
 
+    def save(self, *args, **kwargs):
+        # Hash new files before they are uploaded
+        if self.file and not self.file._committed:
+            self.checksum = get_checksum(self.file)
+        super(SourceFile, self).save(*args, **kwargs)
+
+    def is_older_than(self, arxiv_version):
+        """
+        Returns True if this file is known to be of an earlier version of
+        the paper than `arxiv_version`.
+        """
+        return (
+            self.arxiv_version is not None
+            and arxiv_version is not None
+            and self.arxiv_version < arxiv_version
+        )
+
+    def download(self, arxiv_version=None):
+        """
+        Download the latest version of this file from arXiv, replacing it.
+        """
+        self.file = download_source_file(self.arxiv_id)
+        self.arxiv_version = arxiv_version
+        self.save()
+
+    def get_source_cache_path(self):
+        """
+        Path of this file in the source cache on render hosts, or None if it
+        doesn't have a checksum yet.
+        """
+        if self.checksum:
+            return get_source_cache_path(self.checksum, self.file.name)
+
     def is_pdf(self):
         return self.file.name.endswith(".pdf")
 
@@ -565,3 +1505,217 @@ class SourceFile(models.Model):
             and not name.endswith(".ps.gz")
             and not name.endswith(".dvi.gz")
         )
+
+
+class CachedSourceFileQuerySet(models.QuerySet):
+    def cached_paths(self, source_files):
+        """
+        Returns the set of (host, path) of the given source files that are in
+        source caches. Empty if there is no PAPERS_SOURCE_CACHE_VOLUME.
+        """
+        if not settings.PAPERS_SOURCE_CACHE_VOLUME:
+            return set()
+        paths = [source_file.get_source_cache_path() for source_file in source_files]
+        return set(
+            self.filter(path__in=[path for path in paths if path]).values_list(
+                "host", "path"
+            )
+        )
+
+    def add(self, host, source_file):
+        """
+        Put a source file in a host's source cache, or mark it as used if it
+        is already there, then evict files if the cache is over
+        PAPERS_SOURCE_CACHE_MAX_BYTES.
+        """
+        data = None
+        if source_file.checksum is None:
+            # Files saved before they had checksums
+            with source_file.file.open() as fh:
+                data = fh.read()
+            source_file.checksum = hashlib.sha256(data).hexdigest()
+            source_file.save(update_fields=["checksum"])
+
+        path = source_file.get_source_cache_path()
+        now = timezone.now()
+        if self.filter(host=host, path=path).update(last_used_at=now):
+            return
+
+        if data is None:
+            with source_file.file.open() as fh:
+                data = fh.read()
+        add_to_source_cache(path, data, host=host)
+        # watch_render_events and the update_render_state sweep can both
+        # get here for the same render, so it may have been added since
+        _, created = self.get_or_create(
+            host=host, path=path, defaults={"size": len(data), "last_used_at": now}
+        )
+        if created:
+            self.evict(host)
+
+    def evict(self, host):
+        """
+        Remove the least recently used files from a host's source cache
+        until it is under PAPERS_SOURCE_CACHE_MAX_BYTES. Files that running
+        renders are using are kept. Returns the paths that were removed.
+        """
+        max_bytes = settings.PAPERS_SOURCE_CACHE_MAX_BYTES
+        cached = self.filter(host=host)
+        if (cached.aggregate(size=models.Sum("size"))["size"] or 0) <= max_bytes:
+            return []
+
+        in_use = {
+            render.paper.source_file.get_source_cache_path()
+            for render in Render.objects.running()
+            .filter(host=host)
+            .select_related("paper__source_file")
+        }
+        total = 0
+        evicted = []
+        for cached_source_file in cached.order_by("-last_used_at"):
+            total += cached_source_file.size
+            if total > max_bytes and cached_source_file.path not in in_use:
+                evicted.append(cached_source_file)
+        if not evicted:
+            return []
+
+        # Remove them from the database first, so new renders don't use them
+        self.filter(id__in=[c.id for c in evicted]).delete()
+        paths = [cached_source_file.path for cached_source_file in evicted]
+        remove_from_source_cache(paths, host=host)
+        return paths
+
+
+class CachedSourceFile(models.Model):
+    """
+    A source file in the source cache (PAPERS_SOURCE_CACHE_VOLUME) of a
+    render host.
+    """
+
+    host = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        help_text="Docker host the file is cached on. Empty if it is DOCKER_HOST.",
+    )
+    path = models.CharField(
+        max_length=255, help_text="Path in the cache, from get_source_cache_path()."
+    )
+    size = models.BigIntegerField()
+    last_used_at = models.DateTimeField()
+
+    objects = CachedSourceFileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["host", "last_used_at"], name="papers_cach_host_used_idx"
+            ),
+            models.Index(fields=["path"], name="papers_cach_path_idx"),
+        ]
+        # NULL hosts are never equal to each other, so DOCKER_HOST needs its
+        # own constraint
+        constraints = [
+            models.UniqueConstraint(
+                fields=["host", "path"],
+                condition=models.Q(host__isnull=False),
+                name="papers_cach_host_path_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["path"],
+                condition=models.Q(host__isnull=True),
+                name="papers_cach_path_uniq",
+            ),
+        ]
+
+    def __str__(self):
+        return self.path
+
+
+ACTIVE_IMAGE_CACHE_KEY = "engrafo-image:active"
+# Other processes see a deploy within this long, if they have their own cache
+ACTIVE_IMAGE_CACHE_SECONDS = 60
+
+
+class EngrafoImageQuerySet(models.QuerySet):
+    def get_active_digest(self):
+        """
+        Returns the ID of the image new renders run with, or None to run
+        ENGRAFO_IMAGE. It is cached, because every render checks it, and
+        deploy() clears the cache.
+        """
+        digest = cache.get(ACTIVE_IMAGE_CACHE_KEY)
+        if digest is None:
+            digest = (
+                self.filter(is_active=True)
+                .order_by("-created_at")
+                .values_list("digest", flat=True)
+                .first()
+            ) or ""
+            cache.set(ACTIVE_IMAGE_CACHE_KEY, digest, ACTIVE_IMAGE_CACHE_SECONDS)
+        return digest or None
+
+    def deploy(self):
+        """
+        Pull ENGRAFO_IMAGE on all the render hosts, then switch new renders
+        to it. Raises EngrafoImageError without switching if the hosts
+        don't agree on what the tag is, because it moved while it was being
+        pulled. Returns the EngrafoImage.
+        """
+        images = pull_image()
+        digests = {image.id for image in images.values()}
+        if len(digests) != 1:
+            raise EngrafoImageError(
+                f"Render hosts pulled different images for {settings.ENGRAFO_IMAGE}: "
+                + ", ".join(sorted(digests))
+            )
+        digest = digests.pop()
+        with transaction.atomic():
+            image, _ = self.update_or_create(
+                digest=digest,
+                defaults={"name": settings.ENGRAFO_IMAGE, "is_removed": False},
+            )
+            self.exclude(id=image.id).update(is_active=False)
+            self.filter(id=image.id).update(is_active=True)
+        cache.delete(ACTIVE_IMAGE_CACHE_KEY)
+        image.is_active = True
+        return image
+
+    def prune(self):
+        """
+        Remove images that renders no longer run with from all the render
+        hosts, once no running render is using them. Returns the images that
+        were removed.
+        """
+        in_use = set(Render.objects.running().values_list("image_digest", flat=True))
+        removed = []
+        for image in self.filter(is_active=False, is_removed=False):
+            if image.digest in in_use:
+                continue
+            if remove_image(image.digest):
+                image.is_removed = True
+                image.save()
+                removed.append(image)
+        return removed
+
+
+class EngrafoImage(models.Model):
+    """
+    A version of the Engrafo image that has been pulled on the render hosts
+    by EngrafoImage.objects.deploy().
+    """
+
+    name = models.CharField(max_length=255, help_text="The tag that was pulled.")
+    digest = models.CharField(max_length=255, unique=True, help_text="Image ID.")
+    created_at = models.DateTimeField(auto_now_add=True)
+    is_active = models.BooleanField(
+        default=False, help_text="Whether new renders run with this image."
+    )
+    is_removed = models.BooleanField(
+        default=False, help_text="Whether it has been removed from the render hosts."
+    )
+
+    objects = EngrafoImageQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.name} ({self.digest})"
@@ -1,81 +1,164 @@
 from django.urls import reverse
 import lxml.html
-from itertools import chain
 import os
 import re
 from ..scraper.arxiv_ids import ARXIV_URL_RE
 
+# Processed renders are stored, keyed by this. Bump it when the output of
+# process_render() changes so papers get processed again.
+PROCESSOR_VERSION = 5
+
+# Images at the start of the body that aren't lazy loaded, because they may
+# be on screen when the page loads
+EAGER_IMAGES = 2
+
+# Elements whose text isn't words in the paper
+NON_TEXT_TAGS = {"script", "style"}
+
+# Classes of LaTeXML sections, and their level in the outline
+SECTION_LEVELS = {
+    "ltx_section": 1,
+    "ltx_appendix": 1,
+    "ltx_bibliography": 1,
+    "ltx_subsection": 2,
+    "ltx_subsubsection": 3,
+}
+
 EMAIL_RE = re.compile(
     r"[a-z0-9!#$%&'*+/=?^_`{|}~,-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|},~-]+)*@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?"
 )
 
 
-def process_render(fh, path_prefix, context):
+def process_render(fh, path_prefix, context, images=None):
     """
     Do some final processing on the rendered paper:
     * extract scripts/styles/body
     * rewrite URLs to add a prefix
+    * lazy load images, with sizes and srcsets from `images` if given (see
+      images.generate_image_variants())
+    * remove emails from the body, including from attributes
+    * extract metadata: abstract, first image, word and figure counts, and
+      an outline of sections
+
+    Papers can be huge, so it is done in a single pass over the document and
+    the body is serialized once.
     """
     html = lxml.html.parse(fh)
     head = html.find("head")
+    body = html.find("body")
 
     abstract = None
     first_image = None
+    word_count = 0
+    figure_count = 0
+    outline = []
+    mailto_links = []
+    body_images = 0
+
+    # The head comes before the body in document order, so everything after
+    # we reach the body is in it
+    in_body = False
+    for el in html.getroot().iter():
+        if el is body:
+            in_body = True
+
+        tag = el.tag
+        if in_body:
+            # Remove all emails
+            if el.text and "@" in el.text:
+                el.text = EMAIL_RE.sub("", el.text)
+            if el.tail and "@" in el.tail:
+                el.tail = EMAIL_RE.sub("", el.tail)
+            for name, value in el.attrib.items():
+                if "@" in value:
+                    el.attrib[name] = EMAIL_RE.sub("", value)
+
+            if el.text and isinstance(tag, str) and tag not in NON_TEXT_TAGS:
+                word_count += len(el.text.split())
+            if el.tail and el is not body:
+                word_count += len(el.tail.split())
+        if tag == "a" and "href" in el.attrib:
+            href = el.attrib["href"]
+            # remove mailto: links. Dropping them now would upset iter().
+            if href.startswith("mailto:"):
+                mailto_links.append(el)
+                continue
+
+            # Turn arxiv.org links into vanity links
+            match = ARXIV_URL_RE.search(href)
+            if match:
+                arxiv_id = match.group(1)
+                el.attrib["href"] = reverse("paper_detail", args=(arxiv_id,))
+
+            # Open all links in new windows
+            el.attrib["target"] = "_blank"
+
+        elif tag == "img" and "src" in el.attrib:
+            src = el.attrib["src"]
+            if not src.startswith("data:"):
+                if images and src in images:
+                    add_image_size(el, images[src], path_prefix)
+                el.attrib["src"] = os.path.join(path_prefix, src)
+            if in_body:
+                # Most figures are a long way down the page
+                if body_images >= EAGER_IMAGES:
+                    el.attrib["loading"] = "lazy"
+                el.attrib["decoding"] = "async"
+                body_images += 1
+            # For opengraph tags
+            if first_image is None:
+                parent = el.getparent()
+                if parent.tag == "figure" and parent.get("class") == "ltx_figure":
+                    first_image = el.attrib["src"]
+
+        elif tag == "div" and abstract is None and el.get("class") == "ltx_abstract":
+            # For opengraph tags. Its children haven't been visited yet, so
+            # this is the abstract as Engrafo rendered it.
+            first_paragraph = el.find("p")
+            if first_paragraph is not None:
+                abstract = first_paragraph.text_content()
+
+        elif tag == "figure" and "ltx_figure" in el.get("class", "").split():
+            figure_count += 1
+
+        elif tag == "section" and el.get("id"):
+            classes = el.get("class", "").split()
+            level = next(
+                (SECTION_LEVELS[c] for c in classes if c in SECTION_LEVELS), None
+            )
+            title = next(
+                (
+                    child
+                    for child in el
+                    if "ltx_title" in (child.get("class") or "").split()
+                ),
+                None,
+            )
+            if level is not None and title is not None:
+                outline.append(
+                    {
+                        "id": el.get("id"),
+                        "title": " ".join(title.text_content().split()),
+                        "level": level,
+                    }
+                )
 
-    # Add prefixes
-    for el in html.xpath("//link[@href]"):
-        el.attrib["href"] = os.path.join(path_prefix, el.attrib["href"])
-
-    for el in html.xpath("//script[@src]"):
-        el.attrib["src"] = os.path.join(path_prefix, el.attrib["src"])
-        # lxml will turn it into <script /> without this, which seems to be invalid html
-        el.text = ""
+        elif tag == "link" and "href" in el.attrib:
+            el.attrib["href"] = os.path.join(path_prefix, el.attrib["href"])
 
-    for el in html.xpath("//img[@src]"):
-        if not el.attrib["src"].startswith("data:"):
+        elif tag == "script" and "src" in el.attrib:
             el.attrib["src"] = os.path.join(path_prefix, el.attrib["src"])
+            # lxml will turn it into <script /> without this, which seems to be invalid html
+            el.text = ""
 
-    for el in html.xpath("//a[@href]"):
-        # remove mailto: links
-        if el.attrib["href"].startswith("mailto:"):
-            el.drop_tag()
-            continue
-
-        # Turn arxiv.org links into vanity links
-        match = ARXIV_URL_RE.search(el.attrib["href"])
-        if match:
-            arxiv_id = match.group(1)
-            el.attrib["href"] = reverse("paper_detail", args=(arxiv_id,))
-
-        # Open all links in new windows
-        el.attrib["target"] = "_blank"
-
-    # Stuff for opengraph tags
-    abstract = None
-    abstract_tag = html.find(".//div[@class='ltx_abstract']")
-    if abstract_tag is not None:
-        first_paragraph = abstract_tag.find("p")
-        if first_paragraph is not None:
-            abstract = first_paragraph.text_content()
-
-    first_image = None
-    for figure in html.xpath("//figure[@class='ltx_figure']"):
-        img = figure.find("img")
-        if img is not None:
-            first_image = img.attrib["src"]
-            break
-
-    body = stringify_children(html.find("body"))
-
-    # Remove all emails
-    # Can't figure out how to do this elegantly with lxml
-    body = EMAIL_RE.sub("", body)
+    for el in mailto_links:
+        el.drop_tag()
 
     return {
         # FIXME: This should be str but it's bytes for some reason.
         # It's very odd - BeautifulSoup's docs insists everything is unicode,
         #  and even trying to force the input to be utf-8 doesn't help.
-        "body": body,
+        "body": inner_html(body),
         # just links, styles, and scripts in <head> so we can re-insert in arxiv vanity <head>
         #  stuff that's in the <body> gets included above
         "links": "".join(to_string(e) for e in head.findall("link")),
@@ -83,30 +166,52 @@ def process_render(fh, path_prefix, context):
         "scripts": "".join(to_string(e) for e in head.findall("script")),
         "abstract": abstract,
         "first_image": first_image,
+        "word_count": word_count,
+        "figure_count": figure_count,
+        "outline": outline,
     }
 
 
+def add_image_size(el, image, path_prefix):
+    """
+    Add width and height to an image if Engrafo didn't, so the page doesn't
+    jump around as it loads, and a srcset of its variants.
+    """
+    if "width" not in el.attrib and "height" not in el.attrib:
+        el.attrib["width"] = str(image["width"])
+        el.attrib["height"] = str(image["height"])
+    if not image["variants"]:
+        return
+    candidates = [
+        f"{os.path.join(path_prefix, path)} {width}w"
+        for width, path in sorted(
+            image["variants"].items(), key=lambda item: int(item[0])
+        )
+    ]
+    candidates.append(
+        f"{os.path.join(path_prefix, el.attrib['src'])} {image['width']}w"
+    )
+    el.attrib["srcset"] = ", ".join(candidates)
+    # Figures are shrunk to fit narrow screens
+    try:
+        display_width = int(el.get("width"))
+    except (TypeError, ValueError):
+        display_width = image["width"]
+    el.attrib["sizes"] = f"(max-width: {display_width}px) 100vw, {display_width}px"
+
+
 def to_string(e):
     return lxml.html.tostring(e, encoding="unicode")
 
 
-# https://stackoverflow.com/questions/4624062/get-all-text-inside-a-tag-in-lxml
-def stringify_children(node):
-    return "".join(
-        chunk
-        for chunk in chain(
-            (node.text,),
-            chain(
-                *(
-                    (
-                        lxml.etree.tostring(child, with_tail=False, encoding="unicode"),
-                        child.tail,
-                    )
-                    for child in node.getchildren()
-                )
-            ),
-            (node.tail,),
-        )
-        if chunk
-    )
-
+def inner_html(node):
+    """
+    Serialize the contents of an element, followed by its tail.
+    """
+    s = lxml.etree.tostring(node, encoding="unicode", with_tail=False)
+    # Elements with no content are serialized as <tag/>
+    if s.endswith(f"</{node.tag}>"):
+        s = s[s.index(">") + 1 : -len(f"</{node.tag}>")]
+    else:
+        s = ""
+    return s + (node.tail or "")
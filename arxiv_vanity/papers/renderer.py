@@ -1,29 +1,55 @@
+import collections
 import datetime
+import io
+import logging
 import os
 import shlex
+import tarfile
+import time
+import dateutil.parser
 import docker
 from docker.tls import TLSConfig
 from django.conf import settings
+from gevent.pool import Pool
+import requests
 import tempfile
-from ..utils import log_exception
+from ..utils import catch_exceptions, log_exception
+
+logger = logging.getLogger(__name__)
 
 
 class TooManyRendersRunningError(Exception):
     """More than PAPERS_MAX_RENDERS_RUNNING are running"""
 
 
+# Labels on render containers. RENDER_LABEL is on all of them, so they can
+# be told apart from anything else running on the Docker host.
+RENDER_LABEL = "org.arxiv-vanity.render"
+RENDER_ID_LABEL = "org.arxiv-vanity.render-id"
+ARXIV_ID_LABEL = "org.arxiv-vanity.arxiv-id"
+# Unix timestamp after which the container is removed
+DEADLINE_LABEL = "org.arxiv-vanity.deadline"
+
+# Container events that mean a render has finished
+RENDER_EVENTS = ["die", "destroy"]
+
+# Where PAPERS_SOURCE_CACHE_VOLUME is mounted in containers
+SOURCE_CACHE_MOUNT = "/source-cache"
+
+
 def env_to_file(env):
     with tempfile.NamedTemporaryFile(delete=False) as f:
         f.write(os.environ[env].encode("utf-8"))
         return f.name
 
 
-def create_client():
+def create_client(host=None):
     """
-    Create a client to either a Docker instance.
+    Create a client to a Docker host. `host` is a Docker URL, or None for
+    DOCKER_HOST.
     """
     kwargs = {
-        "base_url": os.environ.get("DOCKER_HOST"),
+        "base_url": host or os.environ.get("DOCKER_HOST"),
         "timeout": 15,  # wait a bit, but give up before 30s Heroku request timeout
     }
 
@@ -40,6 +66,122 @@ def create_client():
     return docker.DockerClient(**kwargs)
 
 
+def get_render_hosts():
+    """
+    Returns a dictionary of Docker hosts to run renders on -> how many
+    renders each can run at once, from PAPERS_RENDER_HOSTS. If that isn't
+    set, it is DOCKER_HOST (as None) with PAPERS_MAX_RENDERS_RUNNING.
+    """
+    if settings.PAPERS_RENDER_HOSTS:
+        return settings.PAPERS_RENDER_HOSTS
+    return {None: settings.PAPERS_MAX_RENDERS_RUNNING}
+
+
+# A host that can't be reached is warned about at most this often, because
+# it is counted on every render
+UNREACHABLE_HOST_WARNING_SECONDS = 60
+_unreachable_host_warned_at = {}
+
+
+def warn_unreachable_host(host, exc):
+    now = time.monotonic()
+    warned_at = _unreachable_host_warned_at.get(host)
+    if warned_at is not None and now - warned_at < UNREACHABLE_HOST_WARNING_SECONDS:
+        return
+    _unreachable_host_warned_at[host] = now
+    logger.warning("Render host %s can't be reached: %s", host or "DOCKER_HOST", exc)
+
+
+def count_running_renders():
+    """
+    Returns a dictionary of render hosts -> the number of render containers
+    running on them. Hosts that can't be reached are left out.
+    """
+    hosts = get_render_hosts()
+
+    def count(host):
+        try:
+            client = create_client(host)
+            # Only running containers are listed, without inspecting each one
+            containers = client.api.containers(filters={"label": RENDER_LABEL})
+        except (docker.errors.DockerException, requests.RequestException) as e:
+            # Down hosts are expected, so this isn't reported as an error
+            warn_unreachable_host(host, e)
+            return None
+        return host, len(containers)
+
+    return dict(
+        result for result in Pool(len(hosts)).imap_unordered(count, hosts) if result
+    )
+
+
+def choose_render_host(running=None):
+    """
+    Returns the Docker host to run a render on: the one running the smallest
+    proportion of its capacity. Raises TooManyRendersRunningError if no host
+    has capacity.
+
+    `running` is a dictionary of host -> the number of renders running on
+    it, by default from count_running_renders(). Hosts not in it are
+    skipped.
+    """
+    hosts = get_render_hosts()
+    if running is None:
+        running = count_running_renders()
+    available = [
+        (host, count / hosts[host])
+        for host, count in running.items()
+        if host in hosts and count < hosts[host]
+    ]
+    if not available:
+        raise TooManyRendersRunningError(
+            f"No render hosts have capacity ({len(running)} of {len(hosts)} reachable)"
+        )
+    return min(available, key=lambda result: result[1])[0]
+
+
+def parse_docker_timestamp(s):
+    """
+    Parse a timestamp from the Docker API into a datetime. Returns None if it
+    is empty or Docker's zero time, which is used for things that haven't
+    happened yet.
+    """
+    if not s or s.startswith("0001-01-01"):
+        return None
+    return dateutil.parser.parse(s)
+
+
+def read_container_logs(container, head_bytes, tail_bytes):
+    """
+    Stream a container's logs, keeping only the first `head_bytes` and last
+    `tail_bytes`, so a runaway TeX job can't fill up memory. The bytes left
+    out in the middle are replaced with a note saying how many there were.
+    """
+    head = bytearray()
+    tail = collections.deque()
+    tail_size = 0
+    total = 0
+    for chunk in container.logs(stream=True):
+        total += len(chunk)
+        if len(head) < head_bytes:
+            remaining = head_bytes - len(head)
+            head += chunk[:remaining]
+            chunk = chunk[remaining:]
+        if not chunk or not tail_bytes:
+            continue
+        tail.append(chunk)
+        tail_size += len(chunk)
+        # Drop chunks from the start that are entirely outside the tail
+        while tail_size - len(tail[0]) >= tail_bytes:
+            tail_size -= len(tail.popleft())
+
+    tail = b"".join(tail)[-tail_bytes:] if tail_bytes else b""
+    omitted = total - len(head) - len(tail)
+    if omitted:
+        return bytes(head) + f"\n\n[{omitted} bytes omitted]\n\n".encode() + tail
+    return bytes(head) + tail
+
+
 def make_command(source, output_path, webhook_url):
     command = [
         f"engrafo -o {shlex.quote(output_path)} {shlex.quote(source)}",
@@ -59,21 +201,124 @@ def make_command(source, output_path, webhook_url):
     return command
 
 
-def render_paper(
-    source, output_path, webhook_url=None, output_bucket=None, extra_run_kwargs=None
-):
+def get_render_labels(render_id=None, arxiv_id=None):
     """
-    Render a source directory using Engrafo.
+    Labels for a new render container. The deadline is
+    PAPERS_MAX_RENDER_TIME_MINS from now.
     """
-    client = create_client()
+    deadline = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        minutes=settings.PAPERS_MAX_RENDER_TIME_MINS
+    )
+    labels = {RENDER_LABEL: "true", DEADLINE_LABEL: str(int(deadline.timestamp()))}
+    if render_id is not None:
+        labels[RENDER_ID_LABEL] = str(render_id)
+    if arxiv_id is not None:
+        labels[ARXIV_ID_LABEL] = str(arxiv_id)
+    return labels
 
-    renders_running = client.info()["ContainersRunning"]
-    if renders_running >= settings.PAPERS_MAX_RENDERS_RUNNING:
-        raise TooManyRendersRunningError(
-            f"{renders_running} renders running, which is more than PAPERS_MAX_RENDERS_RUNNING"
+
+def get_container_deadline(container):
+    """
+    When a container from the containers API should be removed by, as a
+    timezone-aware datetime. Containers started before they had a deadline
+    label get PAPERS_MAX_RENDER_TIME_MINS from when they were created.
+    """
+    labels = container.get("Labels") or {}
+    if DEADLINE_LABEL in labels:
+        timestamp = int(labels[DEADLINE_LABEL])
+    else:
+        timestamp = container["Created"] + settings.PAPERS_MAX_RENDER_TIME_MINS * 60
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def get_source_cache_path(checksum, name):
+    """
+    Path of a source file in the source cache volume. Files are stored by
+    checksum, with their original name, because Engrafo uses the extension
+    to tell what kind of source it is.
+    """
+    return os.path.join(checksum, os.path.basename(name))
+
+
+def get_source_cache_volumes(mode):
+    return {
+        settings.PAPERS_SOURCE_CACHE_VOLUME: {"bind": SOURCE_CACHE_MOUNT, "mode": mode}
+    }
+
+
+def add_to_source_cache(path, data, host=None):
+    """
+    Write a file to the source cache volume on a Docker host. It is copied
+    into a container with the volume mounted, which is never started.
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w") as tar:
+        directory = tarfile.TarInfo(os.path.dirname(path))
+        directory.type = tarfile.DIRTYPE
+        directory.mode = 0o755
+        directory.mtime = int(time.time())
+        tar.addfile(directory)
+        info = tarfile.TarInfo(path)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+
+    client = create_client(host)
+    kwargs = {"command": "true", "volumes": get_source_cache_volumes("rw")}
+    try:
+        container = client.containers.create(
+            settings.PAPERS_SOURCE_CACHE_IMAGE, **kwargs
+        )
+    except docker.errors.ImageNotFound:
+        # Unlike run(), create() doesn't pull missing images
+        client.images.pull(settings.PAPERS_SOURCE_CACHE_IMAGE)
+        container = client.containers.create(
+            settings.PAPERS_SOURCE_CACHE_IMAGE, **kwargs
         )
+    try:
+        container.put_archive(SOURCE_CACHE_MOUNT, buf.getvalue())
+    finally:
+        container.remove(force=True)
 
-    labels = {}
+
+def remove_from_source_cache(paths, host=None):
+    """
+    Delete paths in the source cache volume on a Docker host.
+    """
+    client = create_client(host)
+    client.containers.run(
+        settings.PAPERS_SOURCE_CACHE_IMAGE,
+        ["rm", "-rf"] + [os.path.join(SOURCE_CACHE_MOUNT, path) for path in paths],
+        volumes=get_source_cache_volumes("rw"),
+        remove=True,
+    )
+
+
+def render_paper(
+    source,
+    output_path,
+    webhook_url=None,
+    output_bucket=None,
+    extra_run_kwargs=None,
+    render_id=None,
+    arxiv_id=None,
+    host=None,
+    cached_source=None,
+    image=None,
+):
+    """
+    Render a source directory using Engrafo on a Docker host (see
+    choose_render_host()). `render_id` and `arxiv_id` are put in labels on
+    the container. `image` is the image to run, by default ENGRAFO_IMAGE.
+
+    If `cached_source` is given, it is the path of the source in the
+    host's source cache (see get_source_cache_path()), which is rendered
+    instead of fetching `source` from storage.
+    """
+    client = create_client(host)
+
+    labels = get_render_labels(render_id=render_id, arxiv_id=arxiv_id)
     environment = {
         "BIBLIO_GLUTTON_URL": settings.BIBLIO_GLUTTON_URL,
         "GROBID_URL": settings.GROBID_URL,
@@ -102,6 +347,10 @@ def render_paper(
         # HOST_PWD is set in docker-compose.yml
         volumes[os.environ["HOST_PWD"]] = {"bind": "/mnt", "mode": "rw"}
 
+    if cached_source:
+        source = os.path.join(SOURCE_CACHE_MOUNT, cached_source)
+        volumes.update(get_source_cache_volumes("ro"))
+
     # If running on the local machine, we need to add the container to the same network
     # as the web app so it can call the callback
     if os.environ.get("DOCKER_HOST") == "unix:///var/run/docker.sock":
@@ -110,7 +359,7 @@ def render_paper(
     if extra_run_kwargs is None:
         extra_run_kwargs = {}
     return client.containers.run(
-        settings.ENGRAFO_IMAGE,
+        image or settings.ENGRAFO_IMAGE,
         "sh -c "
         + shlex.quote("; ".join(make_command(source, output_path, webhook_url))),
         volumes=volumes,
@@ -122,41 +371,120 @@ def render_paper(
     )
 
 
+def render_events(host=None, since=None):
+    """
+    Returns a stream of decoded Docker events for render containers
+    finishing on a host. `since` is a Unix timestamp to replay events from.
+    """
+    client = create_client(host)
+    return client.events(
+        since=since,
+        filters={"type": "container", "event": RENDER_EVENTS, "label": RENDER_LABEL},
+        decode=True,
+    )
+
+
 def pull_image():
-    client = create_client()
-    print(f"Pulling {settings.ENGRAFO_IMAGE}...")
-    return client.images.pull(settings.ENGRAFO_IMAGE)
+    """
+    Pull the Engrafo image on all the render hosts in parallel. Returns a
+    dictionary of host -> image. Raises if it fails on any of them.
+    """
+    hosts = get_render_hosts()
+
+    def pull(host):
+        client = create_client(host)
+        print(f"Pulling {settings.ENGRAFO_IMAGE} on {host or 'DOCKER_HOST'}...")
+        return host, client.images.pull(settings.ENGRAFO_IMAGE)
 
+    return dict(Pool(len(hosts)).map(pull, hosts))
 
-def prune_images():
-    client = create_client()
-    for image in client.images.list(filters={"dangling": True}):
-        image_id = image.attrs["Id"]
-        print(f"Removing {image_id}...")
+
+def remove_image(image):
+    """
+    Remove an image from all the render hosts. Returns False if a container
+    is using it on any of them, in which case it is left on that host.
+    """
+    removed = True
+    for host in get_render_hosts():
+        client = create_client(host)
         try:
-            client.images.remove(image_id)
+            client.images.remove(image)
+        except docker.errors.ImageNotFound:
+            pass
         except docker.errors.APIError as e:
             if e.response.status_code == 409:
-                print(f"Image {image_id} in use")
+                removed = False
             else:
                 raise
+    return removed
+
+
+def prune_images(keep=()):
+    """
+    Remove dangling images from all the render hosts, except the IDs in
+    `keep`.
+    """
+    for host in get_render_hosts():
+        client = create_client(host)
+        for image in client.images.list(filters={"dangling": True}):
+            image_id = image.attrs["Id"]
+            if image_id in keep:
+                continue
+            print(f"Removing {image_id}...")
+            try:
+                client.images.remove(image_id)
+            except docker.errors.APIError as e:
+                if e.response.status_code == 409:
+                    print(f"Image {image_id} in use")
+                else:
+                    raise
+
+
+def list_render_containers(client, include_unlabelled=False):
+    """
+    Returns the render containers on a Docker host, including stopped ones,
+    from the list containers API. If `include_unlabelled` is True,
+    containers started before they were labelled are found by their image
+    too, which is a second call to the API.
+    """
+    containers = client.api.containers(all=True, filters={"label": RENDER_LABEL})
+    if not include_unlabelled:
+        return containers
+    unlabelled = [
+        container
+        for container in client.api.containers(
+            all=True, filters={"ancestor": settings.ENGRAFO_IMAGE}
+        )
+        if RENDER_LABEL not in (container.get("Labels") or {})
+    ]
+    return containers + unlabelled
 
 
-def remove_long_running_containers():
+def remove_long_running_containers(include_unlabelled=False):
     """
     Sometimes either a container will get stuck, or the container can't
     be removed. So, just keep on sweeping up.
+
+    Containers from before render containers were labelled are only found
+    if `include_unlabelled` is True (see list_render_containers()).
     """
-    client = create_client()
-    for container in client.api.containers(all=True):
-        delta = datetime.datetime.now() - datetime.datetime.fromtimestamp(
-            container["Created"]
-        )
-        if delta > datetime.timedelta(minutes=settings.PAPERS_MAX_RENDER_TIME_MINS):
-            print(
-                f"Container {container['Id'][:12]} has been running for >{settings.PAPERS_MAX_RENDER_TIME_MINS} mins, force removing"
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for host in get_render_hosts():
+        try:
+            client = create_client(host)
+            containers = list_render_containers(
+                client, include_unlabelled=include_unlabelled
             )
-            try:
-                client.api.remove_container(container["Id"], force=True)
-            except:
-                log_exception()
+        except:
+            log_exception()
+            continue
+        for container in containers:
+            deadline = get_container_deadline(container)
+            if now > deadline:
+                print(
+                    f"Container {container['Id'][:12]} is past its deadline of {deadline.isoformat()}, force removing"
+                )
+                try:
+                    client.api.remove_container(container["Id"], force=True)
+                except:
+                    log_exception()
@@ -1,4 +1,7 @@
+from functools import lru_cache
 from django import template
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
 import randomcolor
 
 register = template.Library()
@@ -46,12 +49,40 @@ CATEGORY_NAMES = {
     'stat.ML': 'Machine Learning',
 }
 
-@register.inclusion_tag('papers/templatetags/category_badge.html')
-def category_badge(category):
+
+def get_category_color(category):
+    """
+    A colour for a category. It is seeded by the category, so it is always
+    the same, but generating it is slow.
+    """
+    return randomcolor.RandomColor(category).generate(luminosity='dark')[0]
+
+
+# Generated once per process. Unknown categories don't get a badge, so
+# these are the only colours that are needed.
+CATEGORY_COLORS = {
+    category: get_category_color(category) for category in CATEGORY_NAMES
+}
+
+
+@lru_cache(maxsize=1024)
+def render_category_badge(category):
     if category not in CATEGORY_NAMES:
-        return {}
-    return {
-        'category': category,
-        'name': CATEGORY_NAMES[category],
-        'color': randomcolor.RandomColor(category).generate(luminosity='dark')[0],
-    }
+        return ''
+    return render_to_string(
+        'papers/templatetags/category_badge.html',
+        {
+            'category': category,
+            'name': CATEGORY_NAMES[category],
+            'color': CATEGORY_COLORS[category],
+        },
+    )
+
+
+@register.simple_tag
+def category_badge(category):
+    """
+    A badge for an arXiv category. The HTML for each category is rendered
+    once and then reused, because the paper list has hundreds of them.
+    """
+    return mark_safe(render_category_badge(category))
@@ -0,0 +1,110 @@
+import datetime
+from unittest import mock
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from ..models import Paper, Render, RenderDiagnostics
+from .utils import create_paper, create_render, create_source_file
+
+
+class PaperAdminTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.force_login(user)
+
+    def create_paper_with_renders(self):
+        paper = create_paper()
+        paper.source_file = create_source_file(file=f"{paper.arxiv_id}.tar.gz")
+        paper.save()
+        create_render(paper=paper, state=Render.STATE_SUCCESS)
+        create_render(paper=paper, state=Render.STATE_FAILURE)
+        return paper
+
+    def get_changelist_queries(self, url="/admin/papers/paper/"):
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return len(ctx.captured_queries), res.content.decode("utf-8")
+
+    def test_changelist_does_not_query_per_row(self):
+        self.create_paper_with_renders()
+        num_queries, _ = self.get_changelist_queries()
+        for _ in range(5):
+            self.create_paper_with_renders()
+        num_queries_more_papers, content = self.get_changelist_queries()
+        self.assertEqual(num_queries, num_queries_more_papers)
+        self.assertEqual(content.count(">failure</a>"), 6)
+
+    def test_changelist_with_has_successful_render_filter(self):
+        self.create_paper_with_renders()
+        create_paper(title="Paper with no renders")
+        _, content = self.get_changelist_queries(
+            "/admin/papers/paper/?has_successful_render=0"
+        )
+        self.assertIn("Paper with no renders", content)
+        self.assertEqual(content.count(">failure</a>"), 0)
+
+    def test_render_action(self):
+        paper1 = create_paper(source_file=create_source_file(file="foo.tar.gz"))
+        paper2 = create_paper(source_file=create_source_file(file="foo.pdf"))
+        with mock.patch(
+            "arxiv_vanity.papers.models.render_paper"
+        ) as mock_render, mock.patch(
+            "arxiv_vanity.papers.models.count_running_renders",
+            return_value={None: 0},
+        ):
+            mock_render.return_value.id = "abc123"
+            res = self.client.post(
+                "/admin/papers/paper/",
+                {
+                    "action": "render",
+                    "_selected_action": [paper1.pk, paper2.pk],
+                },
+                follow=True,
+            )
+        self.assertIn(
+            "1 successfully rendered. 1 not renderable.", res.content.decode("utf-8")
+        )
+        mock_render.assert_called_once()
+        render = paper1.renders.get()
+        self.assertEqual(render.state, Render.STATE_RUNNING)
+        self.assertEqual(render.container_id, "abc123")
+        self.assertFalse(paper2.renders.exists())
+
+
+class RenderAdminTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_superuser("admin", "admin@example.com", "admin")
+        self.client.force_login(user)
+
+    def test_changelist_shows_timing_stats(self):
+        render = create_render(state=Render.STATE_SUCCESS)
+        render.duration_ms = 12345
+        render.save()
+        res = self.client.get("/admin/papers/render/")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("12.3s median", res.content.decode("utf-8"))
+
+    def test_changelist_timing_stats_are_for_recent_renders(self):
+        render = create_render(state=Render.STATE_SUCCESS)
+        render.duration_ms = 12345
+        render.save()
+        Render.objects.filter(id=render.id).update(
+            created_at=timezone.now() - datetime.timedelta(days=8)
+        )
+        res = self.client.get("/admin/papers/render/")
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("12.3s median", res.content.decode("utf-8"))
+
+    def test_change_view_shows_diagnostics(self):
+        render = create_render(state=Render.STATE_FAILURE)
+        res = self.client.get(f"/admin/papers/render/{render.id}/change/")
+        self.assertEqual(res.status_code, 200)
+
+        RenderDiagnostics.objects.create(
+            render=render, container_logs="! Undefined control sequence."
+        )
+        res = self.client.get(f"/admin/papers/render/{render.id}/change/")
+        self.assertIn("! Undefined control sequence.", res.content.decode("utf-8"))
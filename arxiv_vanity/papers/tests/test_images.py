@@ -0,0 +1,70 @@
+import io
+import shutil
+import tempfile
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase
+from gevent import get_hub
+from PIL import Image
+from unittest import mock
+from ..images import generate_image_variants, resize_image
+
+
+def image_file(width, height, format="PNG"):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(buf, format=format)
+    return ContentFile(buf.getvalue())
+
+
+class GenerateImageVariantsTest(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(location=self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_generate_image_variants(self):
+        self.storage.save("render-output/1/x1.png", image_file(1200, 600))
+        self.storage.save(
+            "render-output/1/figures/x2.jpg", image_file(400, 300, "JPEG")
+        )
+        self.storage.save("render-output/1/index.html", ContentFile(b""))
+
+        images = generate_image_variants(self.storage, "render-output/1", [480, 960])
+
+        self.assertEqual(
+            images,
+            {
+                "x1.png": {
+                    "width": 1200,
+                    "height": 600,
+                    "variants": {
+                        480: "variants/480/x1.png",
+                        960: "variants/960/x1.png",
+                    },
+                },
+                "figures/x2.jpg": {"width": 400, "height": 300, "variants": {}},
+            },
+        )
+        with self.storage.open("render-output/1/variants/480/x1.png") as fh:
+            self.assertEqual(Image.open(fh).size, (480, 240))
+
+        # Variants aren't treated as images of the render when run again
+        images = generate_image_variants(self.storage, "render-output/1", [480, 960])
+        self.assertEqual(set(images), {"x1.png", "figures/x2.jpg"})
+        # ...and replace the variants that are there, instead of saving them
+        # under another name
+        self.assertEqual(
+            self.storage.listdir("render-output/1/variants/480")[1], ["x1.png"]
+        )
+
+    def test_resizes_in_threadpool(self):
+        self.storage.save("render-output/1/x1.png", image_file(1200, 600))
+        threadpool = get_hub().threadpool
+        with mock.patch("arxiv_vanity.papers.images.get_hub") as mock_get_hub:
+            apply = mock_get_hub.return_value.threadpool.apply
+            apply.side_effect = threadpool.apply
+            images = generate_image_variants(self.storage, "render-output/1", [480])
+        apply.assert_called_once_with(resize_image, (mock.ANY, [480]))
+        self.assertEqual(images["x1.png"]["variants"], {480: "variants/480/x1.png"})
@@ -1,9 +1,29 @@
 import datetime
+import gzip
+import hashlib
+from unittest import mock
 from django.conf import settings
-from django.test import TestCase, override_settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.forms.models import model_to_dict
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import gevent
 import os
 import shutil
-from ..models import Render, Paper, SourceFile
+from PIL import Image
+from ..models import (
+    CachedSourceFile,
+    EngrafoImage,
+    EngrafoImageError,
+    Render,
+    Paper,
+    SourceFile,
+)
+from ..renderer import RENDER_ID_LABEL, RENDER_LABEL, TooManyRendersRunningError
+from ..fake_docker import FakeDockerHost
 from .utils import (
     create_paper,
     create_render,
@@ -57,6 +77,20 @@ class PaperTest(TestCase):
         mock_run.assert_not_called()
         self.assertEqual(render, render_returned)
 
+    def test_get_render_to_display_does_not_load_outline(self):
+        paper = create_paper(arxiv_id="1708.03313")
+        render = create_render(paper=paper, state=Render.STATE_SUCCESS)
+        outline = [{"id": "S1", "title": "1 Introduction", "level": 1}]
+        render.outline = outline
+        render.save()
+        render_returned = paper.get_render_to_display_and_render_if_needed()
+        self.assertEqual(render_returned, render)
+        self.assertIn("outline", render_returned.get_deferred_fields())
+        # Saving it doesn't clear the outline
+        render_returned.save()
+        render.refresh_from_db()
+        self.assertEqual(render.outline, outline)
+
     @patch_render_run()
     def test_get_render_to_display_with_unexpired_failed_render(self, mock_run):
         paper = create_paper(arxiv_id="1708.03313")
@@ -199,6 +233,35 @@ class RenderTest(TestCase):
             os.path.exists(os.path.join(settings.MEDIA_ROOT, render.get_html_path()))
         )
 
+    def test_queryset_mark_as_deleted(self):
+        paper = create_paper()
+        render1 = create_render_with_html(paper=paper)
+        render2 = create_render_with_html(paper=paper)
+        render3 = create_render_with_html(paper=paper)
+        other_render = create_render_with_html()
+
+        progress = []
+        Render.objects.filter(paper=paper).mark_as_deleted(
+            start=render1.id, chunk_size=1, progress=progress.append
+        )
+        self.assertEqual(progress, [render2.id, render3.id])
+
+        for render in [render1, render2, render3, other_render]:
+            render.refresh_from_db()
+        self.assertFalse(render1.is_deleted)
+        self.assertTrue(render2.is_deleted)
+        self.assertTrue(render3.is_deleted)
+        self.assertFalse(other_render.is_deleted)
+        self.assertTrue(
+            os.path.exists(os.path.join(settings.MEDIA_ROOT, render1.get_html_path()))
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(settings.MEDIA_ROOT, render2.get_html_path()))
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(settings.MEDIA_ROOT, render3.get_html_path()))
+        )
+
     def test_delete_older_renders_if_successful(self):
         paper = create_paper()
         render1 = create_render(paper=paper, state=Render.STATE_SUCCESS)
@@ -223,6 +286,473 @@ class RenderTest(TestCase):
         self.assertEqual(render1.is_deleted, False)
         self.assertEqual(render2.is_deleted, False)
 
+    @mock.patch.dict(os.environ, {"HOST_PWD": "/tmp"})
+    def test_run_renders_fills_hosts_to_capacity(self):
+        hosts = [FakeDockerHost().start() for _ in range(2)]
+        self.addCleanup(lambda: [host.stop() for host in hosts])
+        # Only render containers count
+        hosts[0].add_running_container(render=False)
+        source_file = create_source_file(file="foo.tar.gz")
+        # Has a host reserved by another process, but no container yet
+        reserved = create_render(
+            paper=create_paper(source_file=source_file), state=Render.STATE_RUNNING
+        )
+        reserved.host = hosts[1].url
+        reserved.save()
+        renders = [
+            Render.objects.create(paper=create_paper(source_file=source_file))
+            for _ in range(6)
+        ]
+
+        with override_settings(PAPERS_RENDER_HOSTS={h.url: 2 for h in hosts}):
+            started = Render.objects.run_renders(renders, concurrency=10)
+            with self.assertRaises(TooManyRendersRunningError):
+                Render.objects.create(paper=renders[0].paper).run()
+
+        self.assertEqual(len(started), 3)
+        self.assertEqual(
+            sorted(render.host for render in started),
+            sorted([hosts[0].url, hosts[0].url, hosts[1].url]),
+        )
+        self.assertEqual(hosts[0].running, 3)
+        self.assertEqual(hosts[1].running, 1)
+        unstarted = Render.objects.filter(state=Render.STATE_UNSTARTED)
+        self.assertEqual(unstarted.count(), 4)
+        self.assertFalse(unstarted.filter(host__isnull=False).exists())
+
+    def test_update_state_of_render_that_never_started(self):
+        render = create_render(state=Render.STATE_RUNNING)
+        # Still starting
+        render.update_state()
+        self.assertEqual(render.state, Render.STATE_RUNNING)
+
+        render.created_at = timezone.now() - datetime.timedelta(
+            minutes=settings.PAPERS_MAX_RENDER_TIME_MINS + 1
+        )
+        render.update_state()
+        render.refresh_from_db()
+        self.assertEqual(render.state, Render.STATE_FAILURE)
+        self.assertTrue(render.container_is_removed)
+
+    @mock.patch.dict(os.environ, {"HOST_PWD": "/tmp"})
+    def test_run_and_update_state_on_render_hosts(self):
+        hosts = [FakeDockerHost().start() for _ in range(2)]
+        self.addCleanup(lambda: [host.stop() for host in hosts])
+        hosts[0].add_running_container()
+        paper = create_paper(source_file=create_source_file(file="foo.tar.gz"))
+        render = Render.objects.create(paper=paper)
+
+        with override_settings(PAPERS_RENDER_HOSTS={h.url: 2 for h in hosts}):
+            render.run()
+        render.refresh_from_db()
+        self.assertEqual(render.host, hosts[1].url)
+        container = hosts[1].containers[render.container_id]
+        self.assertEqual(container["Config"]["Labels"][RENDER_LABEL], "true")
+
+        # Talks to the host the render is on, even if it isn't configured
+        hosts[1].exit(render.container_id, exit_code=1, logs=b"! LaTeX Error\n")
+        render.update_state()
+        self.assertEqual(render.state, Render.STATE_FAILURE)
+        self.assertTrue(render.container_is_removed)
+        self.assertEqual(hosts[1].containers, {})
+        self.assertEqual(
+            render.get_diagnostics().get_container_logs(), "! LaTeX Error\n"
+        )
+
+    def test_update_state_saves_diagnostics(self):
+        render = create_render(state=Render.STATE_RUNNING)
+        render.container_id = "abc123"
+        self.assertIsNone(render.get_diagnostics())
+        container = mock.Mock()
+        container.status = "running"
+        container.attrs = {"State": {"StartedAt": "2021-01-06T01:36:00Z"}}
+        container.logs.return_value = iter([b"LaTeX ", b"output"])
+        container.stats.return_value = {}
+        with mock.patch("arxiv_vanity.papers.models.create_client") as create_client:
+            create_client.return_value.containers.get.return_value = container
+            render.update_state()
+            diagnostics = Render.objects.get(id=render.id).get_diagnostics()
+            self.assertEqual(diagnostics.container_inspect, container.attrs)
+            # Logs aren't fetched until it has exited
+            self.assertIsNone(diagnostics.get_container_logs())
+            container.logs.assert_not_called()
+
+            container.status = "exited"
+            container.attrs = {"State": {"ExitCode": 1}}
+            render.update_state()
+            render.update_state()
+
+        diagnostics = Render.objects.get(id=render.id).get_diagnostics()
+        self.assertEqual(diagnostics.get_container_logs(), "LaTeX output")
+        container.logs.assert_called_once_with(stream=True)
+
+    def test_update_state_does_not_query_paper_per_render(self):
+        for container_id in ["abc", "def"]:
+            render = create_render(state=Render.STATE_RUNNING)
+            render.container_id = container_id
+            render.save()
+        with mock.patch(
+            "arxiv_vanity.papers.models.Render.update_state", Render.save
+        ), CaptureQueriesContext(connection) as ctx:
+            Render.objects.update_state()
+        # The paper is joined to the renders, not fetched for each one
+        paper_queries = [
+            q for q in ctx.captured_queries if 'FROM "papers_paper"' in q["sql"]
+        ]
+        self.assertEqual(paper_queries, [])
+
+    def test_record_exit(self):
+        paper = create_paper()
+        render = create_render(paper=paper, state=Render.STATE_RUNNING)
+        self.assertEqual(
+            Render.objects.latest_state_for_arxiv_id(paper.arxiv_id),
+            Render.STATE_RUNNING,
+        )
+        self.assertEqual(Render.objects.filter(id=render.id).record_exit(0), 1)
+        render.refresh_from_db()
+        self.assertEqual(render.state, Render.STATE_SUCCESS)
+        self.assertEqual(render.exit_code, 0)
+        finished_at = render.finished_at
+        self.assertIsNotNone(finished_at)
+        # The cached state is cleared
+        self.assertEqual(
+            Render.objects.latest_state_for_arxiv_id(paper.arxiv_id),
+            Render.STATE_SUCCESS,
+        )
+
+        # A second call doesn't move when it finished
+        Render.objects.filter(id=render.id).record_exit(1)
+        render.refresh_from_db()
+        self.assertEqual(render.state, Render.STATE_FAILURE)
+        self.assertEqual(render.finished_at, finished_at)
+
+        unstarted = create_render(paper=paper)
+        self.assertEqual(Render.objects.filter(id=unstarted.id).record_exit(0), 0)
+
+    @mock.patch.dict(os.environ, {"HOST_PWD": "/tmp"})
+    def test_update_state_after_webhook(self):
+        host = FakeDockerHost().start()
+        self.addCleanup(host.stop)
+        paper = create_paper(source_file=create_source_file(file="foo.tar.gz"))
+        old_render = create_render(paper=paper, state=Render.STATE_SUCCESS)
+        render = Render.objects.create(paper=paper)
+        with override_settings(PAPERS_RENDER_HOSTS={host.url: 1}):
+            render.run()
+
+        Render.objects.filter(id=render.id).record_exit(0)
+        render.refresh_from_db()
+        with mock.patch(
+            "arxiv_vanity.papers.models.Render.postprocess_output"
+        ) as postprocess_output:
+            # Nothing is done while the container is waiting for the webhook,
+            # apart from sampling its memory
+            render.update_state()
+            postprocess_output.assert_not_called()
+            self.assertFalse(render.container_is_removed)
+            self.assertEqual(render.peak_memory_bytes, 256 * 1024 * 1024)
+
+            host.exit(render.container_id, exit_code=0)
+            Render.objects.update_state()
+            postprocess_output.assert_called_once_with()
+
+        render.refresh_from_db()
+        old_render.refresh_from_db()
+        self.assertEqual(render.state, Render.STATE_SUCCESS)
+        self.assertTrue(render.container_is_removed)
+        self.assertEqual(host.containers, {})
+        self.assertTrue(old_render.is_deleted)
+
+    def test_update_state_from_event(self):
+        render = create_render(state=Render.STATE_RUNNING)
+        render.container_id = "abc"
+        render.save()
+        event = {
+            "id": "abc",
+            "Action": "die",
+            "Actor": {"ID": "abc", "Attributes": {"exitCode": "1"}},
+            "time": 1609897000,
+        }
+        with mock.patch("arxiv_vanity.papers.models.Render.update_state") as m:
+            self.assertEqual(Render.objects.update_state_from_event(event), render)
+            m.assert_called_once_with(exit_code="1")
+
+            m.reset_mock()
+            event["Action"] = "destroy"
+            Render.objects.update_state_from_event(event)
+            m.assert_called_once_with(exit_code=None)
+
+            # The render ID comes from the container's labels if it has them
+            m.reset_mock()
+            event["Actor"]["Attributes"][RENDER_ID_LABEL] = str(render.id + 1)
+            self.assertIsNone(Render.objects.update_state_from_event(event))
+            event["Actor"]["Attributes"][RENDER_ID_LABEL] = str(render.id)
+            self.assertEqual(Render.objects.update_state_from_event(event), render)
+            m.assert_called_once_with(exit_code=None)
+
+            m.reset_mock()
+            render.container_is_removed = True
+            render.save()
+            self.assertIsNone(Render.objects.update_state_from_event(event))
+            m.assert_not_called()
+
+    def test_update_telemetry_while_running(self):
+        render = create_render(state=Render.STATE_RUNNING)
+        container = mock.Mock()
+        container.status = "running"
+        container.attrs = {
+            "State": {
+                "StartedAt": "2021-01-06T01:36:00.123456789Z",
+                "FinishedAt": "0001-01-01T00:00:00Z",
+            }
+        }
+        container.stats.return_value = {"memory_stats": {"max_usage": 1234}}
+        render.update_telemetry(container)
+        self.assertEqual(
+            render.started_at,
+            datetime.datetime(
+                2021, 1, 6, 1, 36, 0, 123456, tzinfo=datetime.timezone.utc
+            ),
+        )
+        self.assertIsNone(render.finished_at)
+        self.assertEqual(render.peak_memory_bytes, 1234)
+
+        # Each sample keeps the highest
+        container.stats.return_value = {"memory_stats": {"max_usage": 5678}}
+        render.update_telemetry(container)
+        self.assertEqual(render.peak_memory_bytes, 5678)
+        container.stats.return_value = {"memory_stats": {}}
+        render.update_telemetry(container)
+        self.assertEqual(render.peak_memory_bytes, 5678)
+
+    def test_update_telemetry_from_exited_container(self):
+        render = create_render(state=Render.STATE_RUNNING)
+        container = mock.Mock()
+        container.status = "exited"
+        container.attrs = {
+            "State": {
+                "StartedAt": "2021-01-06T01:36:00Z",
+                "FinishedAt": "2021-01-06T01:37:00.5Z",
+            }
+        }
+        render.update_telemetry(container)
+        self.assertEqual(render.duration_ms, 60500)
+        self.assertIsNone(render.peak_memory_bytes)
+        container.stats.assert_not_called()
+
+    def test_timing_stats(self):
+        paper = create_paper()
+        created_at = datetime.datetime(2021, 1, 6, tzinfo=datetime.timezone.utc)
+        for i, duration in enumerate([10, 20, 30]):
+            render = create_render(paper=paper, state=Render.STATE_SUCCESS)
+            render.created_at = created_at + datetime.timedelta(minutes=i)
+            render.started_at = render.created_at + datetime.timedelta(seconds=2)
+            render.finished_at = render.started_at + datetime.timedelta(
+                seconds=duration
+            )
+            render.duration_ms = duration * 1000
+            render.save()
+
+        stats = Render.objects.timing_stats()
+        self.assertEqual(stats["render_time_p50"], 20)
+        self.assertEqual(stats["render_time_p95"], 29)
+        self.assertEqual(stats["queue_time_p50"], 2)
+        # Only the first render of the paper
+        self.assertEqual(stats["first_render_time_p50"], 12)
+
+    def test_timing_stats_without_renders(self):
+        stats = Render.objects.timing_stats()
+        self.assertIsNone(stats["render_time_p50"])
+        self.assertIsNone(stats["first_render_time_p95"])
+
+    def test_get_processed_render_with_compressed_html(self):
+        render = create_render_with_html()
+        path = os.path.join(TEST_MEDIA_ROOT, render.get_html_path())
+        with open(path, "rb") as f:
+            html = f.read()
+        with open(path, "wb") as f:
+            f.write(gzip.compress(html))
+        self.assertIn("body was inserted", render.get_processed_render()["body"])
+
+    @override_settings(PAPERS_IMAGE_VARIANT_WIDTHS=[100])
+    def test_processed_render_uses_image_variants(self):
+        render = create_render_with_html()
+        output_dir = os.path.join(TEST_MEDIA_ROOT, render.get_output_path())
+        Image.new("RGB", (200, 100)).save(os.path.join(output_dir, "x1.png"))
+        with open(os.path.join(output_dir, "index.html"), "w") as f:
+            f.write('<html><head></head><body><img src="x1.png"></body></html>')
+
+        self.assertIsNone(render.get_image_manifest())
+        render.generate_image_variants()
+        self.assertEqual(
+            render.get_image_manifest(),
+            {
+                "x1.png": {
+                    "width": 200,
+                    "height": 100,
+                    "variants": {"100": "variants/100/x1.png"},
+                }
+            },
+        )
+        body = render.get_processed_render()["body"]
+        self.assertIn('width="200" height="100"', body)
+        self.assertIn("variants/100/x1.png 100w", body)
+
+    def test_update_metadata(self):
+        render = create_render_with_html()
+        self.assertIsNone(render.word_count)
+
+        Render.objects.filter(id=render.id).update_metadata()
+
+        render.refresh_from_db()
+        self.assertEqual(render.abstract, render.get_processed_render()["abstract"])
+        self.assertGreater(render.word_count, 0)
+        self.assertIsNotNone(render.figure_count)
+        self.assertIsInstance(render.outline, list)
+
+
+class RenderHostCapacityTest(TransactionTestCase):
+    @mock.patch.dict(os.environ, {"HOST_PWD": "/tmp"})
+    def test_parallel_dispatch_doesnt_overfill_hosts(self):
+        hosts = [FakeDockerHost(latency=0.01).start() for _ in range(2)]
+        self.addCleanup(lambda: [host.stop() for host in hosts])
+        source_file = create_source_file(file="foo.tar.gz")
+        renders = [
+            Render.objects.create(paper=create_paper(source_file=source_file))
+            for _ in range(12)
+        ]
+
+        def dispatch(renders):
+            # Each greenlet has its own connection, like separate processes
+            try:
+                return Render.objects.run_renders(renders, concurrency=10)
+            finally:
+                connection.close()
+
+        with override_settings(PAPERS_RENDER_HOSTS={h.url: 2 for h in hosts}):
+            greenlets = [gevent.spawn(dispatch, renders[i::3]) for i in range(3)]
+            gevent.joinall(greenlets, raise_error=True)
+
+        self.assertEqual(sum(len(g.value) for g in greenlets), 4)
+        self.assertEqual([host.running for host in hosts], [2, 2])
+        self.assertEqual(Render.objects.running().count(), 4)
+
+
+class PaperVersionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def get_api_result(self, paper, **kwargs):
+        result = model_to_dict(paper, exclude=["id", "source_file", "is_deleted"])
+        result.update(kwargs)
+        return result
+
+    def test_render_is_outdated(self):
+        paper = create_paper(arxiv_version=2)
+        render = create_render(paper=paper)
+        render.arxiv_version = 2
+        render.image_digest = "sha256:old"
+        self.assertFalse(render.is_outdated())
+
+        paper.arxiv_version = 3
+        self.assertTrue(render.is_outdated())
+        paper.arxiv_version = 2
+
+        EngrafoImage.objects.create(
+            name="arxivvanity/engrafo", digest="sha256:new", is_active=True
+        )
+        cache.clear()
+        # Renders made with an older image are replaced by rerender instead
+        self.assertFalse(render.is_outdated())
+
+        # Renders from before versions were recorded fall back to expiry
+        render = create_render(paper=paper)
+        self.assertFalse(render.is_outdated())
+        render = create_render(paper=paper, is_expired=True)
+        self.assertTrue(render.is_outdated())
+
+    def test_made_with_older_image(self):
+        EngrafoImage.objects.create(
+            name="arxivvanity/engrafo", digest="sha256:new", is_active=True
+        )
+        cache.clear()
+        old = create_render(state=Render.STATE_SUCCESS)
+        old.image_digest = "sha256:old"
+        old.save()
+        legacy = create_render(state=Render.STATE_SUCCESS)
+        replaced = create_render(state=Render.STATE_SUCCESS)
+        replaced.image_digest = "sha256:old"
+        replaced.save()
+        new = create_render(paper=replaced.paper, state=Render.STATE_SUCCESS)
+        new.image_digest = "sha256:new"
+        new.save()
+        self.assertEqual(set(Render.objects.made_with_older_image()), {old, legacy})
+
+    @override_settings(PAPERS_EXPIRED_DAYS=90, PAPERS_FAILED_EXPIRED_HOURS=24)
+    def test_failed_render_is_outdated_sooner(self):
+        paper = create_paper()
+        render = create_render(paper=paper, state=Render.STATE_FAILURE)
+        self.assertFalse(render.is_outdated())
+
+        render.created_at = timezone.now() - datetime.timedelta(hours=25)
+        self.assertTrue(render.is_outdated())
+        render.state = Render.STATE_SUCCESS
+        self.assertFalse(render.is_outdated())
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_new_version_downloads_source_file(self):
+        self.addCleanup(shutil.rmtree, TEST_MEDIA_ROOT, ignore_errors=True)
+        source_file = SourceFile.objects.create(
+            arxiv_id="1234.5678", file=ContentFile(b"v1", name="1234.5678.tar.gz")
+        )
+        paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
+        self.assertTrue(paper.has_current_source_file())
+
+        paper, previous_version = Paper.objects.update_from_api(
+            self.get_api_result(paper)
+        )
+        self.assertEqual(previous_version, 1)
+        self.assertTrue(paper.has_current_source_file())
+
+        paper, previous_version = Paper.objects.update_from_api(
+            self.get_api_result(paper, arxiv_version=2)
+        )
+        self.assertEqual(previous_version, 1)
+        self.assertFalse(paper.has_current_source_file())
+
+        with mock.patch(
+            "arxiv_vanity.papers.models.download_source_file",
+            return_value=ContentFile(b"v2", name="1234.5678.tar.gz"),
+        ):
+            paper.get_or_download_source_file()
+        source_file.refresh_from_db()
+        self.assertEqual(source_file.arxiv_version, 2)
+        self.assertEqual(source_file.checksum, hashlib.sha256(b"v2").hexdigest())
+        self.assertTrue(paper.has_current_source_file())
+
+    def test_refresh_from_arxiv(self):
+        paper1 = create_paper(arxiv_id="1234.5678")
+        paper2 = create_paper(arxiv_id="1234.5679")
+        results = [
+            self.get_api_result(paper1, arxiv_version=2),
+            self.get_api_result(paper2),
+        ]
+        progress = mock.Mock()
+        with mock.patch(
+            "arxiv_vanity.papers.models.query_page", return_value=results
+        ) as query_page:
+            self.assertEqual(
+                Paper.objects.all().refresh_from_arxiv(wait_time=0, progress=progress),
+                1,
+            )
+        query_page.assert_called_once_with(
+            id_list=["1234.5678", "1234.5679"], max_results=2
+        )
+        progress.assert_called_once_with(paper2.id, 1)
+        paper1.refresh_from_db()
+        self.assertEqual(paper1.arxiv_version, 2)
+
+
 class SourceFileBulkTarballTest(TestCase):
     def test_has_correct_number_of_items(self):
         tarball = create_source_file_bulk_tarball(num_items=2)
@@ -251,3 +781,183 @@ class SourceFileTest(TestCase):
 
         sf = create_source_file(file="foo.gz")
         self.assertTrue(sf.is_renderable())
+
+
+@override_settings(
+    MEDIA_ROOT=TEST_MEDIA_ROOT,
+    PAPERS_SOURCE_CACHE_VOLUME="source-cache",
+    PAPERS_SOURCE_CACHE_MAX_BYTES=10,
+)
+class CachedSourceFileTest(TestCase):
+    def setUp(self):
+        self.host = FakeDockerHost().start()
+        self.addCleanup(self.host.stop)
+
+    def tearDown(self):
+        try:
+            shutil.rmtree(TEST_MEDIA_ROOT)
+        except FileNotFoundError:
+            pass
+
+    def create_source_file(self, arxiv_id, content):
+        return SourceFile.objects.create(
+            arxiv_id=arxiv_id, file=ContentFile(content, name=f"{arxiv_id}.tar.gz")
+        )
+
+    def test_checksum(self):
+        source_file = self.create_source_file("1234.5678", b"paper")
+        checksum = hashlib.sha256(b"paper").hexdigest()
+        self.assertEqual(source_file.checksum, checksum)
+        self.assertEqual(
+            source_file.get_source_cache_path(), f"{checksum}/1234.5678.tar.gz"
+        )
+
+    def test_add_when_added_at_the_same_time(self):
+        source_file = self.create_source_file("1", b"123456")
+        path = source_file.get_source_cache_path()
+
+        def add_to_source_cache(path, data, host=None):
+            # Another process adds it while this one is uploading
+            CachedSourceFile.objects.create(
+                host=host, path=path, size=len(data), last_used_at=timezone.now()
+            )
+
+        for host in [self.host.url, None]:
+            with mock.patch(
+                "arxiv_vanity.papers.models.add_to_source_cache",
+                side_effect=add_to_source_cache,
+            ):
+                CachedSourceFile.objects.add(host, source_file)
+            self.assertEqual(
+                CachedSourceFile.objects.filter(host=host, path=path).count(), 1
+            )
+
+    @mock.patch.dict(os.environ, {"HOST_PWD": "/tmp"})
+    def test_render_from_source_cache(self):
+        source_file = self.create_source_file("1234.5678", b"paper")
+        path = source_file.get_source_cache_path()
+        paper = create_paper(source_file=source_file)
+
+        with override_settings(PAPERS_RENDER_HOSTS={self.host.url: 2}):
+            render = Render.objects.create(paper=paper)
+            render.run()
+            container = self.host.containers[render.container_id]
+            self.assertNotIn(path, " ".join(container["Config"]["Cmd"]))
+
+            self.host.exit(render.container_id)
+            render.update_state()
+            self.assertEqual(self.host.volumes["source-cache"], {path: b"paper"})
+
+            render = Render.objects.create(paper=paper)
+            Render.objects.run_renders([render])
+            container = self.host.containers[render.container_id]
+            self.assertIn(
+                "source-cache:/source-cache:ro", container["HostConfig"]["Binds"]
+            )
+            self.assertIn(f"/source-cache/{path}", " ".join(container["Config"]["Cmd"]))
+
+    def test_add_and_evict(self):
+        source_file1 = self.create_source_file("1", b"123456")
+        source_file2 = self.create_source_file("2", b"7890123")
+        # Files from before checksums get them when they are cached
+        SourceFile.objects.filter(id=source_file1.id).update(checksum=None)
+        source_file1.refresh_from_db()
+
+        CachedSourceFile.objects.add(self.host.url, source_file1)
+        source_file1.refresh_from_db()
+        path1 = source_file1.get_source_cache_path()
+        self.assertIsNotNone(path1)
+        self.assertEqual(self.host.volumes["source-cache"], {path1: b"123456"})
+
+        # The first file is in use, so it is kept even though the cache is
+        # over its size
+        render = create_render(
+            paper=create_paper(source_file=source_file1), state=Render.STATE_RUNNING
+        )
+        render.host = self.host.url
+        render.save()
+        CachedSourceFile.objects.add(self.host.url, source_file2)
+        path2 = source_file2.get_source_cache_path()
+        self.assertEqual(set(self.host.volumes["source-cache"]), {path1, path2})
+
+        render.state = Render.STATE_SUCCESS
+        render.save()
+        self.assertEqual(CachedSourceFile.objects.evict(self.host.url), [path1])
+        self.assertEqual(self.host.volumes["source-cache"], {path2: b"7890123"})
+        self.assertEqual(
+            list(CachedSourceFile.objects.values_list("path", flat=True)), [path2]
+        )
+        # Removed with the container that removed the file
+        self.assertEqual(self.host.containers, {})
+
+        # Caching it again marks it as used
+        CachedSourceFile.objects.add(self.host.url, source_file2)
+        self.assertEqual(CachedSourceFile.objects.count(), 1)
+
+
+@override_settings(
+    MEDIA_ROOT=TEST_MEDIA_ROOT, ENGRAFO_IMAGE="arxivvanity/engrafo:latest"
+)
+class EngrafoImageTest(TestCase):
+    def tearDown(self):
+        try:
+            shutil.rmtree(TEST_MEDIA_ROOT)
+        except FileNotFoundError:
+            pass
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.hosts = [FakeDockerHost().start() for _ in range(2)]
+        self.addCleanup(lambda: [host.stop() for host in self.hosts])
+        render_hosts = override_settings(
+            PAPERS_RENDER_HOSTS={host.url: 1 for host in self.hosts}
+        )
+        render_hosts.enable()
+        self.addCleanup(render_hosts.disable)
+
+    def move_tag(self, hosts, image_id):
+        for host in hosts:
+            host.registry["arxivvanity/engrafo:latest"] = image_id
+
+    @mock.patch.dict(os.environ, {"HOST_PWD": "/tmp"})
+    def test_deploy_and_prune(self):
+        self.assertIsNone(EngrafoImage.objects.get_active_digest())
+        old = EngrafoImage.objects.deploy()
+        for host in self.hosts:
+            self.assertIn(old.digest, host.images)
+        self.assertEqual(EngrafoImage.objects.get_active_digest(), old.digest)
+
+        # Renders are pinned to the image, not the tag
+        paper = create_paper(source_file=create_source_file(file="foo.tar.gz"))
+        render = Render.objects.create(paper=paper)
+        render.run()
+        self.assertEqual(render.image_digest, old.digest)
+        host = next(h for h in self.hosts if h.url == render.host)
+        self.assertEqual(
+            host.containers[render.container_id]["Config"]["Image"], old.digest
+        )
+
+        self.move_tag(self.hosts, "sha256:new")
+        new = EngrafoImage.objects.deploy()
+        self.assertEqual(EngrafoImage.objects.get_active_digest(), "sha256:new")
+        old.refresh_from_db()
+        self.assertFalse(old.is_active)
+
+        # The old image is kept while a render is running with it
+        self.assertEqual(EngrafoImage.objects.prune(), [])
+        self.assertIn(old.digest, host.images)
+
+        host.exit(render.container_id)
+        render.update_state()
+        self.assertEqual(EngrafoImage.objects.prune(), [old])
+        for host in self.hosts:
+            self.assertEqual(list(host.images), [new.digest])
+
+    def test_deploy_with_mismatched_hosts(self):
+        image = EngrafoImage.objects.deploy()
+        # The tag moved between pulls
+        self.move_tag(self.hosts[1:], "sha256:new")
+        with self.assertRaises(EngrafoImageError):
+            EngrafoImage.objects.deploy()
+        self.assertEqual(EngrafoImage.objects.get_active_digest(), image.digest)
@@ -26,11 +26,11 @@ class ProcessorTest(unittest.TestCase):
         self.assertEqual(
             output["body"],
             """
-<img src="prefix/fig.gif"/>
-<img src="data:foo"/>
+<img src="prefix/fig.gif" decoding="async"/>
+<img src="data:foo" decoding="async"/>
 <a href="http://example.com" target="_blank">Hello</a>
 <div class="ltx_abstract"><p>Science was done</p></div>
-<figure class="ltx_figure"><img src="prefix/first_image.gif"/></figure>
+<figure class="ltx_figure"><img src="prefix/first_image.gif" loading="lazy" decoding="async"/></figure>
 <script src="prefix/script.js"></script>
 """,
         )
@@ -56,3 +56,88 @@ class ProcessorTest(unittest.TestCase):
             output["body"], "some email link ",
         )
 
+    def test_emails_are_removed_from_nested_elements_only_in_body(self):
+        html = (
+            "<head><title>head@example.com</title></head>"
+            '<div class="ltx_abstract"><p>Contact abstract@example.com</p></div>'
+            "<p>Written by <em>me@example.com</em> and you@example.com.</p>"
+        )
+        output = process_render(StringIO(html), "", {})
+        self.assertEqual(
+            output["body"],
+            '<div class="ltx_abstract"><p>Contact </p></div>'
+            "<p>Written by <em></em> and .</p>",
+        )
+        self.assertEqual(output["abstract"], "Contact abstract@example.com")
+
+    def test_emails_are_removed_from_attributes(self):
+        html = (
+            "<head></head>"
+            '<a href="https://example.com/?to=someone@example.com" title="Email me@example.com">Contact</a>'
+        )
+        output = process_render(StringIO(html), "", {})
+        self.assertNotIn("example.com", output["body"])
+        self.assertIn('title="Email "', output["body"])
+        self.assertIn(">Contact</a>", output["body"])
+
+    def test_empty_body(self):
+        output = process_render(StringIO("<head></head><body></body>"), "", {})
+        self.assertEqual(output["body"], "")
+
+    def test_image_sizes_and_srcsets(self):
+        html = (
+            "<head></head>"
+            '<img src="x1.png">'
+            '<img src="x2.png" width="300" height="200">'
+            '<img src="x3.png">'
+        )
+        images = {
+            "x1.png": {"width": 1200, "height": 600, "variants": {}},
+            "x2.png": {
+                "width": 1200,
+                "height": 800,
+                "variants": {
+                    "960": "variants/960/x2.png",
+                    "480": "variants/480/x2.png",
+                },
+            },
+        }
+        output = process_render(StringIO(html), "prefix", {}, images=images)
+        self.assertEqual(
+            output["body"],
+            '<img src="prefix/x1.png" width="1200" height="600" decoding="async"/>'
+            '<img src="prefix/x2.png" width="300" height="200" '
+            'srcset="prefix/variants/480/x2.png 480w, prefix/variants/960/x2.png 960w, prefix/x2.png 1200w" '
+            'sizes="(max-width: 300px) 100vw, 300px" decoding="async"/>'
+            '<img src="prefix/x3.png" loading="lazy" decoding="async"/>',
+        )
+
+    def test_counts_and_outline(self):
+        html = """
+<head><script>not words</script></head>
+<body>
+<section id="S1" class="ltx_section">
+<h2 class="ltx_title ltx_title_section">1 <span>Introduction</span></h2>
+<p>Some words here.</p>
+<figure class="ltx_figure"><img src="x1.png"><figcaption>A figure</figcaption></figure>
+<section id="S1.SS1" class="ltx_subsection">
+<h3 class="ltx_title">1.1 Background</h3>
+<p>More <em>words</em> too</p>
+<style>.not { words: here }</style>
+</section>
+</section>
+<section id="bib" class="ltx_bibliography"><h2 class="ltx_title">References</h2></section>
+<figure class="ltx_table"></figure>
+</body>
+"""
+        output = process_render(StringIO(html), "", {})
+        self.assertEqual(output["word_count"], 13)
+        self.assertEqual(output["figure_count"], 1)
+        self.assertEqual(
+            output["outline"],
+            [
+                {"id": "S1", "title": "1 Introduction", "level": 1},
+                {"id": "S1.SS1", "title": "1.1 Background", "level": 2},
+                {"id": "bib", "title": "References", "level": 1},
+            ],
+        )
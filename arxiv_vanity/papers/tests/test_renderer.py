@@ -0,0 +1,232 @@
+import time
+from unittest import mock
+import docker.errors
+from django.test import SimpleTestCase, override_settings
+from ..renderer import (
+    ARXIV_ID_LABEL,
+    DEADLINE_LABEL,
+    RENDER_ID_LABEL,
+    RENDER_LABEL,
+    TooManyRendersRunningError,
+    _unreachable_host_warned_at,
+    add_to_source_cache,
+    choose_render_host,
+    count_running_renders,
+    get_render_labels,
+    read_container_logs,
+    create_client,
+    remove_from_source_cache,
+    remove_long_running_containers,
+)
+from ..fake_docker import FakeDockerHost
+
+
+class ReadContainerLogsTest(SimpleTestCase):
+    def read(self, chunks, head_bytes, tail_bytes):
+        container = mock.Mock()
+        container.logs.return_value = iter(chunks)
+        return read_container_logs(container, head_bytes, tail_bytes)
+
+    def test_short_logs(self):
+        self.assertEqual(self.read([b"abc", b"def"], 4, 4), b"abcdef")
+
+    def test_long_logs(self):
+        chunks = [b"start\n"] + [b"x" * 10] * 1000 + [b"! Error\n"]
+        self.assertEqual(
+            self.read(chunks, 6, 8),
+            b"start\n\n\n[10000 bytes omitted]\n\n! Error\n",
+        )
+        self.assertEqual(
+            self.read(chunks, 6, 12),
+            b"start\n\n\n[9996 bytes omitted]\n\nxxxx! Error\n",
+        )
+
+    def test_no_tail(self):
+        self.assertEqual(
+            self.read([b"abc", b"def"], 2, 0), b"ab\n\n[4 bytes omitted]\n\n"
+        )
+
+
+@override_settings(PAPERS_MAX_RENDER_TIME_MINS=10)
+class RenderLabelsTest(SimpleTestCase):
+    def test_get_render_labels(self):
+        labels = get_render_labels(render_id=123, arxiv_id="1708.03313")
+        self.assertEqual(labels[RENDER_LABEL], "true")
+        self.assertEqual(labels[RENDER_ID_LABEL], "123")
+        self.assertEqual(labels[ARXIV_ID_LABEL], "1708.03313")
+        self.assertAlmostEqual(int(labels[DEADLINE_LABEL]), time.time() + 600, delta=5)
+        self.assertEqual(set(get_render_labels()), {RENDER_LABEL, DEADLINE_LABEL})
+
+    @override_settings(ENGRAFO_IMAGE="arxivvanity/engrafo")
+    def test_remove_long_running_containers(self):
+        now = int(time.time())
+        containers = [
+            {
+                "Id": "expired",
+                "Created": now,
+                "Labels": {RENDER_LABEL: "true", DEADLINE_LABEL: str(now - 1)},
+            },
+            {
+                "Id": "running",
+                "Created": 0,
+                "Labels": {RENDER_LABEL: "true", DEADLINE_LABEL: str(now + 60)},
+            },
+            # From before containers had deadlines
+            {"Id": "old", "Created": now - 601, "Labels": {RENDER_LABEL: "true"}},
+            {"Id": "new", "Created": now - 60, "Labels": {RENDER_LABEL: "true"}},
+        ]
+        engrafo_containers = [
+            # Already listed by label
+            containers[0],
+            # From before containers had labels
+            {"Id": "unlabelled-old", "Created": now - 601, "Labels": None},
+            {"Id": "unlabelled-new", "Created": now - 60, "Labels": {}},
+        ]
+
+        def list_containers(all, filters):
+            if "ancestor" in filters:
+                return engrafo_containers
+            return containers
+
+        with mock.patch("arxiv_vanity.papers.renderer.create_client") as create_client:
+            client = create_client.return_value
+            client.api.containers.side_effect = list_containers
+            remove_long_running_containers()
+            # Only labelled containers are listed by default
+            client.api.containers.assert_called_once_with(
+                all=True, filters={"label": RENDER_LABEL}
+            )
+            self.assertEqual(
+                [c[0][0] for c in client.api.remove_container.call_args_list],
+                ["expired", "old"],
+            )
+
+            client.api.containers.reset_mock()
+            client.api.remove_container.reset_mock()
+            remove_long_running_containers(include_unlabelled=True)
+        self.assertEqual(
+            client.api.containers.call_args_list,
+            [
+                mock.call(all=True, filters={"label": RENDER_LABEL}),
+                mock.call(all=True, filters={"ancestor": "arxivvanity/engrafo"}),
+            ],
+        )
+        self.assertEqual(
+            [c[0][0] for c in client.api.remove_container.call_args_list],
+            ["expired", "old", "unlabelled-old"],
+        )
+
+
+@override_settings(
+    PAPERS_SOURCE_CACHE_VOLUME="source-cache", PAPERS_SOURCE_CACHE_IMAGE="busybox"
+)
+class SourceCacheTest(SimpleTestCase):
+    def test_helper_containers_dont_use_engrafo(self):
+        with mock.patch("arxiv_vanity.papers.renderer.create_client") as create_client:
+            client = create_client.return_value
+            container = client.containers.create.return_value
+            # Pulled if it isn't on the host
+            client.containers.create.side_effect = [
+                docker.errors.ImageNotFound("No such image"),
+                container,
+            ]
+            add_to_source_cache("abc/1234.5678.tar.gz", b"paper")
+            remove_from_source_cache(["abc/1234.5678.tar.gz"])
+        client.images.pull.assert_called_once_with("busybox")
+        self.assertEqual(
+            [c[0][0] for c in client.containers.create.call_args_list],
+            ["busybox", "busybox"],
+        )
+        container.put_archive.assert_called_once()
+        self.assertEqual(client.containers.run.call_args[0][0], "busybox")
+
+
+class ChooseRenderHostTest(SimpleTestCase):
+    def setUp(self):
+        self.hosts = [FakeDockerHost().start() for _ in range(3)]
+
+    def tearDown(self):
+        for host in self.hosts:
+            host.stop()
+
+    def test_chooses_least_loaded_host(self):
+        a, b, c = self.hosts
+        for _ in range(5):
+            a.add_running_container()
+        b.add_running_container()
+        with override_settings(PAPERS_RENDER_HOSTS={a.url: 10, b.url: 4}):
+            self.assertEqual(choose_render_host(), b.url)
+        with override_settings(PAPERS_RENDER_HOSTS={a.url: 20, b.url: 2}):
+            self.assertEqual(choose_render_host(), a.url)
+
+    def test_only_counts_render_containers(self):
+        a, b, c = self.hosts
+        a.add_running_container(render=False)
+        b.add_running_container()
+        with override_settings(PAPERS_RENDER_HOSTS={a.url: 1, b.url: 1}):
+            self.assertEqual(count_running_renders(), {a.url: 0, b.url: 1})
+            self.assertEqual(choose_render_host(), a.url)
+
+    def test_skips_unreachable_and_full_hosts(self):
+        a, b, c = self.hosts
+        a.stop()
+        b.add_running_container()
+        with override_settings(PAPERS_RENDER_HOSTS={a.url: 10, b.url: 1, c.url: 1}):
+            self.assertEqual(choose_render_host(), c.url)
+        with override_settings(PAPERS_RENDER_HOSTS={a.url: 10, b.url: 1}):
+            with self.assertRaises(TooManyRendersRunningError):
+                choose_render_host()
+
+    def test_warns_about_unreachable_hosts_without_reporting_errors(self):
+        a, b, c = self.hosts
+        a.stop()
+        # Another test may have warned about a host on the same port
+        _unreachable_host_warned_at.clear()
+        with override_settings(PAPERS_RENDER_HOSTS={a.url: 1, b.url: 1}), mock.patch(
+            "arxiv_vanity.utils.log_exception"
+        ) as log_exception:
+            with self.assertLogs("arxiv_vanity.papers.renderer", "WARNING") as logs:
+                self.assertEqual(count_running_renders(), {b.url: 0})
+                self.assertEqual(count_running_renders(), {b.url: 0})
+            # Once, not every time it is counted
+            self.assertEqual(len(logs.output), 1)
+            self.assertIn(a.url, logs.output[0])
+            log_exception.assert_not_called()
+
+
+class FakeDockerHostTest(SimpleTestCase):
+    def test_containers_exit_after_run_time(self):
+        host = FakeDockerHost(run_time=0.1).start()
+        self.addCleanup(host.stop)
+        client = create_client(host.url)
+        client.images.pull("engrafo")
+        container = client.containers.run(
+            "engrafo", "true", labels={RENDER_LABEL: "true"}, detach=True
+        )
+        container.reload()
+        self.assertEqual(container.status, "running")
+        self.assertEqual(client.info()["ContainersRunning"], 1)
+        time.sleep(0.1)
+        container.reload()
+        self.assertEqual(container.status, "exited")
+        self.assertEqual(container.attrs["State"]["ExitCode"], 0)
+        self.assertEqual(
+            [
+                c["Id"]
+                for c in client.api.containers(
+                    all=True, filters={"label": RENDER_LABEL}
+                )
+            ],
+            [container.id],
+        )
+        # Only running containers are listed by default
+        self.assertEqual(client.api.containers(filters={"label": RENDER_LABEL}), [])
+        self.assertEqual(client.api.containers(filters={"label": "other"}), [])
+        self.assertEqual(
+            len(client.api.containers(all=True, filters={"ancestor": "engrafo"})), 1
+        )
+        self.assertEqual(
+            client.api.containers(all=True, filters={"ancestor": "busybox"}), []
+        )
+        container.remove()
+        self.assertEqual(host.containers, {})
@@ -0,0 +1,19 @@
+from django.template import Context, Template
+from django.test import SimpleTestCase
+
+
+class CategoryBadgeTest(SimpleTestCase):
+    def render(self, category):
+        template = Template("{% load papers %}{% category_badge category %}")
+        return template.render(Context({"category": category}))
+
+    def test_category_badge(self):
+        html = self.render("cs.CL")
+        self.assertIn('title="cs.CL"', html)
+        self.assertIn(">computation and language</span>", html)
+        self.assertIn("background-color: #", html)
+        # Colours are the same every time
+        self.assertEqual(self.render("cs.CL"), html)
+
+    def test_unknown_category(self):
+        self.assertEqual(self.render("math.AG"), "")
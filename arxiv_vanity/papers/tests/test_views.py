@@ -1,11 +1,14 @@
 import datetime
+import gzip
 import os
 import shutil
 import unittest
 from unittest import mock
 from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase, override_settings
 from ..models import Render, Paper
+from ..processor import process_render
 from ..views import convert_query_to_arxiv_id
 from .utils import (
     create_paper,
@@ -79,6 +82,76 @@ class PaperDetailViewTest(TestCase):
         # ensure we haven't spun off a new render job
         mock_run.assert_not_called()
 
+    @override_settings(PAPERS_STREAM_BODY_MIN_BYTES=0)
+    def test_it_streams_large_papers(self):
+        source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
+        paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
+        create_render_with_html(paper=paper)
+        res = self.client.get("/papers/1234.5678/")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.streaming)
+        self.assertEqual(
+            res["Cache-Control"], f"public, max-age={settings.PAPER_CACHE_SECONDS}"
+        )
+        content = b"".join(res.streaming_content).decode("utf-8")
+        self.assertEqual(content.count("style-was-inserted"), 1)
+        self.assertEqual(content.count("body was inserted"), 1)
+        self.assertNotIn("<!-- paper body -->", content)
+        self.assertLess(
+            content.index("style-was-inserted"), content.index("body was inserted")
+        )
+        self.assertLess(
+            content.index("body was inserted"), content.index("mailing-list-form")
+        )
+
+    def test_it_compresses_papers(self):
+        source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
+        paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
+        create_render_with_html(paper=paper)
+        res = self.client.get("/papers/1234.5678/", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res["Content-Encoding"], "gzip")
+        self.assertIn("body was inserted", gzip.decompress(res.content).decode("utf-8"))
+
+    def test_it_only_processes_renders_once(self):
+        source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
+        paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
+        create_render_with_html(paper=paper)
+        with mock.patch(
+            "arxiv_vanity.papers.models.process_render", wraps=process_render
+        ) as mock_process_render:
+            for _ in range(2):
+                res = self.client.get("/papers/1234.5678/")
+                self.assertEqual(res.status_code, 200)
+                self.assertIn("body was inserted", res.content.decode("utf-8"))
+        mock_process_render.assert_called_once()
+
+    def test_it_uses_render_columns_for_social_cards(self):
+        source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
+        paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
+        render = create_render_with_html(paper=paper)
+        render.write_processed_render()
+        metadata_path = os.path.join(
+            settings.MEDIA_ROOT, render.get_processed_path(), "metadata.json"
+        )
+        with open(metadata_path) as fh:
+            self.assertNotIn("abstract", fh.read())
+        Render.objects.filter(id=render.id).update(
+            abstract="Abstract from the database",
+            first_image="https://example.com/figure.png",
+        )
+        res = self.client.get("/papers/1234.5678/")
+        self.assertEqual(res.status_code, 200)
+        content = res.content.decode("utf-8")
+        self.assertIn(
+            '<meta property="og:description" content="Abstract from the database">',
+            content,
+        )
+        self.assertIn(
+            '<meta property="og:image" content="https://example.com/figure.png">',
+            content,
+        )
+
     @patch_render_run()
     def test_expired_render_gets_displayed_and_rerendered(self, mock_run):
         source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
@@ -297,6 +370,9 @@ class TestPaperConvert(TestCase):
 
 
 class TestPaperRenderState(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_render_state(self):
         source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
         paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
@@ -308,15 +384,78 @@ class TestPaperRenderState(TestCase):
         res = self.client.get("/papers/1234.5678/render-state/")
         self.assertEqual(res.json()["state"], "success")
 
+    def test_render_state_404s_without_render(self):
+        res = self.client.get("/papers/1234.5678/render-state/")
+        self.assertEqual(res.status_code, 404)
+        create_paper(arxiv_id="1234.5678")
+        res = self.client.get("/papers/1234.5678/render-state/")
+        self.assertEqual(res.status_code, 404)
+
+    def test_render_state_waits_for_render_to_finish(self):
+        paper = create_paper(arxiv_id="1234.5678")
+        render = create_render(paper=paper, state=Render.STATE_RUNNING)
+
+        def finish_render(seconds):
+            render.state = Render.STATE_SUCCESS
+            render.save()
+
+        with mock.patch(
+            "arxiv_vanity.papers.views.time.sleep", side_effect=finish_render
+        ) as mock_sleep:
+            res = self.client.get("/papers/1234.5678/render-state/?wait=10")
+        self.assertEqual(res.json()["state"], "success")
+        mock_sleep.assert_called_once()
+
+    def test_render_state_wait_is_capped(self):
+        paper = create_paper(arxiv_id="1234.5678")
+        create_render(paper=paper, state=Render.STATE_RUNNING)
+        with mock.patch("arxiv_vanity.papers.views.time.sleep") as mock_sleep:
+            with mock.patch(
+                "arxiv_vanity.papers.views.time.monotonic",
+                side_effect=[0, 1, settings.PAPERS_RENDER_STATE_MAX_WAIT_SECONDS],
+            ):
+                res = self.client.get("/papers/1234.5678/render-state/?wait=1000")
+        self.assertEqual(res.json()["state"], "running")
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    def test_render_state_with_invalid_wait(self):
+        res = self.client.get("/papers/1234.5678/render-state/?wait=foo")
+        self.assertEqual(res.status_code, 400)
+
 
 class TestRenderUpdateState(TestCase):
     def test_render_update_state(self):
         source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
         paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
         render = create_render(paper=paper, state=Render.STATE_RUNNING)
-        with mock.patch("arxiv_vanity.papers.models.Render.update_state") as m:
+        # Doesn't touch Docker
+        with mock.patch("arxiv_vanity.papers.models.create_client") as m:
             res = self.client.post(
                 f"/renders/{render.pk}/update-state/", {"exit_code": "1"}
             )
             self.assertEqual(res.status_code, 200)
-            m.assert_called_once_with(exit_code="1")
+            m.assert_not_called()
+        render.refresh_from_db()
+        self.assertEqual(render.state, Render.STATE_FAILURE)
+        self.assertEqual(render.exit_code, 1)
+        self.assertIsNotNone(render.finished_at)
+
+        res = self.client.post(f"/renders/{render.pk}/update-state/", {})
+        self.assertEqual(res.status_code, 400)
+
+        render.container_is_removed = True
+        render.save()
+        res = self.client.post(
+            f"/renders/{render.pk}/update-state/", {"exit_code": "0"}
+        )
+        self.assertEqual(res.status_code, 404)
+
+
+class TestStats(TestCase):
+    def test_stats(self):
+        render = create_render(state=Render.STATE_SUCCESS)
+        render.duration_ms = 12345
+        render.save()
+        res = self.client.get("/stats/")
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("12.3s median", res.content.decode("utf-8"))
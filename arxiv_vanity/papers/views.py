@@ -1,15 +1,27 @@
 import datetime
+import time
 from django.conf import settings
-from django.http import Http404, HttpResponse, JsonResponse
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.db import connection
 from django.db.models import OuterRef, Subquery
 from django.shortcuts import get_object_or_404, render, redirect
+from django.template.loader import render_to_string
 from django.utils.cache import add_never_cache_headers, patch_cache_control
+from django.utils.safestring import mark_safe
 from django.views.decorators.cache import cache_control, never_cache
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
 from django.views.decorators.http import require_POST
 from django.views.generic import TemplateView, ListView
 from .models import Paper, Render, PaperIsNotRenderableError
 from .renderer import TooManyRendersRunningError
+from ..instrumentation import timer
 from ..scraper.arxiv_ids import (
     remove_version_from_arxiv_id,
     ARXIV_URL_RE,
@@ -51,6 +63,9 @@ class PaperListView(ListView):
         return res
 
 
+# Papers are big, and don't have CSRF tokens or other secrets in them that
+# would make compression unsafe
+@gzip_page
 def paper_detail(request, arxiv_id):
     force_render = "render" in request.GET
     no_render = "no-render" in request.GET
@@ -114,44 +129,101 @@ def paper_detail(request, arxiv_id):
         return add_paper_cache_control(res, request)
 
     elif render_to_display.state == Render.STATE_SUCCESS:
-        processed_render = render_to_display.get_processed_render()
+        metadata = render_to_display.get_processed_metadata()
+        context = {
+            "paper": paper,
+            "render": render_to_display,
+            "links": metadata["links"],
+            "scripts": metadata["scripts"],
+            "styles": metadata["styles"],
+        }
 
-        res = render(
-            request,
-            "papers/paper_detail.html",
-            {
-                "paper": paper,
-                "render": render_to_display,
-                "body": processed_render["body"],
-                "links": processed_render["links"],
-                "scripts": processed_render["scripts"],
-                "styles": processed_render["styles"],
-                "abstract": processed_render["abstract"],
-                "first_image": processed_render["first_image"],
-            },
-        )
+        if metadata["body_size"] >= settings.PAPERS_STREAM_BODY_MIN_BYTES:
+            res = stream_paper_detail(request, context, render_to_display)
+        else:
+            context["body"] = render_to_display.read_processed_body()
+            with timer("template"):
+                res = render(request, "papers/paper_detail.html", context)
         return add_paper_cache_control(res, request)
 
     else:
         raise Exception(f"Unknown render state: {render_to_display.state}")
 
 
+# Stands in for the body of a paper when rendering the page around it
+BODY_PLACEHOLDER = "<!-- paper body -->"
+
+
+def stream_paper_detail(request, context, render_to_display):
+    """
+    Returns a streaming response for a paper, so the start of the page can be
+    sent before the body has been read, and the body is never all in memory.
+    """
+    with timer("template"):
+        page = render_to_string(
+            "papers/paper_detail.html",
+            dict(context, body=mark_safe(BODY_PLACEHOLDER)),
+            request=request,
+        )
+    before, after = page.split(BODY_PLACEHOLDER)
+
+    def content():
+        yield before
+        yield from render_to_display.iter_processed_body()
+        yield after
+
+    return StreamingHttpResponse(content())
+
+
+# How often a long-polling render state request checks for a new state
+RENDER_STATE_POLL_SECONDS = 1
+
+
 @never_cache
 def paper_render_state(request, arxiv_id):
-    paper = get_object_or_404(Paper, arxiv_id=arxiv_id)
+    """
+    Returns the state of the latest render of a paper.
+
+    If `wait` is passed, the request is held open for up to that many seconds
+    (capped at PAPERS_RENDER_STATE_MAX_WAIT_SECONDS) until the render has
+    finished, so the rendering page doesn't have to keep polling.
+    """
     try:
-        r = paper.renders.latest()
-    except Render.DoesNotExist:
+        wait = float(request.GET.get("wait", 0))
+    except ValueError:
+        return HttpResponseBadRequest("wait must be a number")
+    wait = min(max(wait, 0), settings.PAPERS_RENDER_STATE_MAX_WAIT_SECONDS)
+    deadline = time.monotonic() + wait
+
+    state = Render.objects.latest_state_for_arxiv_id(arxiv_id)
+    if state is None:
         raise Http404()
-    return JsonResponse({"state": r.state})
+
+    if wait and not connection.in_atomic_block:
+        # Give the database connection back to the pool while we wait.
+        # Subsequent checks mostly hit the cache.
+        connection.close()
+
+    while (
+        state in (Render.STATE_UNSTARTED, Render.STATE_RUNNING)
+        and time.monotonic() < deadline
+    ):
+        time.sleep(RENDER_STATE_POLL_SECONDS)
+        state = Render.objects.latest_state_for_arxiv_id(arxiv_id)
+
+    return JsonResponse({"state": state})
 
 
 @csrf_exempt
 @require_POST
 def render_update_state(request, pk):
-    r = get_object_or_404(Render, pk=pk, container_is_removed=False)
-    r.update_state(exit_code=request.POST.get("exit_code"))
-    r.delete_older_renders_if_successful()
+    try:
+        exit_code = int(request.POST["exit_code"])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("exit_code must be an integer")
+    # The rest is done by update_state() once the container has exited
+    if not Render.objects.filter(pk=pk).record_exit(exit_code):
+        raise Http404("No render with a container")
     return HttpResponse()
 
 
@@ -223,5 +295,6 @@ def stats(request):
             "failed_papers": int(
                 papers.filter(last_render_state=Render.STATE_FAILURE).count()
             ),
+            "timing_30_days": past_30_days.succeeded().timing_stats(),
         },
     )
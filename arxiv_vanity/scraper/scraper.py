@@ -32,12 +32,17 @@ def scrape_and_render_papers():
 def query_and_create_papers():
     """
     Download papers from arXiv's API and insert new ones into the database.
-    Returns an iterator of new papers.
+    Returns an iterator of new papers, and papers that have a new version.
     """
     papers = category_search_query(settings.PAPERS_MACHINE_LEARNING_CATEGORIES)
     for paper in papers:
-        obj, created = Paper.objects.update_or_create_from_api(paper)
-        if created:
+        obj, previous_version = Paper.objects.update_from_api(paper)
+        if previous_version is None:
+            yield obj
+        elif obj.arxiv_version > previous_version:
+            # Results are sorted by when they were updated, so there may be
+            # new papers after this one
+            print(f"Paper {obj.arxiv_id} has a new version {obj.arxiv_version}")
             yield obj
         else:
             print(
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "arxiv_vanity.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",  #  after SecurityMiddleware
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -183,6 +184,10 @@ LOGGING = {
 # Suppress "Starting new HTTPS connection" messages
 logging.getLogger("requests.packages.urllib3.connectionpool").setLevel(logging.ERROR)
 
+# Add a Server-Timing header and log a line with database, storage and
+# processing timings for each request
+INSTRUMENTATION_ENABLED = env.bool("INSTRUMENTATION_ENABLED", default=False)
+
 SENTRY_DSN = env("SENTRY_DSN", default="")
 if SENTRY_DSN:
     sentry_sdk.init(dsn=SENTRY_DSN, integrations=[DjangoIntegration()])
@@ -229,11 +234,17 @@ PAPERS_MACHINE_LEARNING_CATEGORIES = [
     "stat.ML",
 ]
 
-# Number of days after which to re-render papers
-PAPERS_EXPIRED_DAYS = env.int("PAPERS_EXPIRED_DAYS", default=7)
+# Number of days after which to re-render papers anyway. They are
+# re-rendered sooner if arXiv has a new version (see Render.is_outdated()).
+# This used to default to 7.
+PAPERS_EXPIRED_DAYS = env.int("PAPERS_EXPIRED_DAYS", default=90)
+# Number of hours after which to retry failed renders. Failures can be
+# transient, like a container timing out or storage being unavailable.
+PAPERS_FAILED_EXPIRED_HOURS = env.int("PAPERS_FAILED_EXPIRED_HOURS", default=24)
 
 
 # Caching
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://")}
 PAPER_CACHE_SECONDS = env.int("PAPER_CACHE_SECONDS", default=7 * 24 * 60 * 60)
 
 ROOT_URL = env("ROOT_URL", default="http://localhost:8000")
@@ -244,7 +255,61 @@ RANGE_PAGINATOR_TEMPLATE = "django_rangepaginator/bootstrap4.html"
 # Max number of renders to run in parallel
 PAPERS_MAX_RENDERS_RUNNING = env.int("PAPERS_MAX_RENDERS_RUNNING", default=100)
 
+# Docker hosts to run renders on, and how many renders each can run in
+# parallel, like "tcp://render1:2376=100;tcp://render2:2376=50". If empty,
+# renders run on DOCKER_HOST, up to PAPERS_MAX_RENDERS_RUNNING.
+PAPERS_RENDER_HOSTS = env.dict("PAPERS_RENDER_HOSTS", cast={"value": int}, default={})
+
 # Max time a render can run in mins
 PAPERS_MAX_RENDER_TIME_MINS = env.int("PAPERS_MAX_RENDER_TIME_MINS", default=10)
 
+# Max time the render state endpoint will hold a request open waiting for a
+# render to finish. Keep this under the 30s Heroku request timeout.
+PAPERS_RENDER_STATE_MAX_WAIT_SECONDS = env.int(
+    "PAPERS_RENDER_STATE_MAX_WAIT_SECONDS", default=20
+)
+# How long the state of a paper's latest render is cached for. Saving a
+# render clears it, but with the default locmem cache only in the process
+# that saved it, so other processes can see the old state for this long.
+PAPERS_RENDER_STATE_CACHE_SECONDS = env.int(
+    "PAPERS_RENDER_STATE_CACHE_SECONDS", default=5
+)
+
+# Papers with a processed body bigger than this are streamed to the browser
+# instead of being rendered into memory in one go
+PAPERS_STREAM_BODY_MIN_BYTES = env.int(
+    "PAPERS_STREAM_BODY_MIN_BYTES", default=1024 * 1024
+)
+
+# Widths of smaller variants of figures to generate when a render succeeds,
+# for srcsets. Empty to not generate any.
+PAPERS_IMAGE_VARIANT_WIDTHS = env.list(
+    "PAPERS_IMAGE_VARIANT_WIDTHS", cast=int, default=[]
+)
+
+# Gzip text files in the output of successful renders on S3
+PAPERS_COMPRESS_RENDER_OUTPUT = env.bool("PAPERS_COMPRESS_RENDER_OUTPUT", default=True)
+
+# How much of the start and end of a render's container logs to keep.
+# Errors are usually at the end.
+PAPERS_CONTAINER_LOG_HEAD_BYTES = env.int(
+    "PAPERS_CONTAINER_LOG_HEAD_BYTES", default=64 * 1024
+)
+PAPERS_CONTAINER_LOG_TAIL_BYTES = env.int(
+    "PAPERS_CONTAINER_LOG_TAIL_BYTES", default=256 * 1024
+)
+
+# Docker volume on each render host to cache source files in, so papers
+# that are rendered again don't have to be fetched from storage. Empty to
+# not cache them.
+PAPERS_SOURCE_CACHE_VOLUME = env("PAPERS_SOURCE_CACHE_VOLUME", default=None)
+# Size of the source cache on each host. The least recently used files are
+# removed to keep it under this.
+PAPERS_SOURCE_CACHE_MAX_BYTES = env.int(
+    "PAPERS_SOURCE_CACHE_MAX_BYTES", default=10 * 1024 * 1024 * 1024
+)
+# Small image to run the containers that add and remove files in the
+# source cache, so they don't depend on ENGRAFO_IMAGE being on the host
+PAPERS_SOURCE_CACHE_IMAGE = env("PAPERS_SOURCE_CACHE_IMAGE", default="busybox:1.36")
+
 SITEMAP_LIMIT = env.int("SITEMAP_LIMIT", default=45000)
@@ -1,4 +1,10 @@
+import gzip
+import mimetypes
 import os
+from django.core.files.base import ContentFile
+from gevent.pool import Pool
+from storages.backends.s3boto3 import S3Boto3Storage
+from .utils import catch_exceptions
 
 # https://github.com/ephes/homepage/blob/a62d45611c2f3849f0845b8ec4256f130d68db25/homepage/blogs/utils.py
 def storage_walk(storage, cur_dir=""):
@@ -19,5 +25,106 @@ def storage_delete_path(storage, root_path):
     """
     Resursive delete for Django storage.
     """
+    if isinstance(storage, S3Boto3Storage):
+        # S3 can delete up to 1000 keys per request, so do that instead of
+        # walking the tree and deleting one key at a time
+        prefix = storage._normalize_name(storage._clean_name(root_path))
+        storage.bucket.objects.filter(Prefix=prefix.rstrip("/") + "/").delete()
+        return
     for path in storage_walk(storage, root_path):
         storage.delete(path)
+
+
+def storage_overwrite(storage, path, content):
+    """
+    Save a file to storage, replacing it if it exists instead of picking
+    another name.
+    """
+    storage.delete(path)
+    return storage.save(path, content)
+
+
+def storage_save_private(storage, path, content, content_type=None):
+    """
+    Save bytes to storage, replacing the file if it exists. On S3 the file
+    is private, even if the storage's default ACL is public.
+    """
+    if isinstance(storage, S3Boto3Storage):
+        key = storage._normalize_name(storage._clean_name(path))
+        storage.bucket.Object(key).put(
+            Body=content,
+            ACL="private",
+            ContentType=content_type or "application/octet-stream",
+        )
+        return path
+    return storage_overwrite(storage, path, ContentFile(content))
+
+
+def storage_read_chunks(storage, path, chunk_size=64 * 1024):
+    """
+    Returns an iterator of chunks of a file in storage, without reading it
+    all into memory.
+    """
+    if isinstance(storage, S3Boto3Storage):
+        # S3Boto3StorageFile downloads the whole object before it can be
+        # read, so read the response body directly
+        key = storage._normalize_name(storage._clean_name(path))
+        body = storage.bucket.Object(key).get()["Body"]
+        try:
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
+        return
+    with storage.open(path) as f:
+        yield from f.chunks(chunk_size)
+
+
+def storage_gzip_path(
+    storage, root_path, should_compress, cache_control=None, concurrency=10
+):
+    """
+    Gzip files under a path in S3 in place, setting their Content-Encoding
+    so browsers decompress them. `should_compress` is called with the path
+    of each file relative to `root_path`.
+
+    S3 can't pick an encoding based on Accept-Encoding, so this only does
+    gzip, which every browser supports. Does nothing on other storages.
+    Returns the number of files compressed.
+    """
+    if not isinstance(storage, S3Boto3Storage):
+        return 0
+    prefix = storage._normalize_name(storage._clean_name(root_path)).rstrip("/") + "/"
+    keys = [
+        summary.key
+        for summary in storage.bucket.objects.filter(Prefix=prefix)
+        # Small files can get bigger when gzipped
+        if summary.size >= 1024 and should_compress(summary.key[len(prefix) :])
+    ]
+
+    @catch_exceptions
+    def compress(key):
+        obj = storage.bucket.Object(key)
+        if obj.content_encoding == "gzip":
+            return False
+        body = obj.get()["Body"].read()
+        kwargs = {
+            "Body": gzip.compress(body),
+            "ContentEncoding": "gzip",
+            "ContentType": obj.content_type
+            or mimetypes.guess_type(key)[0]
+            or "application/octet-stream",
+        }
+        if cache_control:
+            kwargs["CacheControl"] = cache_control
+        if storage.default_acl:
+            kwargs["ACL"] = storage.default_acl
+        obj.put(**kwargs)
+        return True
+
+    return sum(
+        1 for result in Pool(concurrency).imap_unordered(compress, keys) if result
+    )
@@ -0,0 +1,28 @@
+from django.test import TestCase
+from ..benchmarks.render_load import run_render_load_test
+from ..benchmarks.suite import BENCHMARKS, compare, run_benchmarks
+
+
+class BenchmarksTest(TestCase):
+    def test_run_benchmarks(self):
+        # Just check each benchmark still works
+        results = run_benchmarks(min_time=0, min_iterations=1)
+        self.assertEqual(set(results["results"]), set(BENCHMARKS))
+        for result in results["results"].values():
+            self.assertGreater(result["median"], 0)
+
+    def test_compare(self):
+        baseline = {"results": {"a": {"median": 2.0}, "b": {"median": 1.0}}}
+        current = {"results": {"a": {"median": 1.0}, "c": {"median": 1.0}}}
+        self.assertEqual(compare(baseline, current), [("a", 2.0, 1.0, -50.0)])
+
+    def test_run_render_load_test(self):
+        results = run_render_load_test(num_renders=10, exit_failure_rate=0.5)
+        self.assertEqual(results["dispatch"]["started"], 10)
+        self.assertEqual(results["webhook"]["renders"], 5)
+        self.assertEqual(results["sweep"]["renders"], 10)
+        states = results["states"]
+        self.assertEqual(states["success"] + states["failure"], 10)
+        self.assertGreater(states["failure"], 0)
+        for phase in ["dispatch", "webhook", "sweep", "reap"]:
+            self.assertEqual(results[phase]["errors"], 0)
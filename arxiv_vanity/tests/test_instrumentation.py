@@ -0,0 +1,70 @@
+import os
+import shutil
+from django.conf import settings
+from django.test import TestCase, override_settings
+from ..instrumentation import RequestTimings, timer
+from ..papers.tests.utils import (
+    create_paper,
+    create_render_with_html,
+    create_source_file,
+)
+
+TEST_MEDIA_ROOT = os.path.join(settings.MEDIA_ROOT, "test")
+
+
+class RequestTimingsTest(TestCase):
+    def test_server_timing_header(self):
+        timings = RequestTimings()
+        timings.add("db", 0.002)
+        timings.add("db", 0.003)
+        timings.add("storage", 0.01, 2048)
+        self.assertEqual(
+            timings.server_timing_header(0.1),
+            'db;dur=5.0;desc="2x", storage;dur=10.0;desc="1x 2048 bytes", total;dur=100.0',
+        )
+        self.assertEqual(
+            timings.log_fields(0.1),
+            {
+                "total_ms": 100.0,
+                "db_count": 2,
+                "db_ms": 5.0,
+                "storage_count": 1,
+                "storage_ms": 10.0,
+                "storage_bytes": 2048,
+            },
+        )
+
+    def test_timer_outside_request(self):
+        with timer("db") as span:
+            span.size = 10
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class InstrumentationMiddlewareTest(TestCase):
+    def tearDown(self):
+        try:
+            shutil.rmtree(TEST_MEDIA_ROOT)
+        except FileNotFoundError:
+            pass
+
+    def create_paper_with_render(self):
+        source_file = create_source_file(arxiv_id="1234.5678", file="foo.tar.gz")
+        paper = create_paper(arxiv_id="1234.5678", source_file=source_file)
+        create_render_with_html(paper=paper)
+
+    @override_settings(INSTRUMENTATION_ENABLED=True)
+    def test_paper_detail_timings(self):
+        self.create_paper_with_render()
+        with self.assertLogs("arxiv_vanity.instrumentation", "INFO") as logs:
+            res = self.client.get("/papers/1234.5678/")
+        self.assertEqual(res.status_code, 200)
+        metrics = [part.split(";")[0] for part in res["Server-Timing"].split(", ")]
+        self.assertEqual(metrics, ["db", "storage", "processor", "template", "total"])
+        self.assertIn("path=/papers/1234.5678/ status=200", logs.output[0])
+        self.assertIn("storage_bytes=", logs.output[0])
+
+    def test_disabled(self):
+        self.create_paper_with_render()
+        res = self.client.get("/papers/1234.5678/")
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("Server-Timing", res)
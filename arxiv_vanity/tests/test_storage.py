@@ -0,0 +1,53 @@
+import gzip
+from unittest import mock
+from django.test import SimpleTestCase
+from storages.backends.s3boto3 import S3Boto3Storage
+from ..storage import storage_gzip_path
+
+
+class StorageGzipPathTest(SimpleTestCase):
+    def test_gzips_files_in_place(self):
+        storage = mock.Mock(spec=S3Boto3Storage)
+        storage._clean_name.side_effect = lambda name: name
+        storage._normalize_name.side_effect = lambda name: name
+        storage.default_acl = "public-read"
+        storage.bucket.objects.filter.return_value = [
+            mock.Mock(key="render-output/1/index.css", size=2048),
+            mock.Mock(key="render-output/1/small.css", size=10),
+            mock.Mock(key="render-output/1/x1.png", size=2048),
+            mock.Mock(key="render-output/1/compressed.js", size=2048),
+        ]
+        objects = {
+            "render-output/1/index.css": mock.Mock(
+                content_encoding=None, content_type="text/css"
+            ),
+            "render-output/1/compressed.js": mock.Mock(content_encoding="gzip"),
+        }
+        objects["render-output/1/index.css"].get.return_value = {
+            "Body": mock.Mock(read=mock.Mock(return_value=b"body {}" * 100))
+        }
+        storage.bucket.Object.side_effect = lambda key: objects[key]
+
+        num_compressed = storage_gzip_path(
+            storage,
+            "render-output/1",
+            lambda path: not path.endswith(".png"),
+            cache_control="public, max-age=60",
+        )
+
+        self.assertEqual(num_compressed, 1)
+        storage.bucket.objects.filter.assert_called_once_with(Prefix="render-output/1/")
+        put = objects["render-output/1/index.css"].put
+        put.assert_called_once()
+        kwargs = put.call_args[1]
+        self.assertEqual(gzip.decompress(kwargs["Body"]), b"body {}" * 100)
+        self.assertEqual(kwargs["ContentEncoding"], "gzip")
+        self.assertEqual(kwargs["ContentType"], "text/css")
+        self.assertEqual(kwargs["CacheControl"], "public, max-age=60")
+        self.assertEqual(kwargs["ACL"], "public-read")
+        objects["render-output/1/compressed.js"].put.assert_not_called()
+
+    def test_does_nothing_on_other_storages(self):
+        storage = mock.Mock()
+        self.assertEqual(storage_gzip_path(storage, "render-output/1", bool), 0)
+        storage.bucket.objects.filter.assert_not_called()